@@ -0,0 +1,273 @@
+import logging
+import os
+import re
+import time
+from collections import deque
+from application.data import get_connection, release_connection, create_cursor, close_cursor, commit, rollback, \
+    get_county_id, migrate_record, entry_failure, chains_per_commit, request_row, register_details_row, party_row, \
+    address_detail_row, address_row, party_name_row, register_row, migration_status_row, registered_counties, \
+    bankruptcy_expiry, landcharge_expiry, name_keys, APPLICATION_TYPES, AMENDMENT_TYPES
+from application.registration_numbers import get_registration_numbers
+
+
+# Batch writer for migrate_record: the rows for a whole batch of chains are built up in memory, with their
+# ids taken in blocks from the table sequences, then loaded with one multi-row INSERT per table and a single
+# UPDATE for the cancelled_by links. If the load fails the batch is rolled back and re-run through
+# migrate_record, so a bad entry is still reported (and skipped) on its own.
+
+# Parents before children, so the foreign keys hold at the end of every statement
+TABLES = ['request', 'register_details', 'party', 'address_detail', 'address', 'party_address', 'party_name',
+          'party_name_rel', 'party_trading', 'detl_county_rel', 'register', 'migration_status']
+ROWS_PER_STATEMENT = 1000
+
+allocator = None
+allocator_pid = None
+stats = {'batches': 0, 'fallbacks': 0, 'rows': 0, 'statements': 0}
+
+
+class IdAllocator(object):
+    # Ids are non-transactional, so any left over from one batch (or a rolled-back one) serve the next
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.free = {}
+
+    def next_id(self, cursor, table):
+        if len(self.free.get(table, [])) == 0:
+            cursor.execute("SELECT nextval(pg_get_serial_sequence(%(table)s, 'id')) AS id "
+                           "FROM generate_series(1, %(count)s)", {'table': table, 'count': self.block_size})
+            self.free[table] = deque(row['id'] for row in cursor.fetchall())
+        return self.free[table].popleft()
+
+
+def get_allocator(config):
+    # Per process, like the legacy adapter client: a forked worker must not reuse its parent's ids
+    global allocator, allocator_pid
+    if allocator is None or allocator_pid != os.getpid():
+        allocator = IdAllocator(config['MIGRATION_ID_BLOCK'])
+        allocator_pid = os.getpid()
+    return allocator
+
+
+class BulkBatch(object):
+    def __init__(self, config, cursor, ids):
+        self.config = config
+        self.cursor = cursor
+        self.ids = ids
+        self.rows = dict((table, []) for table in TABLES)
+        self.cancelled = []     # (details id, cancelled_by)
+        self.pending = []
+        self.pending_cancelled = []
+
+    def add(self, table, row):
+        row['id'] = self.ids.next_id(self.cursor, table)
+        self.pending.append((table, row))
+        return row['id']
+
+    def cancel(self, cancelled_by, details_id):
+        if details_id is not None:
+            self.pending_cancelled.append((details_id, cancelled_by))
+
+    def keep(self):
+        # The entry staged cleanly; its rows join the batch
+        for table, row in self.pending:
+            self.rows[table].append(row)
+        self.cancelled += self.pending_cancelled
+        self.discard()
+
+    def discard(self):
+        self.pending = []
+        self.pending_cancelled = []
+
+    def load(self):
+        for table in TABLES:
+            rows = self.rows[table]
+            for offset in range(0, len(rows), ROWS_PER_STATEMENT):
+                insert_rows(self.cursor, table, rows[offset:offset + ROWS_PER_STATEMENT])
+
+        # As update_previous_details: only the first cancellation of a record sticks
+        first = {}
+        for details_id, cancelled_by in self.cancelled:
+            if details_id not in first:
+                first[details_id] = cancelled_by
+        if len(first) > 0:
+            values = b', '.join(self.cursor.mogrify("(%s, %s)", item) for item in first.items())
+            self.cursor.execute(b"UPDATE register_details SET cancelled_by = v.canc FROM (VALUES " + values +
+                                b") AS v(id, canc) WHERE register_details.id = v.id "
+                                b"AND register_details.cancelled_by IS NULL")
+            stats['statements'] += 1
+
+
+def insert_rows(cursor, table, rows):
+    columns = list(rows[0].keys())
+    template = "({})".format(", ".join("%({})s".format(column) for column in columns))
+    values = b', '.join(cursor.mogrify(template, row) for row in rows)
+    cursor.execute("INSERT INTO {} ({}) VALUES ".format(table, ", ".join(columns)).encode('utf-8') + values)
+    stats['rows'] += len(rows)
+    stats['statements'] += 1
+
+
+def stage_registration(batch, expires_date, details_id, name_id, date, county_id, orig_reg_no):
+    reg_no = orig_reg_no
+    if reg_no is None:
+        reg_no = get_registration_numbers(batch.config).next_number(int(date[:4]))
+    else:
+        get_registration_numbers(batch.config).taken(int(date[:4]), int(reg_no))
+    return batch.add('register', register_row(reg_no, expires_date, details_id, name_id, date, county_id))
+
+
+def stage_details(batch, cursor, request_id, data, amends_id):
+    # As data.insert_details
+    register_details_id = batch.add('register_details', register_details_row(request_id, data, amends_id))
+    keys = name_keys(cursor, data)
+
+    debtor_id = None
+    debtor = None
+    names = []
+    for party in data['parties']:
+        party_id = batch.add('party', party_row(register_details_id, party))
+
+        if party['type'] == 'Debtor':
+            debtor_id = party_id
+            debtor = party
+
+        if 'addresses' in party:
+            for address in party['addresses']:
+                detail, address_string = address_detail_row(address)
+                detail_id = None
+                if detail is not None:
+                    detail_id = batch.add('address_detail', detail)
+                address['id'] = batch.add('address', address_row(address, address_string, detail_id))
+                batch.add('party_address', {"address_id": address['id'], "party_id": party_id})
+
+        for name in party['names']:
+            name_id = batch.add('party_name', party_name_row(cursor, name, next(keys)))
+            batch.add('party_name_rel', {"party_name_id": name_id, "party_id": party_id})
+            if party['type'] == 'Debtor':
+                names.append({'id': name_id, 'name': name})
+
+    if debtor_id is not None and 'trading_name' in debtor:
+        batch.add('party_trading', {"party_id": debtor_id, "trading_name": debtor['trading_name']})
+    return names, register_details_id
+
+
+def stage_record(batch, cursor, data, request_id, date, reveal, amends, orig_reg_no):
+    # As data.insert_record
+    names, details_id = stage_details(batch, cursor, request_id, data, amends)
+    name_id = names[0]['id'] if len(names) > 0 else None
+
+    if data['class_of_charge'] in ['PAB', 'WOB']:
+        reg_id = stage_registration(batch, bankruptcy_expiry(reveal, date), details_id, name_id, date, None,
+                                    orig_reg_no)
+    else:
+        county_ids = []
+        for county in registered_counties(data['particulars']['counties']):
+            county_id = get_county_id(cursor, county)
+            batch.add('detl_county_rel', {"county_id": county_id, "details_id": details_id})
+            county_ids.append(county_id)
+
+        if len(names) > 1:
+            raise RuntimeError("Invalid number of names: {}".format(len(names)))
+        reg_id = stage_registration(batch, landcharge_expiry(reveal, data['class_of_charge'], date), details_id,
+                                    name_id, date, county_ids[0] if len(county_ids) > 0 else None, orig_reg_no)
+    return details_id, reg_id
+
+
+def stage_migrated_record(batch, cursor, data):
+    # As data.insert_migrated_record
+    data["class_of_charge"] = re.sub(r"\(|\)", "", data["class_of_charge"])
+    date = data['registration']['date']
+    request_id = batch.add('request', request_row(data['applicant'], APPLICATION_TYPES[data['type']], date))
+
+    reveal = len(data['parties']) > 0
+    details_id, reg_id = stage_record(batch, cursor, data, request_id, date, reveal, None,
+                                      data['registration']['registration_no'])
+    batch.add('migration_status', migration_status_row(reg_id, data['migration_data']['unconverted_reg_no'], date,
+                                                       data['class_of_charge'], data['migration_data']))
+    return details_id, request_id
+
+
+def stage_migrated_cancellation(batch, cursor, data, index):
+    # As data.insert_migrated_cancellation
+    cancellation = data[index]
+    if len(data) == 1:
+        raise RuntimeError("Unexpected length of 1")
+
+    if index == 0:
+        raise RuntimeError("Unexpected cancellation at start of chain")
+
+    date = cancellation['registration']['date']
+    request_id = batch.add('request', request_row(cancellation['applicant'], 'Cancellation', date))
+    original_details_id = data[index - 1]['details_id']
+    details_id, reg_id = stage_record(batch, cursor, cancellation, request_id, date, False, original_details_id,
+                                      cancellation['registration']['registration_no'])
+    batch.cancel(details_id, original_details_id)
+    return details_id, request_id
+
+
+def stage_batch(batch, cursor, data, whole_chains=False):
+    # The same walk over the chains as data.migrate_record, with the same failure reporting. With
+    # whole_chains (any MIGRATION_COMMIT_UNIT but entry) a failed entry drops the rest of its chain too.
+    previous_id = None
+    failures = []
+    for register in data:
+        chain_previous_id = previous_id
+        for index, reg in enumerate(register):
+            try:
+                if reg['type'] == 'CN':
+                    details_id, request_id = stage_migrated_cancellation(batch, cursor, register, index)
+                else:
+                    if reg['type'] in AMENDMENT_TYPES and previous_id is not None:
+                        reg['previous'] = {
+                            'id': previous_id,
+                            'type': AMENDMENT_TYPES[reg['type']]
+                        }
+
+                    details_id, request_id = stage_migrated_record(batch, cursor, reg)
+                    if reg['type'] in ['AM', 'CN', 'CP', 'RN', 'RC']:
+                        batch.cancel(request_id, previous_id)
+
+                reg['details_id'] = details_id
+                previous_id = details_id
+                if not whole_chains:
+                    batch.keep()
+            except Exception as e:
+                failures.append(entry_failure(reg, e))
+                batch.discard()
+                if whole_chains:
+                    previous_id = chain_previous_id
+                    break
+        else:
+            if whole_chains:
+                batch.keep()
+    return failures
+
+
+def migrate_batch(config, data):
+    logging.debug("--- MIGRATE BATCH (%d chains) ---", len(data))
+    conn = get_connection(config)
+    cursor = create_cursor(conn)
+    try:
+        start = time.perf_counter()
+        batch = BulkBatch(config, cursor, get_allocator(config))
+        failures = stage_batch(batch, cursor, data, chains_per_commit(config) is not None)
+        batch.load()
+        commit(cursor)
+        stats['batches'] += 1
+        logging.debug("Bulk batch loaded in %f seconds", time.perf_counter() - start)
+        return failures
+    except Exception as e:
+        logging.warning("Bulk load failed (%s); retrying the batch row by row", str(e))
+        if not conn.closed:
+            rollback(cursor)
+    finally:
+        if not conn.closed:
+            close_cursor(cursor)
+        release_connection(conn)
+
+    # Start the walk again from scratch
+    stats['fallbacks'] += 1
+    for register in data:
+        for reg in register:
+            reg.pop('previous', None)
+            reg.pop('details_id', None)
+    return migrate_record(config, data)
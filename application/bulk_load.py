@@ -0,0 +1,191 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+import psycopg2.errorcodes
+from application.bulk_insert import TABLES
+
+
+# Bulk-load mode: the coordinator drops the secondary indexes and foreign keys on the tables the migration
+# writes to, the workers load without maintaining them, and the coordinator rebuilds them in parallel at the
+# end. Primary keys, unique indexes and check constraints stay, so nothing the rebuild depends on can be
+# broken by the load. The DDL is saved to a file (plain SQL, one statement per line) before anything is
+# dropped; while that file exists another bulk load refuses to start, and restore_indexes.py puts
+# back whatever a failed run left out.
+
+# Secondary indexes: neither unique nor backing any constraint
+INDEXES = ("SELECT format('DROP INDEX %%I', i.relname), pg_get_indexdef(i.oid) "
+           "FROM pg_index x "
+           "JOIN pg_class i ON i.oid = x.indexrelid "
+           "JOIN pg_class t ON t.oid = x.indrelid "
+           "JOIN pg_namespace n ON n.oid = t.relnamespace "
+           "WHERE n.nspname = current_schema() AND t.relname = ANY(%(tables)s) AND NOT x.indisunique "
+           "AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid) "
+           "AND NOT i.relname = ANY(%(keep)s) "
+           "ORDER BY t.relname, i.relname")
+
+FOREIGN_KEYS = ("SELECT format('ALTER TABLE %%I DROP CONSTRAINT %%I', t.relname, c.conname), "
+                "format('ALTER TABLE %%I ADD CONSTRAINT %%I %%s', t.relname, c.conname, pg_get_constraintdef(c.oid)) "
+                "FROM pg_constraint c "
+                "JOIN pg_class t ON t.oid = c.conrelid "
+                "JOIN pg_namespace n ON n.oid = t.relnamespace "
+                "WHERE n.nspname = current_schema() AND t.relname = ANY(%(tables)s) AND c.contype = 'f' "
+                "ORDER BY t.relname, c.conname")
+
+NOT_OWNED = ("SELECT t.relname FROM pg_class t "
+             "JOIN pg_namespace n ON n.oid = t.relnamespace "
+             "WHERE n.nspname = current_schema() AND t.relname = ANY(%(tables)s) "
+             "AND NOT pg_has_role(t.relowner, 'USAGE')")
+
+# Restoring a statement that a previous attempt already got through
+ALREADY_RESTORED = [psycopg2.errorcodes.DUPLICATE_TABLE, psycopg2.errorcodes.DUPLICATE_OBJECT]
+
+
+def ddl_path(config):
+    directory = config.get('MIGRATION_BULK_LOAD_DIR') or os.path.abspath(
+        os.path.join(os.path.dirname(__file__), os.pardir, 'output', 'bulk_load'))
+    return os.path.join(directory, 'pending.sql')
+
+
+def write_ddl(path, statements):
+    # Saved and read back before anything is dropped: if it can't be, the load doesn't start
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write("-- Dropped for a bulk load at {}; restore with restore_indexes.py\n".format(
+            time.strftime('%Y-%m-%d %H:%M:%S')))
+        for statement in statements:
+            f.write(statement + ";\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    if read_ddl(path) != statements:
+        raise RuntimeError("Bulk load: DDL saved to {} does not read back".format(path))
+
+
+def read_ddl(path):
+    with open(path) as f:
+        return [line.rstrip('\n').rstrip(';') for line in f if line.strip() != '' and not line.startswith('--')]
+
+
+class BulkLoad(object):
+    def __init__(self, config, path, statements):
+        self.config = config
+        self.path = path
+        self.statements = statements  # the CREATE INDEX/ADD CONSTRAINT statements to restore
+        self.timings = {}
+        self.load_started = time.perf_counter()
+
+    def finish(self):
+        self.timings['load'] = time.perf_counter() - self.load_started
+        logging.info("Bulk load: load took %f seconds", self.timings['load'])
+        return self.rebuild()
+
+    def rebuild(self):
+        # The indexes first: the foreign key checks can use them
+        for phase, prefix in [('restore_indexes', 'CREATE'), ('restore_constraints', 'ALTER')]:
+            start = time.perf_counter()
+            restore(self.config, self.path, [s for s in read_ddl(self.path) if s.startswith(prefix)])
+            self.timings[phase] = time.perf_counter() - start
+            logging.info("Bulk load: %s took %f seconds", phase, self.timings[phase])
+
+        os.remove(self.path)
+        logging.info("Bulk load: all %d indexes and constraints restored", len(self.statements))
+        return self.timings
+
+
+def begin_bulk_load(config):
+    path = ddl_path(config)
+    if os.path.exists(path):
+        raise RuntimeError("Bulk load: {} is still pending from an earlier run; run restore_indexes.py first".format(
+            path))
+
+    timings = {}
+    start = time.perf_counter()
+    conn = psycopg2.connect(config['PSQL_CONNECTION'])
+    try:
+        cursor = conn.cursor()
+        params = {'tables': TABLES, 'keep': config.get('MIGRATION_BULK_LOAD_KEEP', [])}
+        cursor.execute(NOT_OWNED, params)
+        not_owned = [row[0] for row in cursor.fetchall()]
+        if len(not_owned) > 0:
+            raise RuntimeError("Bulk load: can't rebuild indexes on tables not owned by this user: {}".format(
+                ", ".join(not_owned)))
+
+        cursor.execute(INDEXES, params)
+        indexes = cursor.fetchall()
+        cursor.execute(FOREIGN_KEYS, params)
+        constraints = cursor.fetchall()
+        for drop, create in indexes + constraints:
+            if create is None:
+                raise RuntimeError("Bulk load: no definition to restore for '{}'".format(drop))
+
+        statements = [create for drop, create in indexes + constraints]
+        write_ddl(path, statements)
+        timings['capture'] = time.perf_counter() - start
+
+        # The foreign keys go first: a plain index may be all that backs one
+        start = time.perf_counter()
+        for drop, create in constraints + indexes:
+            cursor.execute(drop)
+        conn.commit()
+        timings['drop'] = time.perf_counter() - start
+    except Exception:
+        conn.rollback()
+        if 'capture' in timings:
+            os.remove(path)  # nothing was dropped
+        raise
+    finally:
+        conn.close()
+
+    logging.info("Bulk load: dropped %d indexes and %d foreign keys (capture %f, drop %f seconds); DDL saved to %s",
+                 len(indexes), len(constraints), timings['capture'], timings['drop'], path)
+    load = BulkLoad(config, path, statements)
+    load.timings.update(timings)
+    return load
+
+
+def restore_statement(config, statement):
+    conn = psycopg2.connect(config['PSQL_CONNECTION'])
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        if config.get('MIGRATION_BULK_LOAD_WORK_MEM'):
+            cursor.execute("SET maintenance_work_mem = %(mem)s", {'mem': config['MIGRATION_BULK_LOAD_WORK_MEM']})
+        start = time.perf_counter()
+        try:
+            cursor.execute(statement)
+        except psycopg2.Error as e:
+            if e.pgcode not in ALREADY_RESTORED:
+                raise
+        logging.debug("Bulk load: %s (%f seconds)", statement, time.perf_counter() - start)
+    finally:
+        conn.close()
+
+
+def restore(config, path, statements):
+    # Runs the statements in parallel, one connection each. Any that fail stay in the file (with those
+    # yet to run) and the restore raises; the rest are not attempted again.
+    failed = []
+    with ThreadPoolExecutor(max_workers=config.get('MIGRATION_BULK_LOAD_RESTORE_WORKERS', 4)) as pool:
+        futures = [(statement, pool.submit(restore_statement, config, statement)) for statement in statements]
+        for statement, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error("Bulk load: failed to restore %s: %s", statement, str(e))
+                failed.append(statement)
+
+    if len(failed) > 0:
+        done = set(statements) - set(failed)
+        write_ddl(path, [s for s in read_ddl(path) if s not in done])
+        raise RuntimeError("Bulk load: {} of {} statements not restored; still pending in {}".format(
+            len(failed), len(statements), path))
+
+
+def restore_pending(config):
+    path = ddl_path(config)
+    if not os.path.exists(path):
+        logging.info("Bulk load: nothing pending in %s", path)
+        return
+    BulkLoad(config, path, read_ddl(path)).rebuild()
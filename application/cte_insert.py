@@ -0,0 +1,79 @@
+import application.data
+from application.data import AMENDMENT_TYPES
+from application.bulk_insert import stage_migrated_record, stage_migrated_cancellation
+
+
+# Writes each register entry as a single statement: a chain of data-modifying CTEs, one per row, where
+# each child row selects its parent's id from the CTE that inserted the parent. The rows and their
+# relationships come from the same stage_* functions as the bulk writer; CteStatement stands in for its
+# batch, handing back references to CTEs in place of preallocated ids.
+
+class Ref(object):
+    def __init__(self, alias):
+        self.alias = alias
+
+
+class CteStatement(object):
+    def __init__(self, config, cursor):
+        self.config = config
+        self.cursor = cursor
+        self.parts = []
+
+    def expression(self, value, refs):
+        if isinstance(value, Ref):
+            refs.add(value.alias)
+            return "{}.id".format(value.alias).encode('utf-8')
+        return self.cursor.mogrify("%s", (value,))
+
+    def from_clause(self, refs):
+        if len(refs) == 0:
+            return b""
+        return " FROM {}".format(", ".join(sorted(refs))).encode('utf-8')
+
+    def add(self, table, row):
+        alias = "{}_{}".format(table, len(self.parts))
+        refs = set()
+        values = b", ".join(self.expression(value, refs) for value in row.values())
+        self.parts.append("{} AS (INSERT INTO {} ({}) SELECT ".format(alias, table, ", ".join(row.keys())).encode(
+            'utf-8') + values + self.from_clause(refs) + b" RETURNING id)")
+        return Ref(alias)
+
+    def cancel(self, cancelled_by, details_id):
+        # As data.update_previous_details
+        if details_id is None:
+            return
+        refs = set()
+        canc = self.expression(cancelled_by, refs)
+        target = self.expression(details_id, refs)
+        self.parts.append("cancel_{} AS (UPDATE register_details SET cancelled_by = ".format(
+            len(self.parts)).encode('utf-8') + canc + self.from_clause(refs) +
+            b" WHERE register_details.id = " + target + b" AND register_details.cancelled_by IS NULL)")
+
+    def execute(self, *results):
+        # Runs the whole statement; returns the ids behind the given references
+        refs = set()
+        columns = b", ".join(self.expression(ref, refs) for ref in results)
+        self.cursor.execute(b"WITH " + b",\n".join(self.parts) + b"\nSELECT " + columns + self.from_clause(refs))
+        return tuple(self.cursor.fetchone())
+
+
+def migrate_entry(cursor, register, index, previous_id):
+    # As data.migrate_entry, in one round trip
+    reg = register[index]
+    statement = CteStatement(application.data.app_config, cursor)
+    if reg['type'] == 'CN':
+        details, request = stage_migrated_cancellation(statement, cursor, register, index)
+    else:
+        if reg['type'] in AMENDMENT_TYPES and previous_id is not None:
+            reg['previous'] = {
+                'id': previous_id,
+                'type': AMENDMENT_TYPES[reg['type']]
+            }
+
+        details, request = stage_migrated_record(statement, cursor, reg)
+        if reg['type'] in ['AM', 'CN', 'CP', 'RN', 'RC']:
+            statement.cancel(request, previous_id)
+
+    details_id, request_id = statement.execute(details, request)
+    reg['details_id'] = details_id
+    return details_id
@@ -5,32 +5,76 @@ import re
 import json
 import traceback
 import datetime
-from application.search_key import create_registration_key
+import io
+import os
+import time
+import weakref
+from application.search_key import registration_key, registration_keys
+from application.reference_data import reference_data
+from application.registration_numbers import get_registration_numbers, close_registration_numbers
+from application.records import json_default
 
 
 app_config = None
 
 
-county_lookup = {}
-    
-
 def get_county_id(cursor, county):
-    # Minor optimization: ~2% of the SQL insert time reduced
-    global county_lookup
-    if county in county_lookup:
-        return county_lookup[county]
+    return reference_data(cursor).county_id(county)
+
+
+# Server-side prepared statements (PSQL_PREPARED_STATEMENTS): each statement is PREPAREd the first time
+# it is used on a database session and EXECUTEd from then on. Sessions are told apart by connection object
+# (a backend pid can be reused by the next session), and a connection's names are dropped when it is
+# replaced, so a replacement connection prepares its own.
+statement_names = {}    # (table, columns) -> statement name
+prepared = weakref.WeakKeyDictionary()  # connection -> names prepared on its session
+statement_stats = {}    # statement name -> executions
+
+
+def use_prepared_statements():
+    return app_config is not None and app_config.get('PSQL_PREPARED_STATEMENTS', False)
+
+
+def execute_prepared(cursor, name, sql, params):
+    # sql takes $1..$n, in the order of params
+    names = prepared.setdefault(cursor.connection, set())
+    if name not in names:
+        cursor.execute("PREPARE {} AS {}".format(name, sql))
+        names.add(name)
+    cursor.execute("EXECUTE {} ({})".format(name, ", ".join(["%s"] * len(params))), params)
+    statement_stats[name] = statement_stats.get(name, 0) + 1
+
+
+def insert_row(cursor, table, row):
+    # row is keyed by column name; the same row dicts feed the multi-row statements in bulk_insert.py
+    columns = list(row.keys())
+    if use_prepared_statements():
+        key = (table, tuple(columns))
+        if key not in statement_names:
+            statement_names[key] = "lcm_insert_{}_{}".format(table, len(statement_names))
+        execute_prepared(cursor, statement_names[key], "INSERT INTO {} ({}) VALUES ({}) RETURNING id".format(
+            table, ", ".join(columns), ", ".join("${}".format(n + 1) for n in range(len(columns)))),
+            [row[column] for column in columns])
+    else:
+        cursor.execute("INSERT INTO {} ({}) VALUES ({}) RETURNING id".format(
+            table, ", ".join(columns), ", ".join("%({})s".format(column) for column in columns)), row)
+    return cursor.fetchone()[0]
+
+
+def copy_value(value):
+    # COPY text format
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
 
-    cursor.execute("SELECT id FROM county WHERE UPPER(name) = %(county)s",
-                   {
-                       "county": county.strip().upper()
-                   })
-    rows = cursor.fetchall()
-    if len(rows) == 0:
-        raise RuntimeError("Invalid county: '{}'".format(county))
-        
-    id = rows[0]['id']
-    county_lookup[county] = id
-    return id
+
+def copy_rows(cursor, table, columns, rows):
+    # Loads rows (tuples in column order) with a single COPY
+    data = io.StringIO()
+    for row in rows:
+        data.write("\t".join(copy_value(value) for value in row) + "\n")
+    data.seek(0)
+    cursor.copy_expert("COPY {} ({}) FROM STDIN".format(table, ", ".join(columns)), data)
 
 
 def calc_five_year_expiry(date):
@@ -49,22 +93,10 @@ def insert_registration(cursor, expires_date, details_id, name_id, date, county_
     if orig_reg_no is None:
         # Get the next registration number
         year = date[:4]  # date is a string
-        # Optimised: indexing register saves ~1% of SQL insert time
-        cursor.execute('select MAX(registration_no) + 1 AS reg '
-                       'from register  '
-                       'where date >=%(start)s AND date < %(end)s',
-                       {
-                           'start': "{}-01-01".format(year),
-                           'end': "{}-01-01".format(int(year) + 1)
-                       })
-
-        rows = cursor.fetchall()
-        if rows[0]['reg'] is None:
-            reg_no = 1000
-        else:
-            reg_no = int(rows[0]['reg'])
+        reg_no = get_registration_numbers(app_config).next_number(int(year))
     else:
         reg_no = orig_reg_no
+        get_registration_numbers(app_config).taken(int(date[:4]), int(reg_no))
 
     # Check if registration_no and date already exist, if they do then increase sequence number
     # TODO: consider if the solution here is actually more robust...
@@ -82,29 +114,42 @@ def insert_registration(cursor, expires_date, details_id, name_id, date, county_
         # version = int(rows[0]['seq_no'])
 
     # Cap it all off with the actual legal "one registration per name":
-    cursor.execute("INSERT INTO register (registration_no, debtor_reg_name_id, details_id, date, county_id, expired_on, " +
-                   "reg_sequence_no) " +
-                   "VALUES( %(regno)s, %(debtor)s, %(details)s, %(date)s, %(county)s, %(exp)s, %(seq)s ) RETURNING id",
-                   {
-                       "regno": reg_no,
-                       "debtor": name_id,
-                       "details": details_id,
-                       'date': date,
-                       'county': county_id,
-                       'exp': expires_date,
-                       'seq': version
-                   })
-    reg_id = cursor.fetchone()[0]
+    reg_id = insert_row(cursor, 'register', register_row(reg_no, expires_date, details_id, name_id, date, county_id,
+                                                         version))
     return reg_no, reg_id
 
 
-def insert_bankruptcy_regn(cursor, reveal, details_id, names, date, orig_reg_no):
-    #logging.debug('Inserting banks reg')
+def register_row(reg_no, expires_date, details_id, name_id, date, county_id, version=1):
+    return {
+        "registration_no": reg_no,
+        "debtor_reg_name_id": name_id,
+        "details_id": details_id,
+        'date': date,
+        'county_id': county_id,
+        'expired_on': expires_date,
+        'reg_sequence_no': version
+    }
+
 
+def bankruptcy_expiry(reveal, date):
+    if reveal is False:
+        return datetime.datetime.now().strftime('%Y-%m-%d')
+    return calc_five_year_expiry(date)
+
+
+def landcharge_expiry(reveal, class_of_charge, date):
+    ex_date = None
     if reveal is False:
         ex_date = datetime.datetime.now().strftime('%Y-%m-%d')
-    else:
+
+    if reveal is True and class_of_charge in ['PA', 'WO', 'DA']:
         ex_date = calc_five_year_expiry(date)
+    return ex_date
+
+
+def insert_bankruptcy_regn(cursor, reveal, details_id, names, date, orig_reg_no):
+    #logging.debug('Inserting banks reg')
+    ex_date = bankruptcy_expiry(reveal, date)
 
     reg_nos = []
     if len(names) == 0:  # Migration case only...
@@ -147,12 +192,7 @@ def insert_landcharge_regn(cursor, reveal, class_of_charge, details_id, names, c
     if len(names) > 1:
         raise RuntimeError("Invalid number of names: {}".format(len(names)))
 
-    ex_date = None
-    if reveal is False:
-        ex_date = datetime.datetime.now().strftime('%Y-%m-%d')
-
-    if reveal is True and class_of_charge in ['PA', 'WO', 'DA']:
-        ex_date = calc_five_year_expiry(date)
+    ex_date = landcharge_expiry(reveal, class_of_charge, date)
 
     reg_nos = []
     if len(county_ids) == 0:  # can occur on migration or a registration against NO COUNTY
@@ -190,31 +230,28 @@ def insert_landcharge_regn(cursor, reveal, class_of_charge, details_id, names, c
 def insert_lc_county(cursor, register_details_id, county):
     #logging.debug('Inserting: ' + county)
     county_id = get_county_id(cursor, county)
-    cursor.execute("INSERT INTO detl_county_rel (county_id, details_id) " +
-                   "VALUES( %(county_id)s, %(details_id)s ) RETURNING id",
-                   {
-                       "county_id": county_id, "details_id": register_details_id
-                   })
-    rows = cursor.fetchall()
-    if len(rows) == 0:
-        raise RuntimeError("Invalid county ID: {}".format(county))
-
-    return rows[0]['id'], county_id
+    return insert_row(cursor, 'detl_county_rel', {"county_id": county_id, "details_id": register_details_id}), county_id
 
 
-def insert_counties(cursor, details_id, counties):
+def registered_counties(counties):
     if len(counties) == 1 and (counties[0].upper() == 'NO COUNTY' or counties[0] == ""):
         return []
+    return [county for county in counties if county != '']
+
 
+def insert_counties(cursor, details_id, counties):
     ids = []
-    for county in counties:
-        if county != '':
-            county_detl_id, county_id = insert_lc_county(cursor, details_id, county)
-            ids.append({'id': county_id, 'name': county})
+    for county in registered_counties(counties):
+        county_detl_id, county_id = insert_lc_county(cursor, details_id, county)
+        ids.append({'id': county_id, 'name': county})
     return ids
 
 
 def insert_register_details(cursor, request_id, data, date, amends):
+    return insert_row(cursor, 'register_details', register_details_row(request_id, data, amends))
+
+
+def register_details_row(request_id, data, amends):
     additional_info = data['additional_information'] if 'additional_information' in data else None
     #logging.debug(data)
     priority_notice = None
@@ -307,25 +344,22 @@ def insert_register_details(cursor, request_id, data, date, amends):
     # amends
     # amend_type
 
-    cursor.execute("INSERT INTO register_details (request_id, class_of_charge, legal_body_ref, "
-                   "amends, district, short_description, amendment_type, priority_notice_no, "
-                   "priority_notice_ind, prio_notice_expires, "
-                   "amend_info_type, amend_info_details, amend_info_details_orig, additional_info ) "
-                   "VALUES (%(rid)s, %(coc)s, %(legal_ref)s, %(amends)s, %(dist)s, %(sdesc)s, %(atype)s, "
-                   "%(pno)s, %(pind)s, %(pnx)s, %(amd_type)s, "
-                   "%(amd_detl_c)s, %(amd_detl_o)s, %(addli)s ) "
-                   "RETURNING id", {
-                       "rid": request_id, "coc": data['class_of_charge'],
-                       "legal_ref": legal_ref, "amends": amends, "dist": district,
-                       "sdesc": short_description, "atype": amend_type,
-                       "pno": priority_notice, 'pind': is_priority_notice, "pnx": prio_notc_expires,
-                       "amd_type": amend_info_type, "amd_detl_c": amend_info_details_current,
-                       "amd_detl_o": amend_info_details_orig, "addli": additional_info
-                   })
-    return cursor.fetchone()[0]
+    return {
+        "request_id": request_id, "class_of_charge": data['class_of_charge'],
+        "legal_body_ref": legal_ref, "amends": amends, "district": district,
+        "short_description": short_description, "amendment_type": amend_type,
+        "priority_notice_no": priority_notice, 'priority_notice_ind': is_priority_notice,
+        "prio_notice_expires": prio_notc_expires, "amend_info_type": amend_info_type,
+        "amend_info_details": amend_info_details_current, "amend_info_details_orig": amend_info_details_orig,
+        "additional_info": additional_info
+    }
 
 
 def insert_party(cursor, details_id, party):
+    return insert_row(cursor, 'party', party_row(details_id, party))
+
+
+def party_row(details_id, party):
     occupation = None
     date_of_birth = None
     residence_withheld = False
@@ -340,16 +374,29 @@ def insert_party(cursor, details_id, party):
         date_of_birth = None
         residence_withheld = party['residence_withheld']
 
-    cursor.execute("INSERT INTO party (register_detl_id, party_type, occupation, date_of_birth, residence_withheld) " +
-                   "VALUES( %(reg_id)s, %(type)s, %(occupation)s, %(dob)s, %(rw)s ) RETURNING id",
-                   {
-                       "reg_id": details_id, "type": party['type'], "occupation": occupation,
-                       "dob": date_of_birth, "rw": residence_withheld
-                   })
-    return cursor.fetchone()[0]
+    return {
+        "register_detl_id": details_id, "party_type": party['type'], "occupation": occupation,
+        "date_of_birth": date_of_birth, "residence_withheld": residence_withheld
+    }
 
 
 def insert_address(cursor, address, party_id):
+    detail, address_string = address_detail_row(address)
+    detail_id = None
+    if detail is not None:
+        detail_id = insert_row(cursor, 'address_detail', detail)
+
+    address['id'] = insert_row(cursor, 'address', address_row(address, address_string, detail_id))
+    insert_row(cursor, 'party_address', {"address_id": address['id'], "party_id": party_id})
+    return address['id']
+
+
+def address_row(address, address_string, detail_id):
+    return {"address_type": address['type'], "address_string": address_string, "detail_id": detail_id}
+
+
+def address_detail_row(address):
+    # Returns (address_detail row or None, address string)
     if 'address_lines' in address and len(address['address_lines']) > 0:
         lines = address['address_lines'][0:5]   # First five lines
         remaining = ", ".join(address['address_lines'][5:])
@@ -361,42 +408,33 @@ def insert_address(cursor, address, party_id):
 
         county = address['county']
         postcode = address['postcode']       # Postcode in the last
-        cursor.execute("INSERT INTO address_detail ( line_1, line_2, line_3, line_4, line_5, line_6 ,county, postcode) "
-                       "VALUES( %(line1)s, %(line2)s, %(line3)s, %(line4)s, %(line5)s, %(line6)s, %(county)s, "
-                       "%(postcode)s ) RETURNING id",
-                       {
-                           "line1": lines[0], "line2": lines[1], "line3": lines[2],
-                           "line4": lines[3], "line5": lines[4], "line6": lines[5],
-                           "county": county, "postcode": postcode,
-                       })
-        detail_id = cursor.fetchone()[0]
+        detail = {
+            "line_1": lines[0], "line_2": lines[1], "line_3": lines[2],
+            "line_4": lines[3], "line_5": lines[4], "line_6": lines[5],
+            "county": county, "postcode": postcode,
+        }
         address_string = "{}, {}, {}".format(", ".join(address['address_lines']), address["county"],
                                              address["postcode"])
     elif 'address_string' in address:
         address_string = address['address_string']
-        detail_id = None
+        detail = None
     else:
         raise Exception('Invalid address object')
+    return detail, address_string
 
-    cursor.execute("INSERT INTO address (address_type, address_string, detail_id) " +
-                   "VALUES( %(type)s, %(string)s, %(detail)s ) " +
-                   "RETURNING id",
-                   {
-                       "type": address['type'],
-                       "string": address_string,
-                       "detail": detail_id
-                   })
-    address['id'] = cursor.fetchone()[0]
 
-    cursor.execute("INSERT INTO party_address (address_id, party_id) " +
-                   "VALUES ( %(address)s, %(party)s ) RETURNING id",
-                   {
-                       "address": address['id'], "party": party_id
-                   })
-    return address['id']
+def insert_party_name(cursor, party_id, name, name_key=None):
+    name_id = insert_row(cursor, 'party_name', party_name_row(cursor, name, name_key))
+    return_data = {
+        'id': name_id,
+        'name': name
+    }
+
+    insert_row(cursor, 'party_name_rel', {"party_name_id": name_id, "party_id": party_id})
+    return return_data
 
 
-def insert_party_name(cursor, party_id, name):
+def party_name_row(cursor, name, name_key=None):
     name_string = None
     forename = None
     middle_names = None
@@ -432,40 +470,27 @@ def insert_party_name(cursor, party_id, name):
     #     searchable_string = get_searchable_string(name_string, company, local_auth, local_auth_area, other)
 
     # get_searchable_string(name_string=None, company=None, local_auth=None, local_auth_area=None, other=None):
-    name_key = create_registration_key(cursor, name)
-    cursor.execute("INSERT INTO party_name ( party_name, forename, middle_names, surname, alias_name, "
-                   "complex_number, complex_name, name_type_ind, company_name, local_authority_name, "
-                   "local_authority_area, other_name, searchable_string, subtype ) "
-                   "VALUES ( %(name)s, %(forename)s, %(midnames)s, %(surname)s, %(alias)s, "
-                   "%(comp_num)s, %(comp_name)s, %(type)s, %(company)s, "
-                   "%(loc_auth)s, %(loc_auth_area)s, %(other)s, %(search_name)s, %(subtype)s ) "
-                   "RETURNING id", {
-                       "name": name_string, "forename": forename, "midnames": middle_names,
-                       "surname": surname, "alias": is_alias, "comp_num": complex_number, "comp_name": complex_name,
-                       "type": name['type'], "company": company, "loc_auth": local_auth,
-                       "loc_auth_area": local_auth_area, "other": other, "search_name": name_key['key'],
-                       'subtype': name_key['indicator']
-                   })
-
-    name_id = cursor.fetchone()[0]
-    return_data = {
-        'id': name_id,
-        'name': name
+    if name_key is None:
+        name_key = registration_key(cursor, name)
+    return {
+        "party_name": name_string, "forename": forename, "middle_names": middle_names,
+        "surname": surname, "alias_name": is_alias, "complex_number": complex_number, "complex_name": complex_name,
+        "name_type_ind": name['type'], "company_name": company, "local_authority_name": local_auth,
+        "local_authority_area": local_auth_area, "other_name": other, "searchable_string": name_key['key'],
+        'subtype': name_key['indicator']
     }
 
-    cursor.execute("INSERT INTO party_name_rel (party_name_id, party_id) " +
-                   "VALUES( %(name)s, %(party)s ) RETURNING id",
-                   {
-                       "name": name_id, "party": party_id
-                   })
 
-    return return_data
+def name_keys(cursor, data):
+    # The keys for every name on a registration, from one registration_keys call, in party order
+    return iter(registration_keys(cursor, [name for party in data['parties'] for name in party['names']]))
 
 
 def insert_details(cursor, request_id, data, date, amends_id):
     #logging.debug("Insert details")
     # register details
     register_details_id = insert_register_details(cursor, request_id, data, date, amends_id)
+    keys = name_keys(cursor, data)
 
     debtor_id = None
     debtor = None
@@ -482,7 +507,7 @@ def insert_details(cursor, request_id, data, date, amends_id):
                 insert_address(cursor, address, party_id)
 
         for name in party['names']:
-            name_info = insert_party_name(cursor, party_id, name)
+            name_info = insert_party_name(cursor, party_id, name, next(keys))
             if party['type'] == 'Debtor':
                 names.append(name_info)
 
@@ -490,9 +515,7 @@ def insert_details(cursor, request_id, data, date, amends_id):
     if debtor_id is not None:
         if 'trading_name' in debtor:
             trading_name = debtor['trading_name']
-            cursor.execute("INSERT INTO party_trading (party_id, trading_name) " +
-                           "VALUES ( %(party)s, %(trading)s ) RETURNING id",
-                           {"party": debtor_id, "trading": trading_name})
+            insert_row(cursor, 'party_trading', {"party_id": debtor_id, "trading_name": trading_name})
     return names, register_details_id
 
 
@@ -518,47 +541,55 @@ def insert_request(cursor, applicant, application_type, date, original_data=None
     # else:
     #     ins_request_id = None  # TODO: consider when ins data should be added...
 
-    cursor.execute("INSERT INTO request (key_number, application_type, application_reference, application_date, " +
-                   "ins_request_id, customer_name, customer_address) " +
-                   "VALUES ( %(key)s, %(app_type)s, %(app_ref)s, %(app_date)s, %(ins_id)s, " +
-                   "%(cust_name)s, %(cust_addr)s ) RETURNING id",
-                   {
-                       "key": applicant['key_number'], "app_type": application_type, "app_ref": applicant['reference'],
-                       "app_date": date, "ins_id": None, "cust_name": applicant['name'],
-                       "cust_addr": applicant['address']
-                   })
-    return cursor.fetchone()[0]
+    return insert_row(cursor, 'request', request_row(applicant, application_type, date))
+
+
+def request_row(applicant, application_type, date):
+    return {
+        "key_number": applicant['key_number'], "application_type": application_type,
+        "application_reference": applicant['reference'], "application_date": date, "ins_request_id": None,
+        "customer_name": applicant['name'], "customer_address": applicant['address']
+    }
 
 
 def insert_migration_status(cursor, register_id, registration_number, registration_date, class_of_charge,
                             additional_data):
-    cursor.execute("INSERT INTO migration_status (register_id, original_regn_no, date, class_of_charge, "
-                   "migration_complete, extra_data ) "
-                   "VALUES( %(register_id)s, %(reg_no)s, %(date)s, %(class)s, True, %(extra)s ) RETURNING id",
-                   {
-                       "register_id": register_id,
-                       "reg_no": registration_number,
-                       "date": registration_date,
-                       "class": class_of_charge,
-                       "extra": json.dumps(additional_data)
-                   })
-    return cursor.fetchone()[0]
+    return insert_row(cursor, 'migration_status', migration_status_row(register_id, registration_number,
+                                                                       registration_date, class_of_charge,
+                                                                       additional_data))
+
+
+def migration_status_row(register_id, registration_number, registration_date, class_of_charge, additional_data):
+    return {
+        "register_id": register_id,
+        "original_regn_no": registration_number,
+        "date": registration_date,
+        "class_of_charge": class_of_charge,
+        "migration_complete": True,
+        "extra_data": json.dumps(additional_data, default=json_default)
+    }
+
+
+# TODO: using registration date as request date. Valid? Always?
+APPLICATION_TYPES = {
+    'NR': 'New registration',
+    'AM': 'Amendment',
+    'CP': 'Part cancellation',
+    'CN': 'Cancellation',
+    'RN': 'Renewal',
+    'PN': 'Priority notice',
+    'RC': 'Rectification'
+}
+
+# Entry types that amend their predecessor in the chain
+AMENDMENT_TYPES = {
+    'AM': 'Amendment', 'RN': 'Renewal', 'RC': 'Rectification', 'CP': 'Part Cancellation'
+}
 
 
 def insert_migrated_record(cursor, data):
     data["class_of_charge"] = re.sub(r"\(|\)", "", data["class_of_charge"])
-
-    # TODO: using registration date as request date. Valid? Always?
-    types = {
-        'NR': 'New registration',
-        'AM': 'Amendment',
-        'CP': 'Part cancellation',
-        'CN': 'Cancellation',
-        'RN': 'Renewal',
-        'PN': 'Priority notice',
-        'RC': 'Rectification'
-    }
-    type_str = types[data['type']]
+    type_str = APPLICATION_TYPES[data['type']]
 
     request_id = insert_request(cursor, data['applicant'], type_str, data['registration']['date'], None)
 
@@ -601,8 +632,55 @@ def get_register_details_id(cursor, reg_no, date):
         return rows[0]['details_id']
 
 
+def delete_migrated(cursor, register_ids):
+    # Undoes migrate_record for the chains behind the given register rows: everything hanging off their
+    # register details, plus the cancellations (which have no migration_status of their own) amending them
+    cursor.execute("SELECT DISTINCT details_id FROM register WHERE id = ANY(%(ids)s)", {'ids': register_ids})
+    details = [row[0] for row in cursor.fetchall()]
+    found = details
+    while len(found) > 0:
+        cursor.execute("SELECT id FROM register_details WHERE amends = ANY(%(found)s) AND NOT id = ANY(%(ids)s)",
+                       {'found': found, 'ids': details})
+        found = [row[0] for row in cursor.fetchall()]
+        details += found
+
+    def select(sql, ids):
+        cursor.execute(sql, {'ids': ids})
+        return [row[0] for row in cursor.fetchall() if row[0] is not None]
+
+    parties = select("SELECT id FROM party WHERE register_detl_id = ANY(%(ids)s)", details)
+    names = select("SELECT party_name_id FROM party_name_rel WHERE party_id = ANY(%(ids)s)", parties)
+    addresses = select("SELECT address_id FROM party_address WHERE party_id = ANY(%(ids)s)", parties)
+    address_details = select("SELECT detail_id FROM address WHERE id = ANY(%(ids)s)", addresses)
+    requests = select("SELECT request_id FROM register_details WHERE id = ANY(%(ids)s)", details)
+
+    # Children before parents
+    for sql, ids in [
+        ("DELETE FROM migration_status WHERE register_id IN (SELECT id FROM register WHERE details_id = ANY(%(ids)s))",
+         details),
+        ("DELETE FROM register WHERE details_id = ANY(%(ids)s)", details),
+        ("DELETE FROM detl_county_rel WHERE details_id = ANY(%(ids)s)", details),
+        ("DELETE FROM party_trading WHERE party_id = ANY(%(ids)s)", parties),
+        ("DELETE FROM party_name_rel WHERE party_id = ANY(%(ids)s)", parties),
+        ("DELETE FROM party_name WHERE id = ANY(%(ids)s)", names),
+        ("DELETE FROM party_address WHERE party_id = ANY(%(ids)s)", parties),
+        ("DELETE FROM address WHERE id = ANY(%(ids)s)", addresses),
+        ("DELETE FROM address_detail WHERE id = ANY(%(ids)s)", address_details),
+        ("DELETE FROM party WHERE id = ANY(%(ids)s)", parties),
+        ("UPDATE register_details SET amends = NULL, cancelled_by = NULL WHERE id = ANY(%(ids)s)", details),
+        ("DELETE FROM register_details WHERE id = ANY(%(ids)s)", details),
+        ("DELETE FROM request WHERE id = ANY(%(ids)s)", requests)
+    ]:
+        cursor.execute(sql, {'ids': ids})
+    return len(details)
+
+
 def update_previous_details(cursor, request_id, original_detl_id):
-    pass
+    if use_prepared_statements():
+        execute_prepared(cursor, "lcm_update_cancelled_by", "UPDATE register_details SET cancelled_by = $1 "
+                         "WHERE id = $2 AND cancelled_by IS NULL", [request_id, original_detl_id])
+        return
+
     cursor.execute("UPDATE register_details SET cancelled_by = %(canc)s WHERE " +
                    "id = %(id)s AND cancelled_by IS NULL",
                    {
@@ -662,6 +740,85 @@ def connect_to_psql(conn_str=None):
 
 def disconnect_from_psql(connection):
     connection.close()
+
+
+# Each worker process keeps one warm connection for the whole run, rather than connecting per batch. It is
+# checked with a trivial query if it has sat idle for a while, and replaced if that fails or if psycopg2
+# has already seen it drop.
+shared_connection = None
+shared_connection_pid = None
+shared_connection_used = 0
+connection_stats = {'connects': 0, 'reconnects': 0, 'checks': 0}
+
+
+def connection_alive(connection, config):
+    if connection.closed:
+        return False
+    if time.time() - shared_connection_used < config.get('PSQL_HEALTH_CHECK_INTERVAL', 30):
+        return True
+
+    connection_stats['checks'] += 1
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+        connection.rollback()
+        return True
+    except psycopg2.Error as e:
+        logging.warning('Database connection failed its health check: %s', str(e))
+        return False
+
+
+def get_connection(config):
+    global shared_connection, shared_connection_pid, shared_connection_used
+    if shared_connection is not None and shared_connection_pid != os.getpid():
+        # Inherited from the parent over fork(); the socket is the parent's to close
+        prepared.pop(shared_connection, None)
+        shared_connection = None
+
+    if shared_connection is not None and not connection_alive(shared_connection, config):
+        connection_stats['reconnects'] += 1
+        close_connection()
+
+    if shared_connection is None:
+        shared_connection = connect_to_psql(config['PSQL_CONNECTION'])
+        shared_connection_pid = os.getpid()
+        connection_stats['connects'] += 1
+
+    shared_connection_used = time.time()
+    return shared_connection
+
+
+def warm_reference_data(config):
+    # Load the county tables before the first batch, so that writing never has to query them
+    conn = get_connection(config)
+    cursor = create_cursor(conn)
+    try:
+        reference_data(cursor)
+        commit(cursor)
+    finally:
+        close_cursor(cursor)
+        release_connection(conn)
+
+
+def release_connection(connection):
+    # Stays open for the next batch; idle time counts from here
+    global shared_connection_used
+    if connection is shared_connection:
+        shared_connection_used = time.time()
+
+
+def close_connection():
+    global shared_connection
+    close_registration_numbers()
+    if shared_connection is not None:
+        prepared.pop(shared_connection, None)
+    if shared_connection is not None and shared_connection_pid == os.getpid():
+        try:
+            disconnect_from_psql(shared_connection)
+        except psycopg2.Error:
+            pass
+    shared_connection = None
     
     
 def create_cursor(connection):
@@ -680,80 +837,163 @@ def rollback(cursor):
     cursor.connection.rollback()
 
 
-def migrate_record(config, data):
-    logging.debug("--- MIGRATE RECORD ---")
-    logging.debug(data)
+def migrate_entry(cursor, register, index, previous_id):
+    # Writes register[index]; returns its details id, the next entry's previous_id
+    reg = register[index]
+    if reg['type'] == 'CN':
+        details_id, request_id = insert_migrated_cancellation(cursor, register, index)
+        reg['details_id'] = details_id
+    else:
+        if reg['type'] in AMENDMENT_TYPES and previous_id is not None:
+            reg['previous'] = {
+                'id': previous_id,
+                'type': AMENDMENT_TYPES[reg['type']]
+            }
 
+        details_id, request_id = insert_migrated_record(cursor, reg)
 
-    global app_config
-    app_config = config
+        reg['details_id'] = details_id
+
+        if reg['type'] in ['AM', 'CN', 'CP', 'RN', 'RC']:
+            if details_id is not None:
+                update_previous_details(cursor, request_id, previous_id)
+
+            else:
+                raise RuntimeError("No details ID retrieved: {} {}".format(
+                    reg['registration']['registration_no'],
+                    reg['registration']['date']))
 
+            # # TODO repeating code is bad.
+
+    return details_id
+
+
+def entry_failure(reg, e):
+    logging.error(str(e))
+    logging.error("Failed on {} {}".format(reg['registration']['registration_no'], reg['registration']['date']))
+    # logging.error(data)
+    call_stack = traceback.format_exc()
+
+    lines = call_stack.split("\n")
+    for line in lines:
+        logging.error(line)
+
+    return {
+        'number': reg['registration']['registration_no'],
+        'date': reg['registration']['date'],
+        'message': str(e)
+    }
+
+
+def chains_per_commit(config):
+    # MIGRATION_COMMIT_UNIT: 'entry' (None here), 'chain' (1), 'batch' (0: once, at the end) or N chains
+    unit = str(config.get('MIGRATION_COMMIT_UNIT', 'entry')).lower()
+    if unit == 'entry':
+        return None
+    elif unit == 'chain':
+        return 1
+    elif unit == 'batch':
+        return 0
+    return int(unit)
+
+
+def migrate_entries(conn, data, write_entry=migrate_entry):
+    # Every entry commits on its own; a failed entry leaves the rest of its chain in place
     previous_id = None
-    first_record = data[0]
     failures = []
-    conn = None
-    types = {
-        'AM': 'Amendment', 'RN': 'Renewal', 'RC': 'Rectification', 'CP': 'Part Cancellation'
-    }
-    
-    try:
-        conn = connect_to_psql()
+    for register in data:
+        for index, reg in enumerate(register):
+            cursor = create_cursor(conn)
+            try:
+                previous_id = write_entry(cursor, register, index, previous_id)
+                #complete(cursor)
+                commit(cursor)
+            except Exception as e:
+                failures.append(entry_failure(reg, e))
+                rollback(cursor)
+            finally:
+                close_cursor(cursor)
+    return failures
+
 
+def migrate_chains(conn, data, every, write_entry=migrate_entry):
+    # Chains commit together, 'every' at a time. A chain is all-or-nothing: when one of its entries fails,
+    # the chain is rolled back to its savepoint (or, committing chain by chain, the transaction is rolled
+    # back) and the other chains in the transaction are unaffected.
+    previous_id = None
+    failures = []
+    uncommitted = []
+    use_savepoints = every != 1
+    cursor = create_cursor(conn)
+    try:
         for register in data:
-            
+            chain_previous_id = previous_id
+            if use_savepoints:
+                cursor.execute("SAVEPOINT chain")
+
             for index, reg in enumerate(register):
-                cursor = create_cursor(conn)
-            
                 try:
-                    if reg['type'] == 'CN':
-                        details_id, request_id = insert_migrated_cancellation(cursor, register, index)
-                        reg['details_id'] = details_id
+                    previous_id = write_entry(cursor, register, index, previous_id)
+                except Exception as e:
+                    failures.append(entry_failure(reg, e))
+                    if use_savepoints:
+                        cursor.execute("ROLLBACK TO SAVEPOINT chain")
                     else:
-                        if reg['type'] in types and previous_id is not None:
-                            reg['previous'] = {
-                                'id': previous_id,
-                                'type': types[reg['type']]
-                            }
+                        rollback(cursor)
+                    logging.error("Rolled back the %d entries of chain %s %s", len(register),
+                                  register[0]['registration']['registration_no'], register[0]['registration']['date'])
+                    previous_id = chain_previous_id
+                    break
+            else:
+                if use_savepoints:
+                    cursor.execute("RELEASE SAVEPOINT chain")
+                uncommitted.append(register)
 
-                        details_id, request_id = insert_migrated_record(cursor, reg)
+            if every > 0 and len(uncommitted) >= every:
+                failures += commit_chains(cursor, uncommitted)
+                uncommitted = []
 
-                        reg['details_id'] = details_id
+        failures += commit_chains(cursor, uncommitted)
+    finally:
+        close_cursor(cursor)
+    return failures
 
-                        if reg['type'] in ['AM', 'CN', 'CP', 'RN', 'RC']:
-                            if details_id is not None:
-                                update_previous_details(cursor, request_id, previous_id)
 
-                            else:
-                                raise RuntimeError("No details ID retrieved: {} {}".format(
-                                    reg['registration']['registration_no'],
-                                    reg['registration']['date']))
+def commit_chains(cursor, chains):
+    try:
+        commit(cursor)
+        return []
+    except psycopg2.Error as e:
+        # Nothing since the last commit survived: report every entry of every chain in it
+        logging.error("Commit of %d chains failed: %s", len(chains), str(e))
+        if not cursor.connection.closed:
+            rollback(cursor)
+        return [{
+            'number': reg['registration']['registration_no'],
+            'date': reg['registration']['date'],
+            'message': str(e)
+        } for chain in chains for reg in chain]
+
+
+def migrate_record(config, data, write_entry=migrate_entry):
+    # write_entry writes one register entry (see migrate_entry and cte_insert.migrate_entry)
+    logging.debug("--- MIGRATE RECORD ---")
+    logging.debug(data)
 
-                            # # TODO repeating code is bad.
 
-                    previous_id = details_id
-                    #complete(cursor)
-                    commit(cursor)
-                except Exception as e:
-                    logging.error(str(e))
-                    logging.error("Failed on {} {}".format(reg['registration']['registration_no'], reg['registration']['date']))
-                    # logging.error(data)
-                    call_stack = traceback.format_exc()
-
-                    lines = call_stack.split("\n")
-                    for line in lines:
-                        logging.error(line)
-
-                    failures.append({
-                        'number': reg['registration']['registration_no'],
-                        'date': reg['registration']['date'],
-                        'message': str(e)
-                    })
-                    rollback(cursor)
-                finally:
-                    close_cursor(cursor)
-                #raise
+    global app_config
+    app_config = config
+
+    conn = None
+    every = chains_per_commit(config)
+    try:
+        conn = get_connection(config)
+        if every is None:
+            failures = migrate_entries(conn, data, write_entry)
+        else:
+            failures = migrate_chains(conn, data, every, write_entry)
     finally:
         if conn is not None:
-            disconnect_from_psql(conn)
-    
+            release_connection(conn)
+
     return failures
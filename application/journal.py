@@ -0,0 +1,78 @@
+import glob
+import logging
+import os
+import threading
+
+
+# Append-only record of migrated work, one file per worker process. Each line is either
+#   C <tab> day <tab> chain key     - every entry in the chain has been committed
+#   D <tab> day                     - every chain on the day has been committed
+# On resume the files from all workers are read back, so that a re-planned run still skips
+# whatever any earlier worker finished.
+
+def default_directory():
+    directory = os.path.dirname(__file__)
+    return os.path.abspath(os.path.join(directory, os.pardir, 'output', 'journal'))
+
+
+def chain_key(history):
+    # Identifies a chain by its first (sorted) history item, before any transformation
+    first = history[0]
+    return "{}/{}/{}".format(first['date'], first['reg_no'], first['class'])
+
+
+class Journal(object):
+    def __init__(self, directory, name, fsync=False):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "{}_{}.log".format(name, os.getpid()))
+        self.file = open(self.path, 'a')
+        self.fsync = fsync
+        self.failed_days = set()
+        self.lock = threading.Lock()
+
+    def fail_day(self, day):
+        with self.lock:
+            self.failed_days.add(day)
+
+    def record_batch(self, registrations, chains, failures, closed_days):
+        # chains[n] is the (day, key) of registrations[n]. A chain counts as committed only if none of
+        # its entries failed; a day only once none of its chains did.
+        failed = set((str(f['number']), f['date']) for f in failures)
+        lines = []
+        with self.lock:
+            for (day, key), chain in zip(chains, registrations):
+                if any((str(reg['registration']['registration_no']), reg['registration']['date']) in failed
+                       for reg in chain):
+                    self.failed_days.add(day)
+                else:
+                    lines.append("C\t{}\t{}\n".format(day, key))
+
+            for day in closed_days:
+                if day not in self.failed_days:
+                    lines.append("D\t{}\n".format(day))
+
+            self.file.write(''.join(lines))
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def load_journals(directory):
+    # Returns (completed days, committed chain keys) across every journal in the directory
+    days = set()
+    chains = set()
+    for path in glob.glob(os.path.join(directory, '*.log')):
+        with open(path) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] == 'D' and len(fields) == 2:
+                    days.add(fields[1])
+                elif fields[0] == 'C' and len(fields) == 3:
+                    chains.add(fields[2])
+                # Anything else is a torn final line from a worker that died mid-write
+
+    logging.info("Journal: %d completed days, %d committed chains", len(days), len(chains))
+    return days, chains
@@ -0,0 +1,154 @@
+import codecs
+import json
+import re
+
+
+# Incremental decoding of a top-level JSON array. Each element is located by scanning for its closing
+# bracket (ignoring anything inside strings) and is only then handed to the json module, so memory use
+# is bounded by the largest element rather than by the whole document.
+
+STRUCTURE = re.compile(r'["\[\]{}]')
+IN_STRING = re.compile(r'["\\]')
+SCALAR_END = re.compile(r'[\s,\]]')
+WHITESPACE = ' \t\n\r'
+
+
+class ArrayStreamDecoder(object):
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0             # Start of the unconsumed text (or of the element being scanned)
+        self.scan = 0            # How far the current element has been scanned
+        self.state = 'start'     # start -> first -> element -> next -> value -> element ... -> done
+        self.kind = None
+        self.depth = 0
+        self.in_string = False
+
+    def skip_whitespace(self):
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+            self.pos += 1
+        return self.pos < len(self.buffer)
+
+    def start_element(self):
+        char = self.buffer[self.pos]
+        self.scan = self.pos + 1
+        self.depth = 0
+        self.in_string = False
+        if char in '[{':
+            self.kind = 'container'
+            self.depth = 1
+        elif char == '"':
+            self.kind = 'string'
+            self.in_string = True
+        else:
+            self.kind = 'scalar'
+            self.scan = self.pos
+        self.state = 'element'
+
+    def find_end(self, final=False):
+        # Returns the end offset of the current element, or None if more text is needed
+        buf = self.buffer
+        if self.kind == 'scalar':
+            match = SCALAR_END.search(buf, self.scan)
+            if match is None:
+                self.scan = len(buf)
+                return len(buf) if final else None
+            return match.start()
+
+        while True:
+            if self.in_string:
+                match = IN_STRING.search(buf, self.scan)
+                if match is None:
+                    self.scan = len(buf)
+                    return None
+                if match.group() == '\\':
+                    if match.end() >= len(buf):
+                        self.scan = match.start()  # Escape split across chunks; revisit it
+                        return None
+                    self.scan = match.end() + 1
+                    continue
+                self.in_string = False
+                self.scan = match.end()
+                if self.depth == 0:
+                    return self.scan
+            else:
+                match = STRUCTURE.search(buf, self.scan)
+                if match is None:
+                    self.scan = len(buf)
+                    return None
+                char = match.group()
+                self.scan = match.end()
+                if char == '"':
+                    self.in_string = True
+                elif char in '[{':
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return self.scan
+
+    def process(self, final=False):
+        items = []
+        while True:
+            if self.state == 'start':
+                if not self.skip_whitespace():
+                    break
+                if self.buffer[self.pos] != '[':
+                    raise ValueError('Expected a JSON array')
+                self.pos += 1
+                self.state = 'first'
+
+            elif self.state in ['first', 'value', 'next']:
+                if not self.skip_whitespace():
+                    break
+                char = self.buffer[self.pos]
+                if char == ']' and self.state != 'value':
+                    self.pos += 1
+                    self.state = 'done'
+                elif self.state == 'next':
+                    if char != ',':
+                        raise ValueError("Expected ',' or ']' at offset {}".format(self.pos))
+                    self.pos += 1
+                    self.state = 'value'
+                else:
+                    self.start_element()
+
+            elif self.state == 'element':
+                end = self.find_end(final)
+                if end is None:
+                    break
+                items.append(json.loads(self.buffer[self.pos:end]))
+                self.pos = end
+                self.state = 'next'
+
+            else:  # done
+                if self.skip_whitespace():
+                    raise ValueError('Unexpected data after JSON array')
+                break
+        return items
+
+    def feed(self, text):
+        # Discard everything already consumed before appending, keeping scan offsets relative
+        self.buffer = self.buffer[self.pos:] + text
+        self.scan -= self.pos
+        self.pos = 0
+        return self.process()
+
+    def close(self):
+        items = self.process(final=True)
+        if self.state != 'done':
+            raise ValueError('Truncated JSON array')
+        return items
+
+
+def iter_array(chunks, encoding='utf-8'):
+    # Yields the elements of a JSON array, given the document as an iterable of byte chunks
+    decoder = codecs.getincrementaldecoder(encoding)()
+    parser = ArrayStreamDecoder()
+    for chunk in chunks:
+        for item in parser.feed(decoder.decode(chunk)):
+            yield item
+
+    for item in parser.feed(decoder.decode(b'', final=True)):
+        yield item
+    for item in parser.close():
+        yield item
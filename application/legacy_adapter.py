@@ -0,0 +1,135 @@
+import logging
+import os
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from application.response_cache import ResponseCache, default_directory
+
+
+# One client per process: forked workers must not share pooled sockets with their parent
+client = None
+client_pid = None
+
+
+class LegacyAdapterClient(object):
+    # Wraps a keep-alive requests session so that every call to the legacy adapter reuses
+    # a pooled connection rather than paying for a fresh TCP handshake.
+    def __init__(self, base_uri, pool_size=4, connect_timeout=5.0, read_timeout=300.0, retries=3, backoff=0.5,
+                 cache=None):
+        self.base_uri = base_uri.rstrip('/')
+        self.cache = cache
+        self.timeout = (connect_timeout, read_timeout)
+
+        # Connection errors, resets and 5xx responses are retried with exponential backoff. Once the
+        # retries are used up the last response is handed back, so callers still see the status code.
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                      backoff_factor=backoff, status_forcelist=[500, 502, 503, 504],
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.stats = {}
+
+    def endpoint(self, url):
+        # '/land_charges_data/2001-01-01' -> 'land_charges_data'
+        path = url[len(self.base_uri):] if url.startswith(self.base_uri) else url
+        return path.lstrip('/').split('/')[0].split('?')[0]
+
+    def record(self, url, seconds, byte_count, cached=False):
+        name = self.endpoint(url)
+        if name not in self.stats:
+            self.stats[name] = {'calls': 0, 'cached': 0, 'bytes': 0, 'seconds': 0.0}
+        self.stats[name]['calls'] += 1
+        if cached:
+            self.stats[name]['cached'] += 1
+        self.stats[name]['bytes'] += byte_count
+        self.stats[name]['seconds'] += seconds
+
+    def from_cache(self, url, params):
+        if self.cache is None:
+            return None
+
+        cached = self.cache.load(url, params)
+        if cached is None:
+            return None
+
+        response = requests.Response()
+        response.status_code, response._content = cached
+        response._content_consumed = True
+        response.url = url
+        response.encoding = 'utf-8'
+        return response
+
+    def get(self, url, headers=None, params=None):
+        start = time.perf_counter()
+        response = self.from_cache(url, params)
+        cached = response is not None
+        if not cached:
+            response = self.session.get(url, headers=headers, params=params, timeout=self.timeout)
+            if self.cache is not None:
+                self.cache.store(url, response.status_code, response.content, params)
+
+        self.record(url, time.perf_counter() - start, len(response.content), cached)
+        return response
+
+    def stream(self, url, headers=None, params=None, chunk_size=65536):
+        # Returns the response as soon as the headers arrive, together with a generator over the body.
+        # With the cache in use the body is read in full (so that it can be stored) and then chunked.
+        if self.cache is not None:
+            response = self.get(url, headers=headers, params=params)
+            return response, response.iter_content(chunk_size)
+
+        start = time.perf_counter()
+        response = self.session.get(url, headers=headers, params=params, timeout=self.timeout, stream=True)
+        self.record(url, time.perf_counter() - start, 0)
+        return response, self.read_chunks(url, response, chunk_size)
+
+    def read_chunks(self, url, response, chunk_size):
+        name = self.endpoint(url)
+        try:
+            chunks = response.iter_content(chunk_size)
+            while True:
+                start = time.perf_counter()
+                chunk = next(chunks, None)
+                self.stats[name]['seconds'] += time.perf_counter() - start
+                if chunk is None:
+                    break
+                self.stats[name]['bytes'] += len(chunk)
+                yield chunk
+        finally:
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+    def log_stats(self):
+        for name in sorted(self.stats):
+            item = self.stats[name]
+            logging.info("Legacy Adapter /%s: %d calls (%d cached), %d bytes, %f seconds", name, item['calls'],
+                         item['cached'], item['bytes'], item['seconds'])
+        if self.cache is not None:
+            self.cache.log_stats()
+
+
+def get_client(config):
+    global client
+    global client_pid
+    if client is None or client_pid != os.getpid():
+        cache = None
+        if config.get('LEGACY_CACHE_MODE', 'off') != 'off':
+            cache = ResponseCache(config.get('LEGACY_CACHE_DIR') or default_directory(),
+                                  config['LEGACY_CACHE_MAX_MB'] * 1024 * 1024,
+                                  config['LEGACY_CACHE_MODE'])
+
+        client = LegacyAdapterClient(config['LEGACY_ADAPTER_URI'],
+                                     pool_size=config.get('LEGACY_POOL_SIZE', 4),
+                                     connect_timeout=config.get('LEGACY_CONNECT_TIMEOUT', 5.0),
+                                     read_timeout=config.get('LEGACY_READ_TIMEOUT', 300.0),
+                                     retries=config.get('LEGACY_RETRIES', 3),
+                                     backoff=config.get('LEGACY_RETRY_BACKOFF', 0.5),
+                                     cache=cache)
+        client_pid = os.getpid()
+    return client
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import time
+
+
+# Combines the statistics returned by each migrate() call (one per partition, from any number of worker
+# processes) into a single run report.
+
+COUNTERS = ['chains_read', 'records', 'skipped', 'errors', 'legacy_calls', 'legacy_wait', 'legacy_ttfb',
+            'sql_batches', 'sql_wait', 'manipulation', 'write_blocked', 'key_hits', 'key_misses',
+            'run_time']
+SLOWEST_DAYS = 10
+
+
+def add_counters(total, stats):
+    for counter in COUNTERS:
+        total[counter] = total.get(counter, 0) + stats.get(counter, 0)
+
+
+def merge_reports(reports, wall_time):
+    totals = {}
+    workers = {}
+    endpoints = {}
+    name_types = {}
+    days = []
+    failed = []
+    for stats in reports:
+        if stats.get('error') is not None:
+            failed.append({'start': stats['start'], 'end': stats['end'], 'error': stats['error']})
+            continue
+
+        add_counters(totals, stats)
+        if stats['worker'] not in workers:
+            workers[stats['worker']] = {'partitions': 0}
+        workers[stats['worker']]['partitions'] += 1
+        add_counters(workers[stats['worker']], stats)
+
+        for name, item in stats.get('legacy_endpoints', {}).items():
+            merged = endpoints.setdefault(name, {})
+            for key in item:
+                merged[key] = merged.get(key, 0) + item[key]
+        for name_type, count in stats.get('name_types', {}).items():
+            name_types[name_type] = name_types.get(name_type, 0) + count
+        days += stats.get('slowest_days', [])
+
+    for worker in workers.values():
+        worker['records_per_second'] = worker['records'] / worker['run_time'] if worker['run_time'] > 0 else 0
+
+    days.sort(key=lambda d: d['seconds'], reverse=True)
+    return {
+        'generated': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'wall_time': wall_time,
+        'partitions': len(reports),
+        'failed_partitions': failed,
+        'totals': totals,
+        'records_per_second': totals.get('records', 0) / wall_time if wall_time > 0 else 0,
+        'workers': workers,
+        'legacy_endpoints': endpoints,
+        'name_types': name_types,
+        'slowest_days': days[:SLOWEST_DAYS]
+    }
+
+
+def write_report(report, directory=None):
+    if directory is None:
+        directory = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'output'))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'migration_report_{}.json'.format(time.strftime('%Y%m%d_%H%M%S')))
+    with open(path, 'w') as f:
+        json.dump(report, f, sort_keys=True, indent=4)
+    return path
+
+
+def log_report(report):
+    totals = report['totals']
+    logging.info("Run complete: %d partitions (%d failed) in %f seconds", report['partitions'],
+                 len(report['failed_partitions']), report['wall_time'])
+    logging.info("Total chains read: %d, records: %d, errors: %d", totals.get('chains_read', 0),
+                 totals.get('records', 0), totals.get('errors', 0))
+    logging.info("Records per second: %f", report['records_per_second'])
+    logging.info("Legacy Adapter wait time: %f (%d calls)", totals.get('legacy_wait', 0),
+                 totals.get('legacy_calls', 0))
+    logging.info("SQL Insert wait time: %f", totals.get('sql_wait', 0))
+    logging.info("Data Mangling wait time: %f", totals.get('manipulation', 0))
+    logging.info("Blocked on the writer queue: %f", totals.get('write_blocked', 0))
+    logging.info("Name key cache: %d hits, %d misses", totals.get('key_hits', 0), totals.get('key_misses', 0))
+    for name in sorted(report['workers']):
+        worker = report['workers'][name]
+        logging.info("  Worker %s: %d partitions, %d records, %f records/second", name, worker['partitions'],
+                     worker['records'], worker['records_per_second'])
+    for day in report['slowest_days']:
+        logging.info("  Slow day %s: %f seconds, %d chains", day['day'], day['seconds'], day['chains'])
+    for failure in report['failed_partitions']:
+        logging.error("  Failed partition %s -> %s: %s", failure['start'], failure['end'], failure['error'])
@@ -0,0 +1,58 @@
+# Legacy private individual names are held as bare letters (remainder_name, then reverse_name backwards)
+# plus a punctuation_code: one two-hex-digit code per punctuation mark, giving the mark (top three bits)
+# and the number of letters before it (bottom five). '*' marks the start of the surname.
+#
+# Every possible code is decoded once, at import, into a 256-entry table; codes that aren't plain
+# two-digit hex (lower or mixed case, a trailing odd digit) still go through int() as before.
+
+PUNCTUATION = ['&', ' ', '-', "'", '(', ')', '*']
+MASK = 0x1F
+
+
+def decode_code(code_int):
+    # (punctuation, length), or None where the top bits don't name a punctuation mark
+    punc_code = code_int >> 5
+    if punc_code >= len(PUNCTUATION):
+        return None
+    return PUNCTUATION[punc_code], code_int & MASK
+
+
+TABLE = [decode_code(n) for n in range(256)]
+CODES = dict(('{:02X}'.format(n), TABLE[n]) for n in range(256))
+
+
+def hex_translator(hex_code):
+    entry = CODES.get(hex_code)
+    if entry is not None:
+        return entry
+
+    code_int = int(hex_code, 16)
+    if not 0 <= code_int < len(TABLE):
+        return PUNCTUATION[code_int >> 5], code_int & MASK
+    if TABLE[code_int] is None:
+        raise IndexError('list index out of range')  # as indexing PUNCTUATION did
+    return TABLE[code_int]
+
+
+def decode_name(punctuation_code, remainder_name, reverse_name):
+    # Returns (forenames, surname)
+    letters = remainder_name + reverse_name[::-1]
+    parts = []
+    start = 0
+    for index in range(0, len(punctuation_code), 2):
+        punc, length = hex_translator(punctuation_code[index:index + 2])
+        parts.append(letters[start:start + length])
+        parts.append(punc)
+        start += length
+
+    parts.append(letters[start:])
+    full_name = ''.join(parts)
+    surname_pos = full_name.find('*')
+    if surname_pos < 0:
+        return full_name.split(), ""
+    return full_name[:surname_pos].split(), full_name[surname_pos + 1:]
+
+
+def decode_row(row):
+    return decode_name(row['punctuation_code'], row['remainder_name'], row['reverse_name'])
+
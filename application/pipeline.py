@@ -0,0 +1,115 @@
+import logging
+import queue
+import threading
+import time
+
+
+# Marks the end of a stage's input/output
+END = object()
+
+
+class StageFailed(RuntimeError):
+    def __init__(self, message, cause=None):
+        super(RuntimeError, self).__init__(message)
+        self.cause = cause
+
+
+def put_unless_stopped(q, item, stop):
+    # A plain put() would block forever if the other side has gone away, so poll the stop flag
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def prefetch(iterable, depth):
+    # Drive 'iterable' from a background thread, keeping up to 'depth' items ready for the consumer.
+    # The bounded queue provides the backpressure: once it's full the producer waits.
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    failure = []
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put_unless_stopped(items, item, stop):
+                    return
+        except Exception as e:
+            logging.error('Prefetch stage failed: %s', str(e))
+            failure.append(e)
+        put_unless_stopped(items, END, stop)
+
+    thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is END:
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+    if len(failure) > 0:
+        raise StageFailed('Prefetch stage failed: {}'.format(str(failure[0])), failure[0])
+
+
+class BackgroundStage(object):
+    # Applies 'func' to each item put() on the stage, in order, on its own thread. Results are
+    # collected and handed back by join(); on_result, if given, also sees each one as it arrives (on
+    # the stage's thread).
+    def __init__(self, func, depth, name='stage', on_result=None):
+        self.func = func
+        self.name = name
+        self.on_result = on_result
+        self.items = queue.Queue(maxsize=depth)
+        self.results = []
+        self.failure = None
+        self.blocked = 0.0  # seconds put() spent waiting for room in the queue
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.items.get()
+            if item is END:
+                break
+            if self.failure is not None:
+                continue  # Keep draining so that put() never deadlocks
+
+            try:
+                result = self.func(item)
+                self.results.append(result)
+                if self.on_result is not None:
+                    self.on_result(result)
+            except Exception as e:
+                logging.error('%s stage failed: %s', self.name, str(e))
+                self.failure = e
+
+    def check(self):
+        if self.failure is not None:
+            raise StageFailed('{} stage failed: {}'.format(self.name, str(self.failure)), self.failure)
+
+    def put(self, item):
+        self.check()
+        start = time.perf_counter()
+        self.items.put(item)
+        self.blocked += time.perf_counter() - start
+
+    def join(self):
+        self.items.put(END)
+        self.thread.join()
+        self.check()
+        return self.results
+
+    def close(self):
+        # For giving up early: still finishes whatever was already queued, but never raises
+        if self.thread.is_alive():
+            self.items.put(END)
+            self.thread.join()
+        if self.failure is not None:
+            logging.error('%s stage had failed: %s', self.name, str(self.failure))
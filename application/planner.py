@@ -0,0 +1,84 @@
+import logging
+from datetime import datetime, timedelta
+from application.legacy_adapter import get_client
+from application.data import close_connection
+
+
+# Splits a date range into partitions of roughly equal registration volume (rather than equal width),
+# and hands them out to worker processes on demand from a shared queue.
+
+def day_range(start, end):
+    cdate = datetime.strptime(start, '%Y-%m-%d')
+    edate = datetime.strptime(end, '%Y-%m-%d')
+    while cdate <= edate:
+        yield cdate.strftime('%Y-%m-%d')
+        cdate += timedelta(days=1)
+
+
+def get_day_volumes(config, start, end):
+    # Returns [(day, count)] for every day in the range, reading the index a year at a time
+    counts = {}
+    year = int(start[:4])
+    while year <= int(end[:4]):
+        window_start = max(start, "{}-01-01".format(year))
+        window_end = min(end, "{}-12-31".format(year))
+        url = "{}/land_charges_index/{}/{}".format(config['LEGACY_ADAPTER_URI'], window_start, window_end)
+        response = get_client(config).get(url, headers={'Content-Type': 'application/json'})
+        if response.status_code != 200:
+            raise RuntimeError("Unexpected response {} from {}".format(response.status_code, url))
+
+        for entry in response.json():
+            day = entry['registration_date'][:10]
+            counts[day] = counts.get(day, 0) + 1
+        year += 1
+
+    return [(day, counts.get(day, 0)) for day in day_range(start, end)]
+
+
+def plan_partitions(volumes, count):
+    # Cut the (ordered) days into at most 'count' contiguous partitions of similar total volume. A
+    # single day is never split, so one very busy day can still make for an oversized partition.
+    total = sum(volume for day, volume in volumes)
+    if len(volumes) == 0:
+        return []
+
+    target = max(1, total / float(count))
+    partitions = []
+    current = None
+    for day, volume in volumes:
+        if current is None:
+            current = {'start': day, 'end': day, 'volume': 0}
+        current['end'] = day
+        current['volume'] += volume
+        if current['volume'] >= target and len(partitions) < count - 1:
+            partitions.append(current)
+            current = None
+
+    if current is not None:
+        partitions.append(current)
+
+    # Hand out the biggest first; the small ones then fill in the gaps at the end of the run
+    partitions.sort(key=lambda p: p['volume'], reverse=True)
+    logging.info("Planned %d partitions for %d registrations (target %d)", len(partitions), total, target)
+    return partitions
+
+
+def partition_worker(target, config, tasks, results=None):
+    # Pull partitions until the coordinator's sentinel (None) arrives, passing whatever the target
+    # returns for each partition back on the results queue
+    while True:
+        partition = tasks.get()
+        if partition is None:
+            break
+        logging.info("Partition %s -> %s (%d registrations)", partition['start'], partition['end'],
+                     partition['volume'])
+        try:
+            stats = target(config, partition['start'], partition['end'])
+        except Exception as e:
+            logging.error("Partition %s -> %s failed: %s", partition['start'], partition['end'], str(e))
+            stats = {'start': partition['start'], 'end': partition['end'], 'error': str(e)}
+
+        if results is not None:
+            results.put(stats)
+
+    close_connection()
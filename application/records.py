@@ -0,0 +1,194 @@
+# Compact in-flight records (MIGRATION_COMPACT_RECORDS). A transformed registration is a tree of dicts,
+# and a batch (or a prefetch queue) holds a good many of them; these slotted classes carry the same
+# fields in a fraction of the memory. They keep the mapping interface the writers already use
+# (record['field'], 'field' in record, get), so nothing downstream has to know which kind it was handed.
+# Fields outside a class's slots still work, kept in a small dict of their own. migration_data stays a plain
+# dict: it is stored as JSON, key order and all.
+
+class Record(object):
+    __slots__ = ('extra',)
+    fields = ()
+
+    def __init__(self):
+        self.extra = None
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.fields:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.fields:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self.extra is not None:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if len(default) > 0:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def keys(self):
+        keys = [field for field in self.fields if hasattr(self, field)]
+        if self.extra is not None:
+            keys += list(self.extra)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return to_dict(self) == to_dict(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, to_dict(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls()
+        for key, value in data.items():
+            record[key] = value
+        return record
+
+
+class RegistrationNumber(Record):
+    fields = ('registration_no', 'date')
+    __slots__ = fields
+
+
+class Applicant(Record):
+    fields = ('name', 'address', 'key_number', 'reference')
+    __slots__ = fields
+
+
+class Particulars(Record):
+    fields = ('counties', 'district', 'description')
+    __slots__ = fields
+
+
+class PrivateName(Record):
+    fields = ('forenames', 'surname')
+    __slots__ = fields
+
+
+class Address(Record):
+    fields = ('type', 'address_string', 'address_lines', 'county', 'postcode', 'id')
+    __slots__ = fields
+
+
+class Name(Record):
+    fields = ('type', 'private', 'company', 'local', 'other', 'complex')
+    __slots__ = fields
+
+    @classmethod
+    def from_dict(cls, data):
+        name = super(Name, cls).from_dict(data)
+        if isinstance(name.get('private'), dict):
+            name.private = PrivateName.from_dict(name.private)
+        return name
+
+
+class Party(Record):
+    fields = ('type', 'names', 'addresses', 'occupation', 'trading_name', 'residence_withheld', 'case_reference',
+              'legal_body', 'legal_body_ref_no')
+    __slots__ = fields
+
+    @classmethod
+    def from_dict(cls, data):
+        party = super(Party, cls).from_dict(data)
+        if 'names' in party:
+            party.names = [Name.from_dict(name) for name in party.names]
+        if 'addresses' in party:
+            party.addresses = [Address.from_dict(address) for address in party.addresses]
+        return party
+
+
+class Registration(Record):
+    fields = ('type', 'class_of_charge', 'registration', 'parties', 'applicant', 'additional_information',
+              'particulars', 'migration_data', 'previous', 'details_id', 'priority_notice', 'update_registration')
+    __slots__ = fields
+
+    @classmethod
+    def from_dict(cls, data):
+        registration = super(Registration, cls).from_dict(data)
+        if 'parties' in registration:
+            registration.parties = [Party.from_dict(party) for party in registration.parties]
+        for field, record_class in [('registration', RegistrationNumber), ('applicant', Applicant),
+                                    ('particulars', Particulars)]:
+            if isinstance(registration.get(field), dict):
+                registration[field] = record_class.from_dict(registration[field])
+        return registration
+
+
+def compact(registrations):
+    # A chain of transformed registrations (dicts), as Registration records
+    return [Registration.from_dict(registration) for registration in registrations]
+
+
+def to_dict(value):
+    # Back to plain dicts and lists, all the way down
+    if isinstance(value, (Record, dict)):
+        return dict((key, to_dict(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [to_dict(item) for item in value]
+    return value
+
+
+def json_default(value):
+    # For json.dump(s): default=json_default
+    if isinstance(value, Record):
+        return to_dict(value)
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
@@ -0,0 +1,80 @@
+import logging
+import time
+from types import MappingProxyType
+
+
+# The county and county_search_keys tables, read in full once per worker (one query each) and then
+# looked up in memory. The maps are read-only, so a forked worker can safely share its parent's copy.
+# A name missing from them fails straight away, as a missing row did before.
+
+# Authority names that county_search_keys deems invalid: only four turned up in the full test run (all from
+# the 1970s), and this program runs once, so they are simply hardcoded.
+OLD_AUTHORITY_KEYS = {
+    'WEST RIDING OF YORKSHIRE': 'WESTRIDIN',
+    'LINCOLN PARTS OF LINDSEY': 'LINCOLN',
+    'CAMBRIDGSHIRE AND ISLE OF ELY': 'CAMBRIDGE',
+    'NORTH RIDING OF YORKSHIRE': 'NORTHRIDI'
+}
+
+loaded = None
+
+
+def normalise(name):
+    return name.strip().upper()
+
+
+class ReferenceData(object):
+    def __init__(self, counties, search_keys):
+        # counties: [(id, name)]; search_keys: [(name, key)]
+        county_ids = {}
+        for county_id, name in counties:
+            county_ids.setdefault(normalise(name), county_id)  # as the old query, the first row wins
+
+        keys = {}
+        ambiguous = set()
+        for name, key in search_keys:
+            name = normalise(name)
+            if name in keys:
+                ambiguous.add(name)
+            keys[name] = key
+
+        self.counties = MappingProxyType(county_ids)
+        self.search_keys = MappingProxyType(keys)
+        self.ambiguous = frozenset(ambiguous)
+
+    def county_id(self, county):
+        try:
+            return self.counties[normalise(county)]
+        except KeyError:
+            raise RuntimeError("Invalid county: '{}'".format(county))
+
+    def name_key(self, name):
+        normalised = normalise(name)
+        if normalised in self.ambiguous:
+            raise RuntimeError('Too many variants found for name {}'.format(name))
+        if normalised in self.search_keys:
+            return self.search_keys[normalised]
+        if name in OLD_AUTHORITY_KEYS:
+            return OLD_AUTHORITY_KEYS[name]
+        raise RuntimeError('No variants found for name {}'.format(name))
+
+
+def load_reference_data(cursor):
+    start = time.perf_counter()
+    cursor.execute("SELECT id, name FROM county")
+    counties = [(row[0], row[1]) for row in cursor.fetchall()]
+    cursor.execute("SELECT name, key FROM county_search_keys")
+    search_keys = [(row[0], row[1]) for row in cursor.fetchall()]
+
+    data = ReferenceData(counties, search_keys)
+    logging.info("Reference data: %d counties, %d county search keys (%d ambiguous) in %f seconds",
+                 len(data.counties), len(data.search_keys), len(data.ambiguous), time.perf_counter() - start)
+    return data
+
+
+def reference_data(cursor):
+    # Loaded on first use if the worker didn't warm it up at the start
+    global loaded
+    if loaded is None:
+        loaded = load_reference_data(cursor)
+    return loaded
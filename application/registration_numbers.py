@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+import psycopg2
+
+
+# New registration numbers (for entries with no original number) come from memory, in blocks reserved
+# for the year from a coordination table. Reservations take a Postgres advisory lock and commit on a
+# connection of their own, so concurrent workers never hand out the same number and a rolled-back
+# migration transaction doesn't give its block back. Unused numbers at the end of a run are skipped.
+# Registrations migrated with their original numbers can land above the stored mark, so every
+# reservation starts from the highest of the stored mark, the register's own MAX + 1 and the highest
+# original number this process has written (its own transaction may not have committed yet). An original
+# number inside a block this process holds moves the block past it. One migrated by another worker is
+# seen once that worker commits, as it was by the old MAX + 1 on every insert.
+
+LOCK_KEY = 0x6c634d52  # 'lcMR'
+TABLE = 'migration_registration_numbers'
+
+LOCK = "SELECT pg_advisory_xact_lock(%(key)s)"
+CREATE = "CREATE TABLE IF NOT EXISTS " + TABLE + " (year INTEGER PRIMARY KEY, next_no INTEGER NOT NULL)"
+STORED = "SELECT next_no FROM " + TABLE + " WHERE year = %(year)s"
+# As insert_registration used to for every registration, unless the stored mark is higher
+FIRST = ('select COALESCE(GREATEST(%(next)s, %(taken)s, MAX(registration_no) + 1), 1000) AS reg '
+         'from register  '
+         'where date >=%(start)s AND date < %(end)s')
+INSERT = "INSERT INTO " + TABLE + " (year, next_no) VALUES (%(year)s, %(next)s)"
+UPDATE = "UPDATE " + TABLE + " SET next_no = %(next)s WHERE year = %(year)s"
+
+allocator = None
+allocator_pid = None
+
+
+class RegistrationNumbers(object):
+    def __init__(self, conn_str, block_size):
+        self.conn_str = conn_str
+        self.block_size = block_size
+        self.blocks = {}    # year -> [next number, limit]
+        self.taken_above = {}  # year -> one past the highest original number written
+        self.connection = None
+        self.lock = threading.Lock()
+        self.reservations = 0
+
+    def next_number(self, year):
+        with self.lock:
+            block = self.blocks.get(year)
+            if block is None or block[0] >= block[1]:
+                block = self.reserve(year)
+                self.blocks[year] = block
+            number = block[0]
+            block[0] += 1
+            return number
+
+    def taken(self, year, number):
+        # A registration keeping its original number: never hand that number out here
+        with self.lock:
+            self.taken_above[year] = max(self.taken_above.get(year, 0), number + 1)
+            block = self.blocks.get(year)
+            if block is not None and block[0] <= number < block[1]:
+                block[0] = number + 1
+
+    def reserve(self, year):
+        if self.connection is None or self.connection.closed:
+            self.connection = psycopg2.connect(self.conn_str)
+
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(LOCK, {'key': LOCK_KEY})
+            cursor.execute(CREATE)
+            cursor.execute(STORED, {'year': year})
+            row = cursor.fetchone()
+            cursor.execute(FIRST, {
+                'next': None if row is None else row[0],
+                'taken': self.taken_above.get(year),
+                'start': "{}-01-01".format(year),
+                'end': "{}-01-01".format(year + 1)
+            })
+            first = int(cursor.fetchone()[0])
+            cursor.execute(INSERT if row is None else UPDATE, {'year': year, 'next': first + self.block_size})
+            self.connection.commit()
+        except Exception:
+            if not self.connection.closed:
+                self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        self.reservations += 1
+        logging.debug("Reserved registration numbers %d-%d for %d", first, first + self.block_size - 1, year)
+        return [first, first + self.block_size]
+
+    def close(self):
+        if self.connection is not None and not self.connection.closed:
+            self.connection.close()
+        self.connection = None
+
+
+def get_registration_numbers(config):
+    # Per process: a forked worker reserves its own blocks
+    global allocator, allocator_pid
+    if allocator is None or allocator_pid != os.getpid():
+        allocator = RegistrationNumbers(config['PSQL_CONNECTION'], config.get('MIGRATION_REG_NO_BLOCK', 100))
+        allocator_pid = os.getpid()
+    return allocator
+
+
+def close_registration_numbers():
+    if allocator is not None and allocator_pid == os.getpid():
+        allocator.close()
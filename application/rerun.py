@@ -0,0 +1,126 @@
+import logging
+import time
+import psycopg2
+from application.data import delete_migrated
+from application.utility import convert_class, class_without_brackets
+
+
+# Reruns against a database that already holds some of the range. Each day's chains are looked up in
+# migration_status with one query, by the (original_regn_no, date, class_of_charge) of every entry that
+# gets a status row (all but cancellations), before any of them is transformed:
+#   skip     - a chain found in full is dropped; one found in part is deleted and migrated again
+#   replace  - any chain found, in full or in part, is deleted and migrated again
+# The lookups and deletes have a connection of their own, so they can run ahead of the writer (on the
+# prefetch thread, in pipelined mode). A replaced chain is deleted, and committed, before it is rewritten.
+
+POLICIES = ['off', 'skip', 'replace']
+
+MIGRATED = ("SELECT ms.original_regn_no, ms.date, ms.class_of_charge, ms.register_id "
+            "FROM migration_status ms "
+            "JOIN unnest(%(nos)s::text[], %(dates)s::date[], %(classes)s::text[]) AS k(no, date, cls) "
+            "ON ms.original_regn_no = k.no AND ms.date = k.date AND ms.class_of_charge = k.cls")
+
+
+def entry_key(item):
+    # A history item as its migration_status row would have it
+    return str(item['reg_no']).strip(), str(item['date'])[:10], class_without_brackets(convert_class(item['class']))
+
+
+def chain_keys(history):
+    return set(entry_key(item) for item in history if item['type'] != 'CN')
+
+
+class MigratedChains(object):
+    def __init__(self, conn_str, policy):
+        if policy not in POLICIES:
+            raise RuntimeError("Unknown rerun policy: '{}'".format(policy))
+        self.conn_str = conn_str
+        self.policy = policy
+        self.connection = None
+        self.stats = {'skipped': 0, 'replaced': 0, 'queries': 0, 'seconds': 0.0}
+
+    def cursor(self):
+        if self.connection is None or self.connection.closed:
+            self.connection = psycopg2.connect(self.conn_str)
+        return self.connection.cursor()
+
+    def lookup(self, keys):
+        # {entry key: [register ids]} for those already migrated
+        keys = list(keys)
+        found = {}
+        if len(keys) == 0:
+            return found
+
+        cursor = self.cursor()
+        try:
+            cursor.execute(MIGRATED, {
+                'nos': [key[0] for key in keys],
+                'dates': [key[1] for key in keys],
+                'classes': [key[2] for key in keys]
+            })
+            for no, date, cls, register_id in cursor.fetchall():
+                found.setdefault((str(no).strip(), str(date)[:10], cls), []).append(register_id)
+            self.connection.commit()
+        finally:
+            cursor.close()
+        self.stats['queries'] += 1
+        return found
+
+    def delete(self, register_ids):
+        cursor = self.cursor()
+        try:
+            delete_migrated(cursor, register_ids)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def day(self, day, chains):
+        # The chains on one day that still need migrating, in their original order
+        start = time.perf_counter()
+        found = self.lookup(set().union(*[chain_keys(history) for history in chains]))
+        remaining = []
+        skipped = 0
+        replace = []
+        for history in chains:
+            keys = chain_keys(history)
+            present = [key for key in keys if key in found]
+            if len(present) == 0:
+                remaining.append(history)
+            elif self.policy == 'skip' and len(present) == len(keys):
+                skipped += 1
+            else:
+                replace.append(history)
+                remaining.append(history)
+
+        if len(replace) > 0:
+            self.delete([register_id for history in replace for key in chain_keys(history) if key in found
+                         for register_id in found[key]])
+        self.stats['skipped'] += skipped
+        self.stats['replaced'] += len(replace)
+        self.stats['seconds'] += time.perf_counter() - start
+        logging.info("Day %s: %d chains already migrated, %d replaced", day, skipped, len(replace))
+        return remaining
+
+    def filter(self, histories, day_end):
+        # Wraps read_histories: holds back each day's chains until its day_end marker, then passes on
+        # whatever day() leaves
+        chains = []
+        for day, history in histories:
+            if history is not day_end:
+                chains.append(history)
+                continue
+
+            remaining = set(id(h) for h in self.day(day, [h for h in chains if h is not None and len(h) > 0]))
+            for h in chains:
+                if h is None or len(h) == 0 or id(h) in remaining:
+                    yield day, h
+            yield day, history
+            chains = []
+
+    def close(self):
+        if self.connection is not None and not self.connection.closed:
+            self.connection.close()
+        self.connection = None
@@ -0,0 +1,137 @@
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+from urllib.parse import urlencode
+
+
+# Local, compressed cache of legacy adapter responses. Entries are keyed on a hash of the URL and its
+# parameters; the file modification time doubles as the last-used time for LRU eviction.
+#
+# The cap is on the whole directory, which every worker shares. A worker only sees its own writes as it
+# makes them, so it re-scans the directory once it has written a tenth of the cap since its last scan,
+# and before evicting anything. Between scans, each worker can take the cache over the cap by at most
+# that tenth.
+
+RESCAN_FRACTION = 0.1
+
+MODES = ['off', 'read-through', 'replay', 'refresh']
+CACHEABLE_STATUS = [200, 404]
+
+
+class CacheMiss(RuntimeError):
+    pass
+
+
+def default_directory():
+    directory = os.path.dirname(__file__)
+    return os.path.abspath(os.path.join(directory, os.pardir, 'output', 'cache'))
+
+
+def cache_key(url, params=None):
+    query = urlencode(sorted((params or {}).items()))
+    return hashlib.sha256((url + '?' + query).encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+    def __init__(self, directory, max_bytes, mode='read-through'):
+        if mode not in MODES:
+            raise RuntimeError("Invalid cache mode: '{}'".format(mode))
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = {}  # path -> size, as of the last scan plus this process's writes since
+        self.total_bytes = 0
+        self.written = 0  # bytes stored since the last scan
+        os.makedirs(directory, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        entries = {}
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.gz'):
+                    path = os.path.join(root, name)
+                    try:
+                        entries[path] = os.path.getsize(path)
+                    except FileNotFoundError:  # Evicted by another worker as we looked
+                        pass
+        self.entries = entries
+        self.total_bytes = sum(entries.values())
+        self.written = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.gz')
+
+    def load(self, url, params=None):
+        # Returns (status_code, body) or None
+        if self.mode in ['off', 'refresh']:
+            return None
+
+        path = self.path(cache_key(url, params))
+        try:
+            with gzip.open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:  # Could also have been evicted by another worker
+            self.misses += 1
+            if self.mode == 'replay':
+                raise CacheMiss("No cached response for {} {}".format(url, params or ''))
+            return None
+
+        self.hits += 1
+        status, body = data.split(b'\n', 1)
+        return int(status), body
+
+    def store(self, url, status_code, body, params=None):
+        if self.mode in ['off', 'replay'] or status_code not in CACHEABLE_STATUS:
+            return
+
+        path = self.path(cache_key(url, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file then rename, so that readers never see a partial entry
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(handle, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+                f.write(str(status_code).encode('ascii') + b'\n' + body)
+        os.replace(temp_path, path)
+
+        size = os.path.getsize(path)
+        self.total_bytes += size - self.entries.get(path, 0)
+        self.entries[path] = size
+        self.written += size
+        if self.total_bytes > self.max_bytes or self.written > self.max_bytes * RESCAN_FRACTION:
+            self.scan()
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Drop least recently used entries until we're back under 90% of the cap
+        target = self.max_bytes * 0.9
+        by_age = []
+        for path in self.entries:
+            try:
+                by_age.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                by_age.append((0, path))
+        by_age.sort()
+
+        for mtime, path in by_age:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= self.entries.pop(path)
+            self.evictions += 1
+
+    def log_stats(self):
+        logging.info("Response cache (%s): %d hits, %d misses, %d evictions, %d bytes in %d entries",
+                     self.mode, self.hits, self.misses, self.evictions, self.total_bytes, len(self.entries))
@@ -1,16 +1,31 @@
-from application.data import migrate_record, connect_to_psql, disconnect_from_psql, create_cursor, close_cursor, commit, rollback
+from application.data import migrate_record, get_connection, release_connection, connection_stats, create_cursor, \
+    close_cursor, commit, rollback, warm_reference_data, statement_stats, copy_rows, copy_value
+from application.bulk_insert import migrate_batch, stats as bulk_stats
+from application.cte_insert import migrate_entry as cte_migrate_entry
 #import json
 import logging
 import traceback
 #import threading
-import requests
 import operator
 import re
+import os
+import socket
+import heapq
+import copy
 #import time
 from datetime import datetime, timedelta
 import time
 from application.utility import convert_class, class_without_brackets, parse_amend_info, save_to_file, reformat_county, \
     extract_authority_name
+from application.legacy_adapter import get_client
+from application.pipeline import prefetch, BackgroundStage, StageFailed
+from application.json_stream import iter_array
+from application.journal import Journal, load_journals, chain_key, default_directory as journal_directory
+from application.metrics import SLOWEST_DAYS
+from application.rerun import MigratedChains
+from application.search_key import configure_key_cache
+from application.name_decoder import hex_translator, decode_row
+from application.records import compact
 
 
 app_config = None
@@ -22,6 +37,10 @@ sqlinsert_count = 0
 wait_time_manipulation = 0
 call_count_legacy_db = 0
 legacy_db_ttfb = 0
+journal = None
+
+# Marks the end of each day in the stream of history chains
+DAY_END = 'DAY_END'
 
 
 class MigrationException(RuntimeError):
@@ -32,7 +51,7 @@ class MigrationException(RuntimeError):
 
 def get_from_legacy_adapter(url, headers={}, params={}):
     start = time.perf_counter()
-    response = requests.get(url, headers=headers, params=params)
+    response = get_client(app_config).get(url, headers=headers, params=params)
     global wait_time_legacydb
     global call_count_legacy_db
     global legacy_db_ttfb
@@ -43,6 +62,35 @@ def get_from_legacy_adapter(url, headers={}, params={}):
     return response
 
 
+def timed_chunks(chunks):
+    global wait_time_legacydb
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        wait_time_legacydb += time.perf_counter() - start
+        if chunk is None:
+            break
+        yield chunk
+
+
+def stream_from_legacy_adapter(url, headers={}, params={}):
+    # As get_from_legacy_adapter, but yields the decoded elements of a JSON array as the body arrives
+    start = time.perf_counter()
+    response, chunks = get_client(app_config).stream(url, headers=headers, params=params,
+                                                     chunk_size=app_config['LEGACY_STREAM_CHUNK'])
+    global wait_time_legacydb
+    global call_count_legacy_db
+    global legacy_db_ttfb
+    wait_time_legacydb += time.perf_counter() - start
+    legacy_db_ttfb += response.elapsed.total_seconds()
+
+    call_count_legacy_db += 1
+    if response.status_code != 200:
+        response.close()
+        raise MigrationException("Unexpected response {} from {}".format(response.status_code, url))
+    return iter_array(timed_chunks(chunks))
+
+
 def get_registrations_to_migrate(start_date, end_date):
     url = app_config['LEGACY_ADAPTER_URI'] + '/land_charges/' + start_date + '/' + end_date
     headers = {'Content-Type': 'application/json'}
@@ -130,76 +178,164 @@ def flag_oddities(data):
         add_flag(data, "Last item lacks name information")
                 
 
-def log_item_summary(data):
-    global final_log
-    for item in data:
-        final_log.append("Processed " + item['registration']["date"] + "/" + str(item['registration']['registration_no']))
-        for flag in item['migration_data']['flags']:
-            final_log.append("  " + flag)
-               
+# check() stages a range's index entries in a temporary table (one COPY) and finds those with nothing in
+# the register with a single anti-join. Entries whose number isn't purely digits were renumbered on
+# migration, so they're matched through migration_status on the original number instead. The misses go to
+# a TSV file per range (escaped as for COPY).
+CHECK_COLUMNS = ['entry', 'original', 'number', 'date', 'class_of_charge', 'via_status']
+
+CHECK_MISSING = ("SELECT k.entry FROM check_index k "
+                 "WHERE NOT EXISTS (SELECT 1 FROM register r JOIN register_details rd ON rd.id = r.details_id "
+                 "WHERE r.registration_no = k.number AND r.date = k.date AND rd.class_of_charge = k.class_of_charge "
+                 "AND (NOT k.via_status OR EXISTS (SELECT 1 FROM migration_status ms "
+                 "WHERE ms.register_id = r.id AND ms.original_regn_no = k.original))) "
+                 "ORDER BY k.entry")
+
+
+def check_output_path(config, start, end):
+    directory = config.get('CHECK_OUTPUT_DIR') or os.path.abspath(
+        os.path.join(os.path.dirname(__file__), os.pardir, 'output', 'check'))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, 'check_{}_{}.tsv'.format(start, end))
+
+
+def check_row(entry, reg):
+    number = re.sub("[^0-9]", "", str(reg['registration_no']))
+    return (entry, str(reg['registration_no']).strip(), number if number != '' else None, reg['registration_date'],
+            class_without_brackets(reg['class_type']), str(reg['registration_no']) != number)
+
 
 def check(config, start, end):
     global app_config
     app_config = config
-    #print(app_config)
 
+    check_start = time.perf_counter()
     url = "{}/land_charges_index/{}/{}".format(config['LEGACY_ADAPTER_URI'], start, end)
     headers = {'Content-Type': 'application/json'}
     registrations = get_from_legacy_adapter(url, headers=headers).json()
 
+    conn = None
+    cursor = None
     try:
-        conn = connect_to_psql(config['PSQL_CONNECTION'])
+        conn = get_connection(config)
         cursor = create_cursor(conn)
 
-        for reg in registrations:
-            #output = ''
-            output = "{}\t{}\t{}\t".format(reg['registration_no'], reg['registration_date'], reg['class_type'])
-
-            reg_no = re.sub("[^0-9]", "", str(reg['registration_no']))
-            if str(reg['registration_no']) != reg_no:
-                cursor.execute('SELECT r.id, r.registration_no, r.date, r.expired_on, rd.class_of_charge '
-                               'FROM register r, register_details rd, migration_status ms '
-                               'WHERE r.details_id=rd.id and r.id = ms.register_id and r.registration_no=%(nno)s and '
-                               'ms.original_regn_no=%(no)s and r.date=%(date)s and rd.class_of_charge=%(cls)s ', {
-                                   'no': reg['registration_no'].strip(), 'date': reg['registration_date'], 'cls': class_without_brackets(reg['class_type']),
-                                   'nno': reg_no.strip()
-                               })
-            else:
-                cursor.execute('SELECT r.id, r.registration_no, r.date, r.expired_on, rd.class_of_charge '
-                               'FROM register r, register_details rd '
-                               'WHERE r.details_id=rd.id and r.registration_no=%(no)s and r.date=%(date)s and '
-                               'rd.class_of_charge=%(cls)s', {
-                                   'no': reg['registration_no'].strip(), 'date': reg['registration_date'], 'cls': class_without_brackets(reg['class_type'])
-                               })
-
-            rows = cursor.fetchall()
-            if len(rows) == 0:
-                # output += "  No rows found\t"
-                print(output + " no rows")
-            # else:
-            #     output += "  {} rows found\t".format(len(rows))
-            #     for row in rows:
-            #         output += "  {}\t{}".format(row['id'], row['expired_on'])
-
-            # output += "END {} {} {}\n".format(reg['registration_no'], reg['registration_date'], reg['class_type'])
-            # output += "\n"
-            # print(output)
-
+        # Typed as the columns they're compared with; dropped again at the commit
+        cursor.execute("CREATE TEMPORARY TABLE check_index ON COMMIT DROP AS "
+                       "SELECT 0 AS entry, ms.original_regn_no AS original, r.registration_no AS number, r.date, "
+                       "rd.class_of_charge, TRUE AS via_status "
+                       "FROM register r, register_details rd, migration_status ms WITH NO DATA")
+        copy_rows(cursor, 'check_index', CHECK_COLUMNS,
+                  (check_row(entry, reg) for entry, reg in enumerate(registrations)))
+        cursor.execute("ANALYZE check_index")
+        cursor.execute(CHECK_MISSING)
+        missing = [registrations[row[0]] for row in cursor.fetchall()]
     finally:
         if cursor is not None:
             commit(cursor)
             close_cursor(cursor)
 
         if conn is not None:
-            disconnect_from_psql(conn)
+            release_connection(conn)
+
+    path = check_output_path(config, start, end)
+    with open(path + '.tmp', 'w') as f:
+        f.write("registration_no\tregistration_date\tclass_type\n")
+        for reg in missing:
+            f.write("\t".join(copy_value(reg[field]) for field in ['registration_no', 'registration_date',
+                                                                  'class_type']) + "\n")
+    os.replace(path + '.tmp', path)
+
+    seconds = time.perf_counter() - check_start
+    logging.info("Check %s -> %s: %d of %d index entries not migrated (%f seconds); see %s", start, end,
+                 len(missing), len(registrations), seconds, path)
+    return {'start': start, 'end': end, 'checked': len(registrations), 'missing': len(missing), 'file': path,
+            'seconds': seconds}
+
 
+def read_histories(start, end, skip_days=()):
+    # Yields (date, history) for every history chain on every day in the range, then (date, DAY_END)
+    cdate = datetime.fromtimestamp(time.mktime(time.strptime(start, '%Y-%m-%d')))
+    edate = datetime.fromtimestamp(time.mktime(time.strptime(end, '%Y-%m-%d')))
+    while cdate <= edate:
+        day = cdate.strftime('%Y-%m-%d')
+        cdate += timedelta(days=1)
+        if day in skip_days:
+            logging.info("Skip %s: already migrated", day)
+            continue
+
+        logging.info("Process %s", day)
+
+        url = app_config['LEGACY_ADAPTER_URI'] + '/land_charges_data/' + day
+        headers = {'Content-Type': 'application/json'}
+        if app_config.get('LEGACY_STREAM_JSON', False):
+            day_regs = stream_from_legacy_adapter(url, headers=headers)
+        else:
+            day_regs = get_from_legacy_adapter(url, headers=headers).json()
+
+        for history in day_regs:
+            yield day, history
+        yield day, DAY_END
+
+
+def report_failures(registration_failures):
+    if len(registration_failures) > 0:
+        logging.error('Failed migrations:')
+        for fail in registration_failures:
+            logging.error("Registration {} of {}".format(fail['number'], fail['date']))
+            logging.error(fail['message'])
+            final_log.append('Failed to migrate ' + fail["date"] + "/" + str(fail['number']))
+    return len(registration_failures)
+
+
+def write_batch(config, batch):
+    # A batch is (registrations, [(day, chain key)] for each registration, days closed by this batch)
+    registrations, chains, closed_days = batch
+    failures = []
+    if len(registrations) > 0:
+        failures = insert_record_to_db(config, registrations)
+
+    if journal is not None:
+        journal.record_batch(registrations, chains, failures, closed_days)
+    return report_failures(failures)
+
+
+def reset_stats():
+    # Workers run one partition after another; each migrate() reports only its own figures
+    global wait_time_legacydb
+    global wait_time_sqlinsert
+    global sqlinsert_count
+    global wait_time_manipulation
+    global call_count_legacy_db
+    global legacy_db_ttfb
+    global final_log
+    wait_time_legacydb = 0
+    wait_time_sqlinsert = 0
+    sqlinsert_count = 0
+    wait_time_manipulation = 0
+    call_count_legacy_db = 0
+    legacy_db_ttfb = 0
+    final_log = []
+    name_type_counts.clear()
+
+
+def endpoint_stats_since(before):
+    after = get_client(app_config).stats
+    result = {}
+    for name in after:
+        previous = before.get(name, {})
+        result[name] = {key: after[name][key] - previous.get(key, 0) for key in after[name]}
+    return result
 
 
 def migrate(config, start, end):
     global app_config
     global error_queue
     global sqlinsert_count
+    global journal
     app_config = config
+    reset_stats()
+    endpoints_before = copy.deepcopy(get_client(app_config).stats)
 
     # hostname = app_config['AMQP_URI']
     # connection = kombu.Connection(hostname=hostname)
@@ -207,68 +343,86 @@ def migrate(config, start, end):
 
     logging.info('Migration started')
     total_start = time.perf_counter()
-    
-    
-    
+    start_date = start
+    warm_reference_data(config)
+    key_cache = configure_key_cache(config.get('MIGRATION_KEY_CACHE_SIZE', 100000))
+    key_stats_before = dict(key_cache.stats)
+
     error_count = 0
-    # Get all the registration numbers that need to be migrated
-
-    # start_time = time.perf_counter()
-    # try:
-        # reg_data = get_registrations_to_migrate(start, end)
-        # if not isinstance(reg_data, list):
-            # msg = "Registration data is not a list:"
-            # logging.error(msg)
-            # logging.error(reg_data)
-            # report_error("E", msg, json.dumps(reg_data))
-            # return
-
-        # total_read = len(reg_data)
-        # logging.info("Retrieved %d items from /land_charges", total_read)
-
-    # except Exception as e:
-        # logging.error('Unhandled exception: %s', str(e))
-        # report_exception(e)
-        # raise
-    # wait_time_get_regs = time.perf_counter() - start_time
-    wait_time_get_regs = 0
     total_inc_history = 0
     total_read = 0
+    total_skipped = 0
     registrations = []
-    
-    cdate = datetime.fromtimestamp(time.mktime(time.strptime(start, '%Y-%m-%d')))
-    edate = datetime.fromtimestamp(time.mktime(time.strptime(end, '%Y-%m-%d')))
-    while cdate <= edate:
-        logging.info("Process %s", cdate.strftime('%Y-%m-%d'))
-        
-        get_start = time.perf_counter()
-        url = app_config['LEGACY_ADAPTER_URI'] + '/land_charges_data/' + cdate.strftime('%Y-%m-%d')
-        headers = {'Content-Type': 'application/json'}
-        day_regs = get_from_legacy_adapter(url, headers=headers).json()
-        total_read += len(day_regs)
-        wait_time_get_regs += get_start - time.perf_counter()
-        
-        cdate += timedelta(days=1)
-        for history in day_regs:
+    chains = []
+    closed_days = []
+
+    # The journal (opted into with MIGRATION_JOURNAL, and kept by any resumed run) records committed chains
+    # and completed days as batches are written; resuming skips anything recorded by any earlier run.
+    journal_dir = config.get('MIGRATION_JOURNAL_DIR') or journal_directory()
+    completed_days = set()
+    committed_chains = set()
+    if config.get('MIGRATION_RESUME', False):
+        completed_days, committed_chains = load_journals(journal_dir)
+
+    journal = None
+    if config.get('MIGRATION_JOURNAL', False) or config.get('MIGRATION_RESUME', False):
+        journal = Journal(journal_dir, "{}_{}".format(start, end), config.get('MIGRATION_JOURNAL_FSYNC', False))
+
+    # In pipelined mode the legacy adapter is read ahead on a thread of its own, behind a bounded queue
+    histories = read_histories(start, end, completed_days)
+
+    # Rerunning over chains that are already in the database: skip or replace them (see rerun.py)
+    rerun = None
+    if config.get('MIGRATION_RERUN', 'off') != 'off':
+        rerun = MigratedChains(config['PSQL_CONNECTION'], config['MIGRATION_RERUN'])
+        histories = rerun.filter(histories, DAY_END)
+
+    if config.get('MIGRATION_PIPELINE', False):
+        logging.info('Pipelined: prefetch depth %d', config['MIGRATION_PREFETCH_DEPTH'])
+        histories = prefetch(histories, config['MIGRATION_PREFETCH_DEPTH'])
+
+    # The asynchronous writer (always on when pipelined) drains batches on its own thread while this one
+    # carries on transforming. Failures reach final_log and the error count as each batch is written.
+    writer = None
+    write_errors = [0]
+    if config.get('MIGRATION_PIPELINE', False) or config.get('MIGRATION_ASYNC_WRITE', False):
+        logging.info('Asynchronous writer: queue of %d batches', config['MIGRATION_WRITE_QUEUE'])
+
+        def count_errors(errors):
+            write_errors[0] += errors
+
+        writer = BackgroundStage(lambda batch: write_batch(config, batch), config['MIGRATION_WRITE_QUEUE'],
+                                 name='writer', on_result=count_errors)
+
+    # Slowest days by wall time, as a min-heap of (seconds, day, chains)
+    slowest_days = []
+    day_started = time.perf_counter()
+    day_chains = 0
+
+    try:
+        for day, history in histories:
+            if history is DAY_END:
+                closed_days.append(day)
+                day_time = (time.perf_counter() - day_started, day, day_chains)
+                if len(slowest_days) < SLOWEST_DAYS:
+                    heapq.heappush(slowest_days, day_time)
+                else:
+                    heapq.heappushpop(slowest_days, day_time)
+                day_started = time.perf_counter()
+                day_chains = 0
+                if writer is not None:
+                    logging.info("Day %s read; %d write errors so far", day, write_errors[0])
+                continue
+
+            day_chains += 1
+
             # Reg is equivalend to history...
+            total_read += 1
             logging.debug(history)
             try:
-    
-
-                # for rows in reg_data:
-                # try:
-                # #For each registration number returned, get history of that application.
-                # logging.info("------------------------------------------------------------------")
-                # rows['class'] = rows['class'].strip()
-                # rows['reg_no'] = rows['reg_no'].strip()
-                # rows['date'] = rows['date'].strip()
-                # logging.info("Process %s %s/%s", rows['class'], rows['date'], rows['reg_no'])
-
-                # history = get_doc_history(rows['reg_no'], rows['class'], rows['date'])
-                
                 start = time.perf_counter()
                 global wait_time_manipulation
-                
+
                 if history is None or len(history) == 0:
                     logging.error("  No document history information found")
                     continue
@@ -276,10 +430,16 @@ def migrate(config, start, end):
                 total_inc_history += len(history)
                 for i in history:
                     i['sorted_date'] = datetime.strptime(i['date'], '%Y-%m-%d').date()
-                
+
                 logging.info("  Chain of length %d found", len(history))
                 history.sort(key=operator.itemgetter('sorted_date', 'reg_no'))
 
+                key = chain_key(history)
+                if key in committed_chains:
+                    logging.info("  Chain %s already migrated", key)
+                    total_skipped += 1
+                    continue
+
                 this_register = []
                 for x, registers in enumerate(history):
                     registers['class'] = convert_class(registers['class'])
@@ -287,66 +447,74 @@ def migrate(config, start, end):
                     logging.info("    Historical record %s %s %s", registers['class'], registers['reg_no'],
                                  registers['date'])
 
-
                     #numeric_reg_no = int(re.sub("/", "", registers['reg_no'])) # TODO: is this safe?
                     land_charges = registers['land_charge']
                         #get_land_charge(numeric_reg_no, registers['class'], registers['date'])
-                   
+
                     if land_charges is not None and len(land_charges) > 0:
                         records = extract_data(land_charges, registers['type'])
-
-                        #this_register.append(record)
                         this_register += records
 
-                        
                     else:
                         record = build_dummy_row(registers)
-                        #registrations.append(record)
                         this_register.append(record)
 
                 flag_oddities(this_register)
+                if config.get('MIGRATION_COMPACT_RECORDS', False):
+                    this_register = compact(this_register)
                 #save_to_file(this_register)
                 wait_time_manipulation += time.perf_counter() - start
                 registrations.append(this_register)
+                chains.append((day, key))
 
                 if len(registrations) > 20:
-                    registration_failures = insert_record_to_db(config, registrations)
+                    batch = (registrations, chains, closed_days)
                     registrations = []
-
-                    if len(registration_failures) > 0:
-                        logging.error('Failed migrations:')
-                        for fail in registration_failures:
-                            logging.error("Registration {} of {}".format(fail['number'], fail['date']))
-                            logging.error(fail['message'])
-                            error_count += 1
-                            final_log.append('Failed to migrate ' + fail["date"] + "/" + str(fail['number']))
+                    chains = []
+                    closed_days = []
+                    if writer is not None:
+                        writer.put(batch)
                     else:
-                        log_item_summary(registrations)
+                        error_count += write_batch(config, batch)
 
+            except StageFailed:
+                raise
             except Exception as e:
                 logging.error('Unhandled exception: %s', str(e))
                 logging.error('Failed to migrate  %s %s %s', history[0]['class'], history[0]['reg_no'], history[0]['date'])
                 report_exception(e)
                 error_count += 1
+                if journal is not None:
+                    journal.fail_day(day)
+
+        # End of main loop
+        if len(registrations) > 0 or len(closed_days) > 0:
+            batch = (registrations, chains, closed_days)
+            if writer is not None:
+                writer.put(batch)
+            else:
+                error_count += write_batch(config, batch)
+            registrations = []
+
+        if writer is not None:
+            writer.join()
+            error_count += write_errors[0]
+    except BaseException:
+        # Giving up early: whatever was already handed to the writer is still written and journalled
+        if writer is not None:
+            writer.close()
+        if journal is not None:
+            journal.close()
+        if rerun is not None:
+            rerun.close()
+        raise
+
+    if journal is not None:
+        journal.close()
+    if rerun is not None:
+        rerun.close()
+        total_skipped += rerun.stats['skipped']
 
-    # End of main loop
-    # TODO: repeated code
-    if len(registrations) > 0:
-        registration_failures = insert_record_to_db(config, registrations)
-        registrations = []
-
-        if len(registration_failures) > 0:
-            logging.error('Failed migrations:')
-            for fail in registration_failures:
-                logging.error("Registration {} of {}".format(fail['number'], fail['date']))
-                logging.error(fail['message'])
-                error_count += 1
-                final_log.append('Failed to migrate ' + fail["date"] + "/" + str(fail['number']))
-        else:
-            log_item_summary(registrations)
-
-
-    
     global wait_time_legacydb
     global legacy_db_ttfb
     total_time = time.perf_counter() - total_start
@@ -354,21 +522,71 @@ def migrate(config, start, end):
     logging.info('Migration complete')
     logging.info("Total registrations read: %d", total_read)
     logging.info("Total records processed: %d", total_inc_history)
+    if config.get('MIGRATION_RESUME', False) or rerun is not None:
+        logging.info("Total chains skipped (resume/rerun): %d", total_skipped)
+    if rerun is not None:
+        logging.info("Rerun (%s): %d chains replaced; %d migration_status lookups took %f seconds",
+                     rerun.policy, rerun.stats['replaced'], rerun.stats['queries'], rerun.stats['seconds'])
     logging.info("Total errors: %d", error_count)
     logging.info("Legacy Adapter wait time: %f (%d calls)", wait_time_legacydb, call_count_legacy_db)
     logging.info("Legacy Adapter cumulative TTFB: %f", legacy_db_ttfb)
-    #logging.info("Startup wait time: %f", wait_time_get_regs)
+    get_client(app_config).log_stats()
     logging.info("SQL Insert wait time: %f", wait_time_sqlinsert)
+    logging.info("Database connections: %d opened, %d replaced, %d health checks", connection_stats['connects'],
+                 connection_stats['reconnects'], connection_stats['checks'])
+    for name in sorted(statement_stats):
+        logging.info("Prepared statement %s: %d executions", name, statement_stats[name])
+    if config.get('MIGRATION_WRITE_MODE', 'row') == 'bulk':
+        logging.info("Bulk writer: %d batches, %d rows in %d statements, %d batches re-run row by row",
+                     bulk_stats['batches'], bulk_stats['rows'], bulk_stats['statements'], bulk_stats['fallbacks'])
+    write_blocked = writer.blocked if writer is not None else 0.0
+    if writer is not None:
+        logging.info("Blocked on the writer queue: %f", write_blocked)
+    key_hits = key_cache.stats['hits'] - key_stats_before['hits']
+    key_misses = key_cache.stats['misses'] - key_stats_before['misses']
+    logging.info("Name key cache: %d hits, %d misses; %d of %d entries used, %d evicted in all", key_hits, key_misses,
+                 len(key_cache.entries), key_cache.size, key_cache.stats['evictions'])
+    for name_type in sorted(name_type_counts):
+        logging.info("Names of type %s: %d", name_type, name_type_counts[name_type])
     logging.info("Data Mangling wait time: %f", wait_time_manipulation)
     logging.info("Total run time: %f", total_time)
-    
+
     for line in final_log:
         logging.info(line)
 
-    
+    return {
+        'worker': "{}:{}".format(socket.gethostname(), os.getpid()),
+        'start': start_date,
+        'end': end,
+        'error': None,
+        'chains_read': total_read,
+        'records': total_inc_history,
+        'skipped': total_skipped,
+        'errors': error_count,
+        'legacy_calls': call_count_legacy_db,
+        'legacy_wait': wait_time_legacydb,
+        'legacy_ttfb': legacy_db_ttfb,
+        'legacy_endpoints': endpoint_stats_since(endpoints_before),
+        'sql_batches': sqlinsert_count,
+        'sql_wait': wait_time_sqlinsert,
+        'manipulation': wait_time_manipulation,
+        'write_blocked': write_blocked,
+        'key_hits': key_hits,
+        'key_misses': key_misses,
+        'name_types': dict(name_type_counts),
+        'run_time': total_time,
+        'slowest_days': [{'day': d, 'seconds': t, 'chains': n} for t, d, n in sorted(slowest_days, reverse=True)]
+    }
+
+
 def insert_record_to_db(config, data):
     start = time.perf_counter()
-    failures = migrate_record(config, data)
+    if config.get('MIGRATION_WRITE_MODE', 'row') == 'bulk':
+        failures = migrate_batch(config, data)
+    elif config.get('MIGRATION_WRITE_MODE', 'row') == 'cte':
+        failures = migrate_record(config, data, cte_migrate_entry)
+    else:
+        failures = migrate_record(config, data)
     global wait_time_sqlinsert
     global sqlinsert_count
     sqlinsert_count += 1
@@ -404,46 +622,50 @@ def report_error(error_type, message, stack):
     error_queue.put(error)
 
 
+# Name type codes: the last byte of reverse_name_hex. Each maps to (name type, builder, prefix): a code with
+# a prefix only counts when reverse_name_hex also starts with it. Anything else is a simple (punctuated)
+# private individual's name. Classification is one lookup; new legacy codes need only register_name_type.
+NAME_TYPES = {}
+SIMPLE_NAME = ('Simple', lambda data: extract_simple(data), None)
+name_type_counts = {}
+
+
+def register_name_type(code, name_type, builder, prefix=None):
+    NAME_TYPES[code] = (name_type, builder, prefix)
+
+
+def authority_builder(name_type):
+    return lambda data: build_registration(data, name_type, extract_authority_name(data['name']))
+
+
+register_name_type('01', 'County Council', authority_builder('County Council'))
+register_name_type('02', 'Rural Council', authority_builder('Rural Council'))
+register_name_type('04', 'Parish Council', authority_builder('Parish Council'))
+register_name_type('08', 'Other Council', authority_builder('Other Council'))
+register_name_type('10', 'Development Corporation',
+                   lambda data: build_registration(data, 'Development Corporation', {'other': data['name']}))
+register_name_type('F1', 'Limited Company',
+                   lambda data: build_registration(data, 'Limited Company', {'company': data['name']}))
+register_name_type('F2', 'Other', lambda data: build_registration(data, 'Other', {'other': data['name']}))
+register_name_type('F3', 'Complex Name', lambda data: build_registration(data, 'Complex Name', {
+    'complex': {'name': data['name'], 'number': int(data['reverse_name_hex'][2:8], 16)}}), prefix='F9')
+
+
+def classify_name(data):
+    name_hex = data['reverse_name_hex']
+    entry = NAME_TYPES.get(name_hex[-2:], SIMPLE_NAME)
+    if entry[2] is not None and not name_hex.startswith(entry[2]):
+        entry = SIMPLE_NAME
+    name_type_counts[entry[0]] = name_type_counts.get(entry[0], 0) + 1
+    return entry
+
+
 def extract_data(rows, app_type):
-    #print(rows)
     data = rows[0]
 
-    if data['reverse_name_hex'][-2:] == '01':
-        # County council
-        logging.info('      EO Name is County Council')
-        registration = build_registration(data, 'County Council', extract_authority_name(data['name']))
-    elif data['reverse_name_hex'][-2:] == '02':
-        # Rural council
-        logging.info('      EO Name is Rural Council')
-        registration = build_registration(data, 'Rural Council', extract_authority_name(data['name']))
-    elif data['reverse_name_hex'][-2:] == '04':
-        # Parish council
-        logging.info('      EO Name is Parish Council')
-        registration = build_registration(data, 'Parish Council', extract_authority_name(data['name']))
-    elif data['reverse_name_hex'][-2:] == '08':
-        # Other council
-        logging.info('      EO Name is Other Council')
-        registration = build_registration(data, 'Other Council', extract_authority_name(data['name']))
-    elif data['reverse_name_hex'][-2:] == '10':
-        # Dev corp
-        logging.info('      EO Name is Development Corporation')
-        registration = build_registration(data, 'Development Corporation', {'other': data['name']})
-    elif data['reverse_name_hex'][-2:] == 'F1':
-        # Ltd Company
-        logging.info('      EO Name is Limited Company')
-        registration = build_registration(data, 'Limited Company', {'company': data['name']})
-    elif data['reverse_name_hex'][-2:] == 'F2':
-        # Other
-        logging.info('      EO Name is Other')
-        registration = build_registration(data, 'Other', {'other': data['name']})
-    elif data['reverse_name_hex'][-2:] == 'F3' and data['reverse_name_hex'][0:2] == 'F9':
-        logging.info('      EO Name is Complex Name')
-        registration = build_registration(data, 'Complex Name', {'complex': {'name': data['name'], 'number': int(data['reverse_name_hex'][2:8], 16)}})
-    else:    
-        # Mundane name
-        logging.info('      EO Name is Simple')
-        registration = extract_simple(data)
-    
+    name_type, builder, prefix = classify_name(data)
+    logging.debug('      EO Name is %s', name_type)
+    registration = builder(data)
     registration['type'] = app_type
 
     addl_rows = []
@@ -545,33 +767,7 @@ def handle_additional_rows(registration, rows, app_type):
 
 
 def extract_simple(rows):
-    hex_codes = []
-    length = len(rows['punctuation_code'])
-    count = 0
-    while count < length:
-        hex_codes.append(rows['punctuation_code'][count:(count + 2)])
-        count += 2
-
-    orig_name = rows["remainder_name"] + rows["reverse_name"][::-1]
-    name_list = []
-    for items in hex_codes:
-        punc, pos = hex_translator(items)
-        name_list.append(orig_name[:pos])
-        name_list.append(punc)
-        orig_name = orig_name[pos:]
-
-    name_list.append(orig_name)
-    full_name = ''.join(name_list)
-    try:
-        surname_pos = full_name.index('*')
-        forenames = full_name[:surname_pos]
-        surname = full_name[surname_pos + 1:]
-    except ValueError:
-        surname = ""
-        forenames = full_name
-
-    forenames = forenames.split()
-
+    forenames, surname = decode_row(rows)
     registration = build_registration(rows, 'Private Individual', {'private': {'forenames': forenames, 'surname': surname}})
     return registration
 
@@ -726,11 +922,3 @@ def build_registration(rows, name_type, name_data):
     # return registration_status_code
 
 
-def hex_translator(hex_code):
-    mask = 0x1F
-    code_int = int(hex_code, 16)
-    length = code_int & mask
-    punc_code = code_int >> 5
-    punctuation = ['&', ' ', '-', "'", '(', ')', '*']
-    return punctuation[punc_code], length
-
@@ -9,6 +9,8 @@
 # converted (by Synchroniser) to *be* identical to the legacy key
 import re
 import psycopg2
+from collections import OrderedDict
+from application.reference_data import reference_data
 
 
 # Some look up tables etc.
@@ -90,14 +92,53 @@ LA_NON_KEY_WORDS = ['AND', '&', 'AT', 'BY', 'CITY', 'CUM', 'DE', 'DU', 'EN', 'IN
 B_INDICATORS = ['BOARD OF']
 
 
+# The tables above, compiled once at import: key generation runs for every party name, so no rule
+# rebuilds a pattern or rescans a list per call. Token rules become sets and one word -> replacement
+# map; the B indicators become a single alternation. The keys must not change (see
+# tests/test_search_key.py, which checks them against the original implementation).
+
+def build_common_words():
+    # As remove_common_words used to apply them: the last list containing a word wins, and a trailing
+    # S word overrides that
+    words = {}
+    for common in COMMON_WORDS:
+        for word in COMMON_WORDS[common]:
+            words[word] = common
+    for word in S_WORDS:
+        words[word] = word[0:-1]
+    return words
+
+
+COMMON_WORD_MAP = build_common_words()
+COMMON_WORD_SET = frozenset(word for common in COMMON_WORDS for word in COMMON_WORDS[common])
+NOISE_SET = frozenset(NOISE)
+NON_KEY_SET = frozenset(NON_KEY_WORDS)
+LA_NON_KEY_SET = frozenset(LA_NON_KEY_WORDS)
+NOISE_NONKEY_OR_S_SET = frozenset(NOISE + NON_KEY_WORDS + S_WORDS)
+
+NON_ALPHANUMERIC = re.compile('[^A-Za-z0-9]')
+NON_ALPHANUMERIC_SPACES = re.compile('[^A-Za-z0-9\s]')
+PLC_FORMS = [
+    re.compile("(\s|^)(public)\s(limited|ltd|ld)\s(company|co|cos|coy|coys|comp|comps|companies)(\s|$)",
+               flags=re.IGNORECASE),
+    re.compile("(\s|^)(cwmni|c)\s(cyf|cyfyngedig|c)\s(cyhoeddus|c)(\s|$)", flags=re.IGNORECASE),
+    re.compile("(\s|^)(C C C|P L C)(\s|$)", flags=re.IGNORECASE)
+]
+PLC_REPLACEMENTS = [r"\1PLC\5", r"\1PLC\5", r"\1PLC\3"]
+B_INDICATOR_MATCH = re.compile('(^|\s)(?:{})(\s|$)'.format(
+    '|'.join(re.escape(indicator) for indicator in COMPLEX_NAME_INDICATORS + B_INDICATORS)))
+B_INDICATOR_REMOVE = [re.compile('(^|\s){}(\s|$)'.format(re.escape(item))) for item in B_INDICATORS]
+DEVELOPMENT_CORPORATION = re.compile("\s(New Town\s)? Development Corporation", flags=re.IGNORECASE)
+
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
 def remove_non_alphanumeric(name_string):
-    return re.sub('[^A-Za-z0-9]', '', name_string)
+    return NON_ALPHANUMERIC.sub('', name_string)
 
 def remove_non_alphanumeric_spaces(name_string):
-    return re.sub('[^A-Za-z0-9\s]', '', name_string)
+    return NON_ALPHANUMERIC_SPACES.sub('', name_string)
 
 
 def create_private_name_key(private):
@@ -111,13 +152,8 @@ def remove_common_words(name_array):
     # Cover the rules for 'common words', 'trailing S words' and the rule about
     # three very specific words ending in 'ies'
     for index, word in enumerate(name_array):
-        for common in COMMON_WORDS:
-            options = COMMON_WORDS[common]
-            if word in options:
-                name_array[index] = common
-
-        if word in S_WORDS:
-            name_array[index] = word[0:-1]
+        if word in COMMON_WORD_MAP:
+            name_array[index] = COMMON_WORD_MAP[word]
 
     return name_array
 
@@ -130,10 +166,11 @@ def remove_noise(name_array):
     if len(name_array) > 0 and name_array[-1] == 'THE':
         del(name_array[-1])
 
-    return [word for word in name_array if word not in NOISE]
+    return [word for word in name_array if word not in NOISE_SET]
 
 
 def remove_non_key(name_array, words_to_remove):
+    # words_to_remove: NON_KEY_SET or LA_NON_KEY_SET
     result = [word for word in name_array if word not in words_to_remove]
     return result
 
@@ -147,47 +184,26 @@ def replace_la_abbreviations(name_array):
 
 def create_limited_name_key(company):
     # Pre-parse the various PLC combinations...
-    company = re.sub("(\s|^)(public)\s(limited|ltd|ld)\s(company|co|cos|coy|coys|comp|comps|companies)(\s|$)", r"\1PLC\5", company, flags=re.IGNORECASE)
-    company = re.sub("(\s|^)(cwmni|c)\s(cyf|cyfyngedig|c)\s(cyhoeddus|c)(\s|$)", r"\1PLC\5", company, flags=re.IGNORECASE)
-    company = re.sub("(\s|^)(C C C|P L C)(\s|$)", r"\1PLC\3", company, flags=re.IGNORECASE)
+    for form, replacement in zip(PLC_FORMS, PLC_REPLACEMENTS):
+        company = form.sub(replacement, company)
     # C C C   P L C
     company = remove_non_alphanumeric_spaces(company)
 
     name_array = company.upper().split(' ')
     name_array = remove_common_words(name_array)
     name_array = remove_noise(name_array)
-    name_array = remove_non_key(name_array, NON_KEY_WORDS)
+    name_array = remove_non_key(name_array, NON_KEY_SET)
     name = ' '.join(name_array)
     return remove_non_alphanumeric(name)
 
 
 def fetch_name_key(cursor, name):
-    cursor.execute('SELECT key FROM county_search_keys WHERE name=%(name)s', {'name': name.upper()})
-    rows = cursor.fetchall()
-    if len(rows) == 0:
-        # Right, the full test run turned up only four authority names that the new data tables deem to be
-        # invalid (all date from the 1970s). There are elegant and correct ways to fix this, but there are
-        # only FOUR such names, and this program will be executed once.
-        # Therefore, hardcoding these cases is just easier.
-        if name == 'WEST RIDING OF YORKSHIRE':
-            return 'WESTRIDIN'
-        elif name == 'LINCOLN PARTS OF LINDSEY':
-            return 'LINCOLN'
-        elif name == 'CAMBRIDGSHIRE AND ISLE OF ELY':
-            return 'CAMBRIDGE'
-        elif name == 'NORTH RIDING OF YORKSHIRE':
-            return 'NORTHRIDI'
-        else:
-            raise RuntimeError('No variants found for name {}'.format(name))
-    if len(rows) > 1:
-        raise RuntimeError('Too many variants found for name {}'.format(name))
-    key = rows[0]['key']
-    return key
+    return reference_data(cursor).name_key(name)
 
 
 def create_local_authority_key(area):
     area_array = area.upper().split(' ')
-    area_array = remove_non_key(area_array, LA_NON_KEY_WORDS)
+    area_array = remove_non_key(area_array, LA_NON_KEY_SET)
     area_array = replace_la_abbreviations(area_array)
     area = ' '.join(area_array)
     area = remove_non_alphanumeric(area)
@@ -202,7 +218,7 @@ def count_words(name_array):
     count = 0
     previous_was_1_char = False
     for name in name_array:
-        if name not in NOISE:
+        if name not in NOISE_SET:
             if len(name) > 1:
                 count += 1
                 previous_was_1_char = False
@@ -214,29 +230,16 @@ def count_words(name_array):
 
 
 def contains_common_word(name_array):
-    for common in COMMON_WORDS:
-        options = COMMON_WORDS[common]
-        for word in options:
-            if word in name_array:
-                return True
-    return False
+    return not COMMON_WORD_SET.isdisjoint(name_array)
 
 
 def contains_b_indicators(name):
-    test = COMPLEX_NAME_INDICATORS + B_INDICATORS
-    for indicator in test:
-        if re.search('(^|\s){}(\s|$)'.format(indicator), name) is not None:
-            return True
-    return False
+    return B_INDICATOR_MATCH.search(name) is not None
 
 
 def contains_noise_nonkey_or_s_words(name_array):
     # TODO: what about the three -IES words
-    test_for_words = NOISE + NON_KEY_WORDS + S_WORDS
-    for name in name_array:
-        if name in test_for_words:
-            return True
-    return False
+    return not NOISE_NONKEY_OR_S_SET.isdisjoint(name_array)
 
 
 def is_class_b(name):
@@ -259,8 +262,8 @@ def get_other_type_a_key(name):
 
 
 def get_other_type_b_key(name):
-    for item in B_INDICATORS:
-        name = re.sub('(^|\s){}(\s|$)'.format(item), "", name)
+    for item in B_INDICATOR_REMOVE:
+        name = item.sub("", name)
 
     key = create_limited_name_key(name)  # Handily, type b are mostly treated with the LTD CO rules
     return key
@@ -289,7 +292,7 @@ def create_registration_key(cursor, name):
     elif name['type'] in ['Parish Council', 'Rural Council', 'Other Council']:
         key = create_local_authority_key(name['local']['area'])
     elif name['type'] == 'Development Corporation':
-        devcorp = re.sub("\s(New Town\s)? Development Corporation", "", name['other'], flags=re.IGNORECASE)
+        devcorp = DEVELOPMENT_CORPORATION.sub("", name['other'])
         key = create_local_authority_key(devcorp)
     elif name['type'] == 'Other':
         key, ind = get_other_key(name['other'])
@@ -343,7 +346,7 @@ def create_search_keys(cursor, name_type, name):
         keys.append(create_local_authority_key(name['local_authority_area']))
 
     elif name_type == 'Development Corporation':
-        devcorp = re.sub("\s(New Town\s)? Development Corporation", "", name['other'], flags=re.IGNORECASE)
+        devcorp = DEVELOPMENT_CORPORATION.sub("", name['other'])
         keys.append(create_local_authority_key(devcorp))
 
     elif name_type == 'Other':
@@ -360,3 +363,71 @@ def create_search_keys(cursor, name_type, name):
         raise RuntimeError('Unknown name type: {}'.format(name['type']))
 
     return keys
+
+
+# Memoised keys. Surnames, company names and council areas repeat heavily, so each worker keeps the
+# most recently used keys in a bounded LRU cache. Entries are keyed on the name type and the fields the key
+# is built from, exactly as given: parts of the rules are case-sensitive, so folding case would change
+# keys. Failures (e.g. an unknown county) are never cached.
+
+class KeyCache(object):
+    def __init__(self, size):
+        self.size = size    # entries; 0 turns the cache off
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, cache_key, compute):
+        if cache_key in self.entries:
+            self.entries.move_to_end(cache_key)
+            self.stats['hits'] += 1
+            return self.entries[cache_key]
+
+        self.stats['misses'] += 1
+        value = compute()
+        if self.size > 0:
+            self.entries[cache_key] = value
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return value
+
+
+key_cache = KeyCache(100000)
+
+
+def configure_key_cache(size):
+    global key_cache
+    if size != key_cache.size:
+        key_cache = KeyCache(size)
+    return key_cache
+
+
+def registration_key_fields(name):
+    # What create_registration_key reads from a name, as a hashable tuple
+    if name['type'] == 'Private Individual':
+        return name['type'], tuple(name['private']['forenames']), name['private']['surname']
+    elif name['type'] == 'Limited Company':
+        return name['type'], name['company']
+    elif name['type'] in ['County Council', 'Parish Council', 'Rural Council', 'Other Council']:
+        return name['type'], name['local']['area']
+    elif name['type'] == 'Complex Name':
+        return name['type'], name['complex']['name']
+    return name['type'], name.get('other')
+
+
+def registration_key(cursor, name):
+    # create_registration_key, memoised
+    key = key_cache.get(('registration',) + registration_key_fields(name),
+                        lambda: create_registration_key(cursor, name))
+    return dict(key)
+
+
+def registration_keys(cursor, names):
+    # Keys for a list of names, in order; each distinct name is looked up once
+    keys = {}
+    for name in names:
+        fields = registration_key_fields(name)
+        if fields not in keys:
+            keys[fields] = registration_key(cursor, name)
+    return [dict(keys[registration_key_fields(name)]) for name in names]
+
@@ -0,0 +1,285 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import requests
+
+
+# A stand-in for the legacy adapter, for repeatable benchmarks of the whole migration on one box.
+# Responses come from recorded fixtures where they exist (optionally recording them from a real adapter
+# first) and are otherwise generated, deterministically, from the request itself.
+
+ROUTES = [
+    ('land_charges_data', re.compile(r'^/land_charges_data/(\d{4}-\d{2}-\d{2})$')),
+    ('land_charges_index', re.compile(r'^/land_charges_index/(\d{4}-\d{2}-\d{2})/(\d{4}-\d{2}-\d{2})$')),
+    ('doc_history', re.compile(r'^/doc_history/([^/]+)$')),
+    ('land_charges', re.compile(r'^/land_charges/([^/]+)$')),
+]
+
+FORENAMES = ['JOHN', 'MARY', 'DAVID', 'SARAH', 'PETER', 'ELIZABETH', 'WILLIAM', 'ANNE', 'GUY', 'MARGARET']
+SURNAMES = ['SMITH', 'JONES', 'WILLIAMS', 'TAYLOR', 'BROWN', 'DAVIES', 'EVANS', 'WILSON', 'THOMAS', 'JOHNSON']
+COMPANIES = ['ACME BUILDERS LIMITED', 'WEST COUNTRY HOMES LTD', 'PLYMOUTH PROPERTIES PLC', 'TAVISTOCK & CO']
+COUNTIES = ['DEVON', 'CORNWALL', 'SOMERSET', 'DORSET', 'CUMBRIA']
+CLASSES = ['C1', 'C1', 'C4', 'D2', 'D2', 'F', 'PAB', 'WOB']
+
+
+def encode_private_name(forenames, surname):
+    # Inverse of routes.extract_simple: strip the punctuation out of the name and record where it
+    # was in two-hex-digit codes (punctuation index in the top three bits, run length in the bottom five)
+    letters = ''
+    codes = ''
+    words = forenames + ['*' + surname]
+    for index, word in enumerate(words):
+        if index > 0:
+            punc = 6 if word.startswith('*') else 1
+            codes += '{:02X}'.format((punc << 5) | len(words[index - 1].lstrip('*')))
+        letters += word.lstrip('*')
+
+    split = max(0, len(letters) - 12)
+    return letters[:split], letters[split:][::-1], codes
+
+
+class SyntheticData(object):
+    def __init__(self, volume=50, skew=0.0, seed='lc-migrator'):
+        self.volume = volume
+        self.skew = skew
+        self.seed = seed
+
+    def rng(self, *parts):
+        return random.Random('|'.join([self.seed] + [str(p) for p in parts]))
+
+    def day_volume(self, day):
+        year = int(day[:4])
+        rng = self.rng('volume', day)
+        scale = max(0.0, 1 + self.skew * (year - 1900) / 100.0)
+        return int(self.volume * scale * rng.uniform(0.5, 1.5))
+
+    def land_charge_row(self, rng, reg_no, date, class_of_charge):
+        row = {
+            'time': date + ' 00:00:00.000000',
+            'registration_no': str(reg_no),
+            'registration_date': date,
+            'class_type': class_of_charge,
+            'priority_notice': ' ',
+            'priority_notice_ref': '',
+            'property_county': rng.choice(COUNTIES),
+            'counties': '',
+            'property': 'LAND AT {} FARM'.format(rng.choice(SURNAMES)),
+            'parish_district': 'PARISH OF {}'.format(rng.choice(SURNAMES)),
+            'amendment_info': '',
+            'occupation': '',
+            'address': '',
+            'name': '',
+            'remainder_name': '',
+            'reverse_name': '',
+            'punctuation_code': '',
+            'reverse_name_hex': ''
+        }
+
+        if class_of_charge in ['PAB', 'WOB']:
+            row['class_type'] = class_of_charge[:2] + '(B)'
+            row['occupation'] = 'CARPENTER'
+            row['address'] = '{} HIGH STREET PLYMOUTH'.format(rng.randint(1, 200))
+            row['amendment_info'] = 'PLYMOUTH COUNTY COURT NO {} OF {}'.format(rng.randint(1, 999), date[:4])
+            row['property_county'] = ''
+
+        if rng.random() < 0.15:
+            row['name'] = rng.choice(COMPANIES)
+            row['reverse_name_hex'] = '000000000000000000000000F1'
+        else:
+            forenames = [rng.choice(FORENAMES) for i in range(rng.randint(1, 2))]
+            remainder, reverse, codes = encode_private_name(forenames, rng.choice(SURNAMES))
+            row['remainder_name'] = remainder
+            row['reverse_name'] = reverse
+            row['punctuation_code'] = codes
+            row['reverse_name_hex'] = reverse.encode('ascii').hex().upper()
+        return row
+
+    def chain(self, reg_no, date, class_of_charge):
+        rng = self.rng('chain', reg_no, date, class_of_charge)
+        history = [{
+            'reg_no': str(reg_no), 'date': date, 'class': class_of_charge, 'type': 'NR',
+            'land_charge': [self.land_charge_row(rng, reg_no, date, class_of_charge)]
+        }]
+
+        when = datetime.strptime(date, '%Y-%m-%d')
+        if class_of_charge not in ['PAB', 'WOB'] and rng.random() < 0.2:
+            when += timedelta(days=rng.randint(30, 3000))
+            am_no = rng.randint(1000, 99999)
+            am_date = when.strftime('%Y-%m-%d')
+            history.append({
+                'reg_no': str(am_no), 'date': am_date, 'class': class_of_charge, 'type': 'AM',
+                'land_charge': [self.land_charge_row(rng, am_no, am_date, class_of_charge)]
+            })
+
+        if rng.random() < 0.1:
+            when += timedelta(days=rng.randint(30, 3000))
+            history.append({
+                'reg_no': str(rng.randint(1000, 99999)), 'date': when.strftime('%Y-%m-%d'),
+                'class': class_of_charge, 'type': 'CN', 'land_charge': None
+            })
+        return history
+
+    def index_entries(self, day):
+        rng = self.rng('day', day)
+        return [(1000 + n, rng.choice(CLASSES)) for n in range(self.day_volume(day))]
+
+    def land_charges_data(self, day):
+        return [self.chain(reg_no, day, coc) for reg_no, coc in self.index_entries(day)]
+
+    def land_charges_index(self, start, end):
+        result = []
+        cdate = datetime.strptime(start, '%Y-%m-%d')
+        edate = datetime.strptime(end, '%Y-%m-%d')
+        while cdate <= edate:
+            day = cdate.strftime('%Y-%m-%d')
+            for reg_no, coc in self.index_entries(day):
+                result.append({'registration_no': str(reg_no), 'registration_date': day, 'class_type': coc})
+            cdate += timedelta(days=1)
+        return result
+
+    def doc_history(self, reg_no, params):
+        return [dict(item, land_charge=None) for item in self.chain(reg_no, params['date'], params['class'])]
+
+    def land_charges(self, reg_no, params):
+        return self.chain(reg_no, params['date'], params['class'])[0]['land_charge']
+
+    def respond(self, endpoint, args, params):
+        if endpoint == 'land_charges_data':
+            return self.land_charges_data(args[0])
+        elif endpoint == 'land_charges_index':
+            return self.land_charges_index(args[0], args[1])
+        elif 'date' not in params or 'class' not in params:
+            return None
+        elif endpoint == 'doc_history':
+            return self.doc_history(args[0], params)
+        else:
+            return self.land_charges(args[0], params)
+
+
+class FixtureStore(object):
+    # Recorded responses live in <directory>/<endpoint>/<path args and query values>.json
+    def __init__(self, directory, upstream=None):
+        self.directory = directory
+        self.upstream = upstream
+
+    def path(self, endpoint, args, params):
+        name = '_'.join(list(args) + [params[k] for k in sorted(params)])
+        return os.path.join(self.directory, endpoint, re.sub(r'[^A-Za-z0-9_\-]', '-', name) + '.json')
+
+    def load(self, endpoint, args, params, path_and_query):
+        path = self.path(endpoint, args, params)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return 200, f.read()
+
+        if self.upstream is None:
+            return None
+
+        response = requests.get(self.upstream.rstrip('/') + path_and_query)
+        if response.status_code == 200:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(response.content)
+        return response.status_code, response.content
+
+
+class StubAdapterServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, synthetic=None, fixtures=None, latency=0.0, jitter=0.0, bandwidth=0,
+                 error_rate=0.0, reset_rate=0.0, seed='lc-migrator'):
+        HTTPServer.__init__(self, address, StubAdapterHandler)
+        self.synthetic = synthetic
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth  # bytes per second; 0 for unlimited
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.faults = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests_served = 0
+
+    def roll(self):
+        with self.lock:
+            self.requests_served += 1
+            return self.faults.random(), self.faults.uniform(-self.jitter, self.jitter)
+
+
+class StubAdapterHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, as the real adapter
+
+    def log_message(self, format, *args):
+        logging.debug('Stub adapter: ' + format, *args)
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if self.server.bandwidth <= 0:
+            self.wfile.write(body)
+            return
+
+        chunk = 16384
+        for offset in range(0, len(body), chunk):
+            piece = body[offset:offset + chunk]
+            self.wfile.write(piece)
+            time.sleep(len(piece) / self.server.bandwidth)
+
+    def do_GET(self):
+        fault, jitter = self.server.roll()
+        delay = self.server.latency + jitter
+        if delay > 0:
+            time.sleep(delay)
+
+        if fault < self.server.reset_rate:
+            self.close_connection = True
+            self.connection.close()
+            return
+        if fault < self.server.reset_rate + self.server.error_rate:
+            self.send_body(500, b'{"error": "injected failure"}')
+            return
+
+        parsed = urlparse(self.path)
+        params = {key: value[0] for key, value in parse_qs(parsed.query).items()}
+        for endpoint, pattern in ROUTES:
+            match = pattern.match(parsed.path)
+            if match is not None:
+                break
+        else:
+            self.send_body(404, b'{"error": "not found"}')
+            return
+
+        args = match.groups()
+        if self.server.fixtures is not None:
+            recorded = self.server.fixtures.load(endpoint, args, params, self.path)
+            if recorded is not None:
+                self.send_body(recorded[0], recorded[1])
+                return
+
+        data = None
+        if self.server.synthetic is not None:
+            data = self.server.synthetic.respond(endpoint, args, params)
+
+        if data is None:
+            self.send_body(404, b'{"error": "not found"}')
+        else:
+            self.send_body(200, json.dumps(data).encode('utf-8'))
+
+
+def start_server(host='localhost', port=0, **kwargs):
+    # Serves on a background thread; returns the server (see server.server_address for the port)
+    server = StubAdapterServer((host, port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever, name='stub-adapter', daemon=True)
+    thread.start()
+    return server
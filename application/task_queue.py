@@ -0,0 +1,114 @@
+import logging
+import os
+import socket
+import time
+import traceback
+from kombu import Connection
+from application.data import close_connection
+
+
+# Queue-driven distribution of migration work: a coordinator publishes partitions (see planner.py) as
+# tasks; any number of worker processes, on any number of hosts, consume and acknowledge them and
+# publish a result for each. A broker is only needed across hosts - on one box the filesystem transport
+# will do, and the memory transport is enough for tests.
+
+TASK_QUEUE = 'lc-migrator-tasks'
+RESULT_QUEUE = 'lc-migrator-results'
+
+
+def connect(config):
+    options = {}
+    if config['TASK_QUEUE_URI'].startswith('filesystem'):
+        folder = config.get('TASK_QUEUE_FOLDER') or os.path.abspath(
+            os.path.join(os.path.dirname(__file__), os.pardir, 'output', 'queue'))
+        # The exchange tables too, or kombu puts them in control/ under the working directory
+        control = os.path.join(folder, 'control')
+        os.makedirs(control, exist_ok=True)
+        options = {'data_folder_in': folder, 'data_folder_out': folder, 'control_folder': control}
+    return Connection(config['TASK_QUEUE_URI'], transport_options=options)
+
+
+def publish_tasks(config, action, partitions):
+    with connect(config) as conn:
+        queue = conn.SimpleQueue(TASK_QUEUE)
+        for partition in partitions:
+            queue.put({
+                'action': action,
+                'start': partition['start'],
+                'end': partition['end'],
+                'volume': partition.get('volume', 0)
+            }, serializer='json')
+        queue.close()
+    logging.info("Published %d %s tasks", len(partitions), action)
+
+
+def run_worker(config, targets, idle_timeout=60):
+    # Consume tasks until none has arrived for idle_timeout seconds (0 to wait forever). A task is only
+    # acknowledged once its result is published, so a broker will redeliver it if this worker dies.
+    worker = "{}:{}".format(socket.gethostname(), os.getpid())
+    completed = 0
+    with connect(config) as conn:
+        tasks = conn.SimpleQueue(TASK_QUEUE)
+        results = conn.SimpleQueue(RESULT_QUEUE)
+        idle_since = time.time()
+        while True:
+            try:
+                message = tasks.get(block=True, timeout=1)
+            except tasks.Empty:
+                if idle_timeout > 0 and time.time() - idle_since > idle_timeout:
+                    break
+                continue
+            except Exception as e:
+                # The filesystem transport can hand a consumer a message that is still being written
+                logging.error('Unreadable task message: %s', str(e))
+                continue
+
+            task = message.payload
+            logging.info("Task %s %s -> %s", task['action'], task['start'], task['end'])
+            result = dict(task, worker=worker, status='ok', error=None, stats=None)
+            start = time.perf_counter()
+            try:
+                if task['action'] not in targets:
+                    raise RuntimeError("Unknown action: '{}'".format(task['action']))
+                result['stats'] = targets[task['action']](config, task['start'], task['end'])
+            except Exception as e:
+                logging.error('Task failed: %s', str(e))
+                logging.error(traceback.format_exc())
+                result['status'] = 'failed'
+                result['error'] = str(e)
+
+            result['seconds'] = time.perf_counter() - start
+            results.put(result, serializer='json')
+            message.ack()
+            completed += 1
+            idle_since = time.time()
+
+        tasks.close()
+        results.close()
+    close_connection()
+    logging.info("Worker %s finished after %d tasks", worker, completed)
+    return completed
+
+
+def collect_results(config, expected, timeout=0):
+    # Wait for 'expected' results (or until nothing has arrived for timeout seconds, if non-zero)
+    collected = []
+    with connect(config) as conn:
+        results = conn.SimpleQueue(RESULT_QUEUE)
+        last = time.time()
+        while len(collected) < expected:
+            try:
+                message = results.get(block=True, timeout=1)
+            except results.Empty:
+                if timeout > 0 and time.time() - last > timeout:
+                    break
+                continue
+
+            result = message.payload
+            message.ack()
+            last = time.time()
+            collected.append(result)
+            logging.info("%s %s -> %s: %s (%s, %.1fs)", result['action'], result['start'], result['end'],
+                         result['status'], result['worker'], result['seconds'])
+        results.close()
+    return collected
@@ -1,6 +1,7 @@
 import re
 import os
 import json
+from application.records import json_default
 
 def convert_class(class_of_charge):
     charge = {
@@ -93,7 +94,7 @@ def save_to_file(data):
     filename = str(data[0]['registration']['registration_no']) + "_" + data[0]['registration']['date'] + '_' + data[0]['class_of_charge'] + '.txt'
     file = os.path.join(directory, filename)
     
-    j = json.dumps(data, sort_keys=True, indent=4)
+    j = json.dumps(data, sort_keys=True, indent=4, default=json_default)
     with open(file, "w+") as txt:
         txt.write(j)
 
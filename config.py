@@ -9,7 +9,77 @@ class Config(object):
 
     PSQL_CONNECTION = os.getenv("PSQL_CONNECTION", "dbname='landcharges' user='landcharges' host='192.168.39.229' password='landcharges'")
     #PSQL_CONNECTION = os.getenv("PSQL_CONNECTION", "dbname='landcharges' user='landcharges' host='localhost' password='lcalpha'")
+    # Seconds a worker's connection may sit idle before it is checked with a trivial query
+    PSQL_HEALTH_CHECK_INTERVAL = float(os.getenv('PSQL_HEALTH_CHECK_INTERVAL', '30'))
+    # PREPARE the per-row statements once per connection (turn off behind a transaction-pooling proxy)
+    PSQL_PREPARED_STATEMENTS = os.getenv('PSQL_PREPARED_STATEMENTS', 'true').lower() == 'true'
 
     LEGACY_ADAPTER_URI = os.getenv('LEGACY_ADAPTER_URL', 'http://10.0.2.2:15007')
     #LEGACY_ADAPTER_URI = os.getenv('LEGACY_ADAPTER_URL', 'http://localhost:5007')
+    LEGACY_POOL_SIZE = int(os.getenv('LEGACY_POOL_SIZE', '4'))
+    LEGACY_CONNECT_TIMEOUT = float(os.getenv('LEGACY_CONNECT_TIMEOUT', '5'))
+    LEGACY_READ_TIMEOUT = float(os.getenv('LEGACY_READ_TIMEOUT', '300'))
+    LEGACY_RETRIES = int(os.getenv('LEGACY_RETRIES', '3'))
+    LEGACY_RETRY_BACKOFF = float(os.getenv('LEGACY_RETRY_BACKOFF', '0.5'))
+    # Decode /land_charges_data one history chain at a time instead of loading the whole day
+    LEGACY_STREAM_JSON = os.getenv('LEGACY_STREAM_JSON', 'false').lower() == 'true'
+    LEGACY_STREAM_CHUNK = int(os.getenv('LEGACY_STREAM_CHUNK', '65536'))
+    # Local response cache: off, read-through, replay (offline) or refresh. Defaults to output/cache.
+    LEGACY_CACHE_MODE = os.getenv('LEGACY_CACHE_MODE', 'off')
+    LEGACY_CACHE_DIR = os.getenv('LEGACY_CACHE_DIR', '')
+    LEGACY_CACHE_MAX_MB = int(os.getenv('LEGACY_CACHE_MAX_MB', '2048'))
+
+    # Overlap legacy adapter reads, transformation and database writes
+    MIGRATION_PIPELINE = os.getenv('MIGRATION_PIPELINE', 'false').lower() == 'true'
+    MIGRATION_PREFETCH_DEPTH = int(os.getenv('MIGRATION_PREFETCH_DEPTH', '500'))  # history chains
+    MIGRATION_WRITE_QUEUE = int(os.getenv('MIGRATION_WRITE_QUEUE', '4'))  # batches
+    # Just the database writes on a thread of their own (implied by MIGRATION_PIPELINE)
+    MIGRATION_ASYNC_WRITE = os.getenv('MIGRATION_ASYNC_WRITE', 'false').lower() == 'true'
+
+    # Journal of committed chains/completed days (default output/journal), and resuming from it (a resumed run
+    # journals its own progress too)
+    MIGRATION_JOURNAL = os.getenv('MIGRATION_JOURNAL', 'false').lower() == 'true'
+    MIGRATION_JOURNAL_DIR = os.getenv('MIGRATION_JOURNAL_DIR', '')
+    MIGRATION_JOURNAL_FSYNC = os.getenv('MIGRATION_JOURNAL_FSYNC', 'false').lower() == 'true'
+    MIGRATION_RESUME = os.getenv('MIGRATION_RESUME', 'false').lower() == 'true'
+
+    # Name keys kept per worker (least recently used dropped first); 0 to generate every one afresh
+    MIGRATION_KEY_CACHE_SIZE = int(os.getenv('MIGRATION_KEY_CACHE_SIZE', '100000'))
+
+    # Hold transformed records in slotted classes rather than dicts while they wait to be written
+    MIGRATION_COMPACT_RECORDS = os.getenv('MIGRATION_COMPACT_RECORDS', 'false').lower() == 'true'
+
+    # Chains already in migration_status: 'off' (write them again regardless), 'skip' (complete ones; partial
+    # ones are replaced) or 'replace' (delete and migrate again)
+    MIGRATION_RERUN = os.getenv('MIGRATION_RERUN', 'off')
+
+    # 'row' writes each entry with its own statements; 'cte' writes each entry as one statement of chained
+    # CTEs; 'bulk' loads each batch with multi-row statements, taking ids from the sequences
+    # MIGRATION_ID_BLOCK at a time
+    MIGRATION_WRITE_MODE = os.getenv('MIGRATION_WRITE_MODE', 'row')
+    MIGRATION_ID_BLOCK = int(os.getenv('MIGRATION_ID_BLOCK', '1000'))
+    # New registration numbers are reserved per year this many at a time
+    MIGRATION_REG_NO_BLOCK = int(os.getenv('MIGRATION_REG_NO_BLOCK', '100'))
+
+    # Transaction per 'entry' (each register entry), 'chain', 'batch', or a number of chains. Chains are
+    # all-or-nothing with any unit but entry, isolated from each other by savepoints.
+    MIGRATION_COMMIT_UNIT = os.getenv('MIGRATION_COMMIT_UNIT', 'entry')
+
+    # Drop the secondary indexes and foreign keys on the migration's tables for the run and rebuild them
+    # (MIGRATION_BULK_LOAD_RESTORE_WORKERS at a time) at the end; the DDL is kept meanwhile in
+    # MIGRATION_BULK_LOAD_DIR (default output/bulk_load). MIGRATION_BULK_LOAD_KEEP names indexes to leave.
+    MIGRATION_BULK_LOAD = os.getenv('MIGRATION_BULK_LOAD', 'false').lower() == 'true'
+    MIGRATION_BULK_LOAD_DIR = os.getenv('MIGRATION_BULK_LOAD_DIR', '')
+    MIGRATION_BULK_LOAD_KEEP = [name for name in os.getenv('MIGRATION_BULK_LOAD_KEEP', '').split(',') if name != '']
+    MIGRATION_BULK_LOAD_RESTORE_WORKERS = int(os.getenv('MIGRATION_BULK_LOAD_RESTORE_WORKERS', '4'))
+    MIGRATION_BULK_LOAD_WORK_MEM = os.getenv('MIGRATION_BULK_LOAD_WORK_MEM', '')  # e.g. 1GB, for the rebuild
+
+    # Task queue for distribute.py/worker.py; filesystem:// keeps it on one host (TASK_QUEUE_FOLDER,
+    # default output/queue), anything else (e.g. the AMQP broker) spreads it across hosts
+    TASK_QUEUE_URI = os.getenv('TASK_QUEUE_URI', 'filesystem://')
+    TASK_QUEUE_FOLDER = os.getenv('TASK_QUEUE_FOLDER', '')
+
+    # check.py writes the index entries it can't find to a TSV file per range here (default output/check)
+    CHECK_OUTPUT_DIR = os.getenv('CHECK_OUTPUT_DIR', '')
+
     LAND_CHARGES_URI = os.getenv('LAND_CHARGES_URL', 'http://localhost:5004')
@@ -0,0 +1,57 @@
+import sys
+from log.logger import setup_logging
+import importlib
+import os
+from application.planner import get_day_volumes, plan_partitions
+from application.task_queue import publish_tasks, collect_results
+from application.metrics import merge_reports, write_report, log_report
+from application.bulk_load import begin_bulk_load
+import time
+
+# Coordinator for queue-driven runs: plans the partitions, publishes them as tasks for worker.py
+# processes (on this or any other host sharing TASK_QUEUE_URI) and waits for every result.
+#   python3 distribute.py migrate 1990-01-01 1999-12-31
+
+cfg = 'Config'
+c = getattr(importlib.import_module('config'), cfg)
+config = {}
+
+for key in dir(c):
+    if key.isupper():
+        config[key] = getattr(c, key)
+
+setup_logging(config)
+
+
+if len(sys.argv) < 4 or sys.argv[1] not in ['migrate', 'check']:
+    print('Usage: distribute.py migrate|check <start date> <end date>')
+    exit()
+
+action = sys.argv[1]
+s = sys.argv[2]
+e = sys.argv[3]
+
+run_start = time.perf_counter()
+partition_count = int(os.getenv("TASK_PARTITIONS", '64'))
+partitions = plan_partitions(get_day_volumes(config, s, e), partition_count)
+
+# Bulk-load mode (migrate only): the indexes are rebuilt once every result is in, or collecting gives up
+bulk_load = begin_bulk_load(config) if action == 'migrate' and config['MIGRATION_BULK_LOAD'] else None
+try:
+    publish_tasks(config, action, partitions)
+    results = collect_results(config, len(partitions), int(os.getenv("RESULT_TIMEOUT", '0')))
+finally:
+    bulk_timings = bulk_load.finish() if bulk_load is not None else None
+
+failed = [r for r in results if r['status'] != 'ok']
+print("{} of {} tasks complete, {} failed".format(len(results), len(partitions), len(failed)))
+for result in failed:
+    print("  {} {} -> {}: {}".format(result['action'], result['start'], result['end'], result['error']))
+
+if action == 'migrate':
+    report = merge_reports([r['stats'] for r in results if r['stats'] is not None] +
+                           [r for r in failed if r['stats'] is None], time.perf_counter() - run_start)
+    if bulk_timings is not None:
+        report['bulk_load'] = bulk_timings
+    log_report(report)
+    print("Run report written to {}".format(write_report(report)))
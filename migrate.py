@@ -1,12 +1,14 @@
 import sys
-import time
-from datetime import datetime, timedelta
-import math
 from log.logger import setup_logging
 import importlib
 import os
 from application.routes import migrate
-from multiprocessing import Process
+from application.planner import get_day_volumes, plan_partitions, partition_worker
+from application.metrics import merge_reports, write_report, log_report
+from application.bulk_load import begin_bulk_load
+from multiprocessing import Process, Queue
+import time
+import queue
 
 exit(1)
 
@@ -20,6 +22,11 @@ for key in dir(c):
 
 setup_logging(config)
 
+# --resume skips days and chains already recorded in the migration journal
+if '--resume' in sys.argv:
+    sys.argv.remove('--resume')
+    config['MIGRATION_RESUME'] = True
+
 
 if len(sys.argv) < 3:
     print('Insuffcient parameters specified')
@@ -29,36 +36,51 @@ s = sys.argv[1]
 e = sys.argv[2]
 
 
-sd = datetime.fromtimestamp(time.mktime(time.strptime(s, '%Y-%m-%d')))
-ed = datetime.fromtimestamp(time.mktime(time.strptime(e, '%Y-%m-%d')))
-days = (ed - sd).days
-
-# Slightly buggy: this will slice to a minimum of 1 day, so if there are too many slices it'll increase the width
-# of the range.
+# Partitions are balanced by registration volume (from the legacy index) rather than by width; there are
+# several per worker, and each worker takes the next one off the queue whenever it finishes its last.
 slices = int(os.getenv("MIGRATOR_WORKERS", '8'))
-day_slice = math.floor(days / slices)
-
-ranges = []  # {start: x, end: y}
-for x in range(0, slices):
-    if x == 0:
-        start = sd
-    else:
-        start = ranges[x - 1]['end'] + timedelta(days=1)
-
-    if x == slices - 1:
-        end = ed
-    else:
-        end = start + timedelta(days=day_slice)
-
-    ranges.append({
-        'start': start,
-        'end': end
-    })
-
-for r in ranges:
-    name = "Migrate {} -> {}".format(r['start'].strftime('%Y-%m-%d'), r['end'].strftime('%Y-%m-%d'))
-    print(name)
-    p = Process(target=migrate,
-                args=(config, r['start'].strftime('%Y-%m-%d'), r['end'].strftime('%Y-%m-%d')),
-                name=name)
-    p.start()
+partitions_per_worker = int(os.getenv("PARTITIONS_PER_WORKER", '8'))
+
+run_start = time.perf_counter()
+partitions = plan_partitions(get_day_volumes(config, s, e), slices * partitions_per_worker)
+
+# In bulk-load mode the indexes come off before any worker starts, and go back on (timed) once they've all
+# finished, whatever happened to them
+bulk_load = begin_bulk_load(config) if config['MIGRATION_BULK_LOAD'] else None
+try:
+    tasks = Queue()
+    results = Queue()
+    for partition in partitions:
+        print("Migrate {} -> {} ({})".format(partition['start'], partition['end'], partition['volume']))
+        tasks.put(partition)
+
+    for x in range(0, slices):
+        tasks.put(None)
+
+    workers = []
+    for x in range(0, slices):
+        p = Process(target=partition_worker, args=(migrate, config, tasks, results), name="Migrate worker {}".format(x))
+        p.start()
+        workers.append(p)
+
+    # Every partition reports back exactly once, even if it failed. Drain the results before joining: a
+    # worker can't exit while its results are still queued.
+    reports = []
+    while len(reports) < len(partitions):
+        try:
+            reports.append(results.get(timeout=5))
+        except queue.Empty:
+            if not any(p.is_alive() for p in workers):
+                print("Workers exited with {} partitions unreported".format(len(partitions) - len(reports)))
+                break
+
+    for p in workers:
+        p.join()
+finally:
+    bulk_timings = bulk_load.finish() if bulk_load is not None else None
+
+report = merge_reports(reports, time.perf_counter() - run_start)
+if bulk_timings is not None:
+    report['bulk_load'] = bulk_timings
+log_report(report)
+print("Run report written to {}".format(write_report(report)))
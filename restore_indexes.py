@@ -0,0 +1,17 @@
+from log.logger import setup_logging
+import importlib
+from application.bulk_load import restore_pending
+
+# Puts back the indexes and foreign keys that a bulk load (MIGRATION_BULK_LOAD) dropped and didn't get
+# to restore, from the DDL it saved. Safe to run again if it fails part way.
+
+cfg = 'Config'
+c = getattr(importlib.import_module('config'), cfg)
+config = {}
+
+for key in dir(c):
+    if key.isupper():
+        config[key] = getattr(c, key)
+
+setup_logging(config)
+restore_pending(config)
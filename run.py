@@ -2,11 +2,17 @@ import config
 import importlib
 import os
 from application.routes import migrate
+from application.bulk_load import begin_bulk_load
 from log.logger import setup_logging
 import sys
 
 exit(1)
 
+# --resume skips days and chains already recorded in the migration journal
+resume = '--resume' in sys.argv
+if resume:
+    sys.argv.remove('--resume')
+
 if len(sys.argv) < 3:
     print('Insuffcient parameters specified')
     exit()
@@ -23,7 +29,15 @@ for key in dir(c):
     if key.isupper():
         config[key] = getattr(c, key)
 
+if resume:
+    config['MIGRATION_RESUME'] = True
+
 setup_logging(config)
-migrate(config, s, e)
+bulk_load = begin_bulk_load(config) if config['MIGRATION_BULK_LOAD'] else None
+try:
+    migrate(config, s, e)
+finally:
+    if bulk_load is not None:
+        bulk_load.finish()
 
 
@@ -0,0 +1,40 @@
+import argparse
+import logging
+from application.stub_adapter import StubAdapterServer, SyntheticData, FixtureStore
+
+
+# Local stand-in for the legacy adapter. Point LEGACY_ADAPTER_URL at it, e.g.:
+#   python3 stub_adapter.py --port 15007 --volume 200 --latency 0.05 --error-rate 0.01
+#   LEGACY_ADAPTER_URL=http://localhost:15007 python3 run.py 1990-01-01 1990-12-31
+
+parser = argparse.ArgumentParser(description='Legacy adapter stand-in for offline benchmarking')
+parser.add_argument('--host', default='localhost')
+parser.add_argument('--port', type=int, default=15007)
+parser.add_argument('--fixtures', help='Directory of recorded responses to serve')
+parser.add_argument('--record', metavar='URL', help='Fetch and record fixtures missing from --fixtures from this adapter')
+parser.add_argument('--no-synthetic', action='store_true', help='404 anything without a fixture')
+parser.add_argument('--volume', type=int, default=50, help='Average synthetic chains per day')
+parser.add_argument('--skew', type=float, default=0.0, help='Synthetic volume growth per century since 1900')
+parser.add_argument('--seed', default='lc-migrator')
+parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+parser.add_argument('--jitter', type=float, default=0.0, help='Random +/- seconds added to the latency')
+parser.add_argument('--bandwidth', type=int, default=0, help='Bytes per second per response; 0 is unlimited')
+parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 500')
+parser.add_argument('--reset-rate', type=float, default=0.0, help='Fraction of connections dropped unanswered')
+args = parser.parse_args()
+
+if args.record and not args.fixtures:
+    parser.error('--record needs --fixtures')
+
+logging.basicConfig(level=logging.INFO)
+synthetic = None if args.no_synthetic else SyntheticData(args.volume, args.skew, args.seed)
+fixtures = FixtureStore(args.fixtures, args.record) if args.fixtures else None
+
+server = StubAdapterServer((args.host, args.port), synthetic=synthetic, fixtures=fixtures, latency=args.latency,
+                           jitter=args.jitter, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                           reset_rate=args.reset_rate, seed=args.seed)
+print("Stub legacy adapter on http://{}:{}".format(args.host, server.server_address[1]))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
@@ -0,0 +1,133 @@
+import copy
+import application.data as data
+from application.bulk_insert import BulkBatch, IdAllocator, stage_batch
+
+
+class FakeCursor(object):
+    # Hands out ids per table as the sequences would, and records every row written
+    def __init__(self):
+        self.ids = {}
+        self.rows = {}
+        self.cancelled = []
+        self.uncommitted = []
+        self.result = []
+        self.connection = self
+
+    def cursor(self, cursor_factory=None):
+        return self
+
+    def next_id(self, table):
+        self.ids[table] = self.ids.get(table, 0) + 1
+        return self.ids[table]
+
+    def execute(self, sql, params=None):
+        if sql.startswith('INSERT INTO'):
+            table = sql.split()[2]
+            row = dict(params, id=self.next_id(table))
+            self.uncommitted.append((table, row))
+            self.result = [[row['id']]]
+        elif sql.startswith('SELECT nextval'):
+            self.result = [{'id': self.next_id(params['table'])} for n in range(params['count'])]
+        elif sql.startswith('SELECT id FROM county'):
+            self.result = [{'id': 7}]
+        elif sql == 'SAVEPOINT chain':
+            self.savepoint = len(self.uncommitted)
+        elif sql == 'ROLLBACK TO SAVEPOINT chain':
+            self.uncommitted = self.uncommitted[:self.savepoint]
+        elif sql.startswith('UPDATE register_details'):
+            self.uncommitted.append((None, (params['id'], params['canc'])))
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        for table, row in self.uncommitted:
+            if table is None:
+                self.cancelled.append(row)
+            else:
+                self.rows.setdefault(table, []).append(row)
+        self.uncommitted = []
+
+    def rollback(self):
+        self.uncommitted = []
+
+    def close(self):
+        pass
+
+
+def entry(reg_no, date, entry_type, coc='C1', county='DEVON', parties=True):
+    record = {
+        'class_of_charge': coc,
+        'type': entry_type,
+        'registration': {'date': date, 'registration_no': reg_no},
+        'parties': [],
+        'applicant': {'name': '', 'address': '', 'key_number': '', 'reference': ''},
+        'additional_information': '',
+        'migration_data': {'unconverted_reg_no': reg_no, 'flags': []},
+        'particulars': {'counties': [county], 'district': 'PLYMOUTH', 'description': 'LAND'}
+    }
+    if parties:
+        record['parties'] = [{
+            'type': 'Estate Owner',
+            'addresses': [{'type': 'Residence', 'address_string': '1 HIGH STREET'}],
+            'names': [{'type': 'Private Individual', 'private': {'forenames': ['JOHN'], 'surname': 'SMITH'}}]
+        }]
+    return record
+
+
+def chains():
+    return [
+        [entry('100', '1990-01-01', 'NR'), entry('200', '1991-01-01', 'AM'),
+         entry('300', '1992-01-01', 'CN', parties=False)],
+        [entry('101', '1990-01-01', 'NR', county='NOWHERE')],
+        [entry('102', '1990-01-01', 'NR', coc='WO(B)')],
+        [entry('103', '1990-01-01', 'NR'), entry('201', '1991-01-01', 'AM', county='NOWHERE'),
+         entry('301', '1992-01-01', 'CN', parties=False)],
+    ]
+
+
+def migrate_both(monkeypatch, unit):
+    row_cursor = FakeCursor()
+    monkeypatch.setattr(data, 'connect_to_psql', lambda conn_str=None: row_cursor)
+    monkeypatch.setattr(data, 'shared_connection', None)
+    row_lookup = {'DEVON': 7}
+
+    def county_id(cursor, county):
+        if county not in row_lookup:
+            raise RuntimeError("Invalid county: '{}'".format(county))
+        return row_lookup[county]
+
+    monkeypatch.setattr(data, 'get_county_id', county_id)
+    monkeypatch.setattr('application.bulk_insert.get_county_id', county_id)
+    row_failures = data.migrate_record({'PSQL_CONNECTION': '', 'MIGRATION_COMMIT_UNIT': unit}, chains())
+
+    bulk_cursor = FakeCursor()
+    batch = BulkBatch({}, bulk_cursor, IdAllocator(1))
+    bulk_failures = stage_batch(batch, bulk_cursor, chains(), unit != 'entry')
+
+    assert row_failures == bulk_failures
+    for table in data_tables(row_cursor.rows, batch.rows):
+        assert row_cursor.rows.get(table, []) == batch.rows[table], table
+    assert [c for c in row_cursor.cancelled if c[0] is not None] == batch.cancelled
+    return row_cursor, bulk_failures
+
+
+def test_bulk_matches_row_by_row(monkeypatch):
+    cursor, failures = migrate_both(monkeypatch, 'entry')
+    # The failed amendment leaves the head of its chain in place (and fails the cancellation after it)
+    assert [f['number'] for f in failures] == ['101', '201', '301']
+    assert [r['original_regn_no'] for r in cursor.rows['migration_status']] == ['100', '200', '102', '103']
+
+
+def test_failed_chain_is_rolled_back(monkeypatch):
+    for unit in ['chain', 'batch', '2']:
+        cursor, failures = migrate_both(monkeypatch, unit)
+        assert [f['number'] for f in failures] == ['101', '201']
+        assert [r['original_regn_no'] for r in cursor.rows['migration_status']] == ['100', '200', '102']
+
+
+def data_tables(*sets):
+    return sorted(set(table for rows in sets for table in rows if len(rows[table]) > 0))
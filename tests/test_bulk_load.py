@@ -0,0 +1,116 @@
+import os
+import threading
+import psycopg2
+import pytest
+import application.bulk_load as bulk_load
+from application.bulk_load import begin_bulk_load, restore_pending, read_ddl, INDEXES, FOREIGN_KEYS, NOT_OWNED
+
+INDEX = ('DROP INDEX ix_party_name', 'CREATE INDEX ix_party_name ON public.party_name USING btree (searchable_string)')
+FOREIGN_KEY = ('ALTER TABLE register DROP CONSTRAINT register_details_fk',
+               'ALTER TABLE register ADD CONSTRAINT register_details_fk FOREIGN KEY (details_id) '
+               'REFERENCES register_details(id)')
+
+
+class DuplicateIndex(psycopg2.Error):
+    pgcode = '42P07'
+
+
+class FakeDatabase(object):
+    def __init__(self, not_owned=None):
+        self.not_owned = not_owned or []
+        self.executed = []
+        self.fail = set()
+        self.exists = set()
+        self.committed = False
+        self.lock = threading.Lock()
+
+    def connect(self, conn_str):
+        return FakeConnection(self)
+
+
+class FakeConnection(object):
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+        self.autocommit = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        if sql == NOT_OWNED:
+            self.result = [(name,) for name in self.db.not_owned]
+        elif sql == INDEXES:
+            self.result = [INDEX]
+        elif sql == FOREIGN_KEYS:
+            self.result = [FOREIGN_KEY]
+        elif sql in self.db.fail:
+            raise RuntimeError('could not create index')
+        elif sql in self.db.exists:
+            raise DuplicateIndex('already exists')
+        else:
+            with self.db.lock:
+                self.db.executed.append(sql)
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        self.db.committed = True
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(bulk_load.psycopg2, 'connect', db.connect)
+    return db
+
+
+def config(tmpdir):
+    return {'PSQL_CONNECTION': '', 'MIGRATION_BULK_LOAD_DIR': str(tmpdir)}
+
+
+class TestBulkLoad:
+    def test_drop_then_restore(self, db, tmpdir):
+        load = begin_bulk_load(config(tmpdir))
+        assert db.executed == [FOREIGN_KEY[0], INDEX[0]] and db.committed
+        assert read_ddl(load.path) == [INDEX[1], FOREIGN_KEY[1]]
+
+        timings = load.finish()
+        assert db.executed[2:] == [INDEX[1], FOREIGN_KEY[1]]
+        assert not os.path.exists(load.path)
+        assert set(timings) == {'capture', 'drop', 'load', 'restore_indexes', 'restore_constraints'}
+
+    def test_refuses_while_restore_pending(self, db, tmpdir):
+        load = begin_bulk_load(config(tmpdir))
+        with pytest.raises(RuntimeError):
+            begin_bulk_load(config(tmpdir))
+        assert db.executed == [FOREIGN_KEY[0], INDEX[0]]
+        assert os.path.exists(load.path)
+
+    def test_refuses_tables_it_cannot_rebuild(self, db, tmpdir):
+        db.not_owned = ['register']
+        with pytest.raises(RuntimeError):
+            begin_bulk_load(config(tmpdir))
+        assert db.executed == [] and not db.committed
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_failed_restore_stays_pending(self, db, tmpdir):
+        load = begin_bulk_load(config(tmpdir))
+        db.fail.add(INDEX[1])
+        with pytest.raises(RuntimeError):
+            load.finish()
+        assert read_ddl(load.path) == [INDEX[1], FOREIGN_KEY[1]]
+
+        # Put right by hand meanwhile: an index that already exists counts as restored
+        db.fail.clear()
+        db.exists.add(INDEX[1])
+        restore_pending(config(tmpdir))
+        assert db.executed[-1] == FOREIGN_KEY[1]
+        assert not os.path.exists(load.path)
@@ -0,0 +1,63 @@
+import application.routes as routes
+
+INDEX = [
+    {'registration_no': '1234', 'registration_date': '1990-01-02', 'class_type': 'C(I)'},
+    {'registration_no': '12/34 ', 'registration_date': '1990-01-02', 'class_type': 'PA(B)'},
+    {'registration_no': 'A\tB', 'registration_date': '1990-01-03', 'class_type': 'D(II)'}
+]
+
+
+class FakeResponse(object):
+    def json(self):
+        return INDEX
+
+
+class FakeCursor(object):
+    def __init__(self):
+        self.statements = []
+        self.copied = None
+        self.result = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+        if sql == routes.CHECK_MISSING:
+            self.result = [(1,), (2,)]
+
+    def copy_expert(self, sql, data):
+        self.statements.append(sql)
+        self.copied = data.read()
+
+    def fetchall(self):
+        return self.result
+
+
+class TestCheck:
+    def test_check_reports_missing_entries(self, monkeypatch, tmpdir):
+        cursor = FakeCursor()
+        monkeypatch.setattr(routes, 'get_from_legacy_adapter', lambda url, headers: FakeResponse())
+        monkeypatch.setattr(routes, 'get_connection', lambda config: None)
+        monkeypatch.setattr(routes, 'release_connection', lambda conn: None)
+        monkeypatch.setattr(routes, 'create_cursor', lambda conn: cursor)
+        monkeypatch.setattr(routes, 'commit', lambda cursor: None)
+        monkeypatch.setattr(routes, 'close_cursor', lambda cursor: None)
+
+        stats = routes.check({'LEGACY_ADAPTER_URI': '', 'CHECK_OUTPUT_DIR': str(tmpdir)}, '1990-01-01', '1990-12-31')
+
+        # One COPY and one anti-join for the whole range
+        assert len([sql for sql in cursor.statements if sql.startswith('COPY')]) == 1
+        assert cursor.statements.count(routes.CHECK_MISSING) == 1
+        assert cursor.copied.split('\n') == [
+            '0\t1234\t1234\t1990-01-02\tC1\tFalse',
+            '1\t12/34\t1234\t1990-01-02\tPAB\tTrue',
+            '2\tA\\tB\t\\N\t1990-01-03\tD2\tTrue',
+            ''
+        ]
+
+        assert stats['checked'] == 3 and stats['missing'] == 2
+        with open(stats['file']) as f:
+            assert f.read().split('\n') == [
+                'registration_no\tregistration_date\tclass_type',
+                '12/34 \t1990-01-02\tPA(B)',
+                'A\\tB\t1990-01-03\tD(II)',
+                ''
+            ]
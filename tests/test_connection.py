@@ -0,0 +1,65 @@
+import application.data as data
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = 0
+        self.healthy = True
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        if not self.healthy:
+            raise data.psycopg2.OperationalError('server closed the connection unexpectedly')
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class TestSharedConnection:
+    def setup_method(self, method):
+        data.shared_connection = None
+        self.opened = []
+
+    def teardown_method(self, method):
+        data.shared_connection = None
+
+    def connect(self, conn_str=None):
+        self.opened.append(FakeConnection())
+        return self.opened[-1]
+
+    def test_connection_is_reused(self, monkeypatch):
+        monkeypatch.setattr(data, 'connect_to_psql', self.connect)
+        config = {'PSQL_CONNECTION': '', 'PSQL_HEALTH_CHECK_INTERVAL': 30}
+        first = data.get_connection(config)
+        data.release_connection(first)
+        assert data.get_connection(config) is first
+        assert len(self.opened) == 1
+
+    def test_dropped_connection_is_replaced(self, monkeypatch):
+        monkeypatch.setattr(data, 'connect_to_psql', self.connect)
+        config = {'PSQL_CONNECTION': '', 'PSQL_HEALTH_CHECK_INTERVAL': 30}
+        first = data.get_connection(config)
+        first.closed = 2
+        assert data.get_connection(config) is not first
+
+    def test_idle_connection_is_checked(self, monkeypatch):
+        monkeypatch.setattr(data, 'connect_to_psql', self.connect)
+        config = {'PSQL_CONNECTION': '', 'PSQL_HEALTH_CHECK_INTERVAL': 0}
+        first = data.get_connection(config)
+        assert data.get_connection(config) is first
+        first.healthy = False
+        second = data.get_connection(config)
+        assert second is not first and first.closed == 1
+
+    def test_forked_worker_connects_afresh(self, monkeypatch):
+        monkeypatch.setattr(data, 'connect_to_psql', self.connect)
+        config = {'PSQL_CONNECTION': '', 'PSQL_HEALTH_CHECK_INTERVAL': 30}
+        first = data.get_connection(config)
+        monkeypatch.setattr(data, 'shared_connection_pid', -1)
+        assert data.get_connection(config) is not first
+        assert first.closed == 0
@@ -0,0 +1,62 @@
+import application.data as data
+from application.cte_insert import migrate_entry
+from tests.test_bulk_insert import entry
+
+
+class FakeCursor(object):
+    def __init__(self):
+        self.statements = []
+        self.connection = self
+        self.closed = 0
+
+    def cursor(self, cursor_factory=None):
+        return self
+
+    def mogrify(self, template, params):
+        value = params[0]
+        return b'NULL' if value is None else "'{}'".format(value).encode('utf-8')
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql.decode('utf-8'))
+
+    def fetchone(self):
+        return [10 * len(self.statements), 10 * len(self.statements) + 1]
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestCteInsert:
+    def test_one_statement_per_entry(self, monkeypatch):
+        cursor = FakeCursor()
+        monkeypatch.setattr(data, 'connect_to_psql', lambda conn_str=None: cursor)
+        monkeypatch.setattr(data, 'shared_connection', None)
+        monkeypatch.setattr(data, 'get_county_id', lambda cursor, county: 7)
+        monkeypatch.setattr('application.bulk_insert.get_county_id', lambda cursor, county: 7)
+
+        chain = [entry('100', '1990-01-01', 'NR'), entry('200', '1991-01-01', 'AM'),
+                 entry('300', '1992-01-01', 'CN', parties=False)]
+        failures = data.migrate_record({'PSQL_CONNECTION': ''}, [chain], migrate_entry)
+
+        assert failures == []
+        assert len(cursor.statements) == 3
+        assert [reg['details_id'] for reg in chain] == [10, 20, 30]
+
+        head = cursor.statements[0]
+        assert "register_details_1 AS (INSERT INTO register_details (request_id," in head
+        assert "SELECT request_0.id, 'C1'" in head
+        assert "INSERT INTO migration_status (register_id," in head
+        assert head.endswith("SELECT register_details_1.id, request_0.id FROM register_details_1, request_0")
+
+        # The amendment points back at the head and marks it cancelled by its own request
+        assert "'Amendment'" in cursor.statements[1] and ", '10', " in cursor.statements[1]
+        assert "SET cancelled_by = request_0.id FROM request_0 WHERE register_details.id = '10'" in \
+            cursor.statements[1]
+        assert "SET cancelled_by = register_details_1.id FROM register_details_1 " \
+               "WHERE register_details.id = '20'" in cursor.statements[2]
@@ -0,0 +1,24 @@
+from application.journal import Journal, load_journals, chain_key
+
+
+def chain(reg_no, date):
+    return [{'registration': {'registration_no': reg_no, 'date': date}}]
+
+
+class TestJournal:
+    def test_failed_chain_keeps_day_open(self, tmpdir):
+        journal = Journal(str(tmpdir), 'test')
+        registrations = [chain('100', '2001-01-01'), chain('101', '2001-01-01'), chain('200', '2001-01-02')]
+        keys = [('2001-01-01', 'a'), ('2001-01-01', 'b'), ('2001-01-02', 'c')]
+        failures = [{'number': '101', 'date': '2001-01-01', 'message': 'oops'}]
+        journal.record_batch(registrations, keys, failures, ['2001-01-01', '2001-01-02'])
+        journal.close()
+
+        assert load_journals(str(tmpdir)) == ({'2001-01-02'}, {'a', 'c'})
+
+    def test_torn_lines_are_ignored(self, tmpdir):
+        tmpdir.join('other_1.log').write("C\t2001-01-01\tx\nD\t2001-01-01\nC\t2001-0")
+        assert load_journals(str(tmpdir)) == ({'2001-01-01'}, {'x'})
+
+    def test_chain_key(self):
+        assert chain_key([{'reg_no': '1416', 'date': '2002-04-16', 'class': 'D2'}]) == '2002-04-16/1416/D2'
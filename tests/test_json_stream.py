@@ -0,0 +1,32 @@
+import pytest
+import json
+from application.json_stream import iter_array
+
+
+test_documents = [
+    [],
+    [[{"reg_no": "1416", "date": "2002-04-16", "land_charge": None}]],
+    [[{"name": "O'BRIEN [JNR] {X}", "esc": "quote \" and slash \\\\", "n": 12.5}], [], [1, True, None]],
+    ["a ] string", 42, -1.5e3, None, False, {"nested": [[[]]]}],
+    [[{"name": "CAFÉ ☃", "address": "23 WILLIAM PRANCE ROAD, PLYMOUTH"}] * 20]
+]
+
+
+def split_into(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestJsonStream:
+    def test_matches_json_loads(self):
+        for document in test_documents:
+            data = json.dumps(document, ensure_ascii=False, indent=1).encode('utf-8')
+            for size in [1, 2, 3, 7, 64, len(data) + 1]:
+                assert list(iter_array(split_into(data, size))) == document
+
+    def test_truncated_document(self):
+        with pytest.raises(ValueError):
+            list(iter_array([b'[[1, 2], [3']))
+
+    def test_not_an_array(self):
+        with pytest.raises(ValueError):
+            list(iter_array([b'{"a": 1}']))
@@ -0,0 +1,101 @@
+import types
+import pytest
+import requests
+import application.legacy_adapter as legacy_adapter
+from application.legacy_adapter import LegacyAdapterClient, get_client
+from application.response_cache import ResponseCache, CacheMiss
+from application.stub_adapter import start_server, SyntheticData
+
+
+class Faults(object):
+    # Stands in for the stub server's random faults: the first 'failures' requests get a 500
+    def __init__(self, failures):
+        self.failures = failures
+
+    def random(self):
+        self.failures -= 1
+        return 0.0 if self.failures >= 0 else 1.0
+
+    def uniform(self, low, high):
+        return 0.0
+
+
+def serve(monkeypatch, failures):
+    server = start_server(synthetic=SyntheticData(volume=5), error_rate=0.5)
+    server.faults = Faults(failures)
+    sleeps = []
+    monkeypatch.setattr(requests.packages.urllib3.util.retry, 'time',
+                        types.SimpleNamespace(sleep=sleeps.append, time=lambda: 0))
+    return server, 'http://localhost:{}'.format(server.server_address[1]), sleeps
+
+
+class TestLegacyAdapterClient:
+    def test_server_errors_are_retried(self, monkeypatch):
+        server, base, sleeps = serve(monkeypatch, 2)
+        try:
+            client = LegacyAdapterClient(base, retries=3, backoff=0.5)
+            response = client.get(base + '/land_charges_data/1990-05-01')
+            assert response.status_code == 200 and len(response.json()) > 0
+            assert server.requests_served == 3
+            assert sleeps == [1.0]  # The first retry goes straight away
+            client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_last_response_returned_when_retries_run_out(self, monkeypatch):
+        server, base, sleeps = serve(monkeypatch, 10)
+        try:
+            client = LegacyAdapterClient(base, retries=3, backoff=0.5)
+            response = client.get(base + '/land_charges_data/1990-05-01')
+            assert response.status_code == 500
+            assert response.json() == {'error': 'injected failure'}
+            assert server.requests_served == 4
+            # Exponential backoff, from the second retry on
+            assert sleeps == [1.0, 2.0]
+            assert client.stats['land_charges_data']['calls'] == 1
+            client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_client_rebuilt_after_fork(self, monkeypatch):
+        config = {'LEGACY_ADAPTER_URI': 'http://localhost:1'}
+        monkeypatch.setattr(legacy_adapter, 'client', None)
+        monkeypatch.setattr(legacy_adapter.os, 'getpid', lambda: 100)
+        parent = get_client(config)
+        assert get_client(config) is parent
+
+        monkeypatch.setattr(legacy_adapter.os, 'getpid', lambda: 200)
+        child = get_client(config)
+        assert child is not parent and child.session is not parent.session
+        assert get_client(config) is child
+
+    def test_cached_responses(self, monkeypatch, tmpdir):
+        server, base, sleeps = serve(monkeypatch, 0)
+        try:
+            url = base + '/land_charges_data/1990-05-01'
+            client = LegacyAdapterClient(base, cache=ResponseCache(str(tmpdir), 1024 * 1024))
+            fetched = client.get(url)
+            assert server.requests_served == 1
+
+            # Served from the cache from here on, as a Response like any other
+            cached = client.get(url)
+            assert cached.status_code == 200 and cached.content == fetched.content
+            assert cached.json() == fetched.json() and cached.text == fetched.text
+            response, chunks = client.stream(url, chunk_size=1000)
+            assert response.status_code == 200 and b''.join(chunks) == fetched.content
+            assert server.requests_served == 1
+            assert client.stats['land_charges_data']['calls'] == 3
+            assert client.stats['land_charges_data']['cached'] == 2
+            client.close()
+
+            replay = LegacyAdapterClient(base, cache=ResponseCache(str(tmpdir), 1024 * 1024, 'replay'))
+            assert replay.get(url).json() == fetched.json()
+            with pytest.raises(CacheMiss):
+                replay.get(base + '/land_charges_data/1990-05-02')
+            assert server.requests_served == 1
+            replay.close()
+        finally:
+            server.shutdown()
+            server.server_close()
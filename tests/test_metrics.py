@@ -0,0 +1,35 @@
+import json
+from application.metrics import merge_reports, write_report
+
+
+def stats(worker, records, run_time, days):
+    return {
+        'worker': worker, 'start': '2001-01-01', 'end': '2001-01-02', 'error': None,
+        'chains_read': records, 'records': records, 'errors': 0, 'legacy_calls': 1, 'legacy_wait': 0.5,
+        'run_time': run_time, 'legacy_endpoints': {'land_charges_data': {'calls': 1, 'bytes': 100}},
+        'slowest_days': [{'day': day, 'seconds': seconds, 'chains': 1} for day, seconds in days]
+    }
+
+
+class TestMetrics:
+    def test_merge_reports(self):
+        report = merge_reports([
+            stats('a', 10, 2.0, [('2001-01-01', 1.0)]),
+            stats('a', 20, 3.0, [('2001-01-02', 3.0)]),
+            stats('b', 30, 5.0, [('2001-01-03', 2.0)]),
+            {'start': '2001-02-01', 'end': '2001-02-02', 'error': 'boom'}
+        ], 10.0)
+
+        assert report['partitions'] == 4
+        assert report['failed_partitions'] == [{'start': '2001-02-01', 'end': '2001-02-02', 'error': 'boom'}]
+        assert report['totals']['records'] == 60
+        assert report['records_per_second'] == 6.0
+        assert report['workers']['a']['partitions'] == 2
+        assert report['workers']['a']['records_per_second'] == 6.0
+        assert report['legacy_endpoints'] == {'land_charges_data': {'calls': 3, 'bytes': 300}}
+        assert [d['day'] for d in report['slowest_days']] == ['2001-01-02', '2001-01-03', '2001-01-01']
+
+    def test_write_report(self, tmpdir):
+        report = merge_reports([], 1.0)
+        with open(write_report(report, str(tmpdir))) as f:
+            assert json.load(f) == report
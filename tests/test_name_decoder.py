@@ -0,0 +1,86 @@
+import random
+import pytest
+from application.name_decoder import hex_translator, decode_name, decode_row
+from application.stub_adapter import encode_private_name
+from application.routes import hex_translator as routes_hex_translator
+
+
+# routes.extract_simple/hex_translator as they were before the decoder table, for comparison
+def reference_hex_translator(hex_code):
+    mask = 0x1F
+    code_int = int(hex_code, 16)
+    length = code_int & mask
+    punc_code = code_int >> 5
+    punctuation = ['&', ' ', '-', "'", '(', ')', '*']
+    return punctuation[punc_code], length
+
+
+def reference_decode(rows):
+    hex_codes = []
+    length = len(rows['punctuation_code'])
+    count = 0
+    while count < length:
+        hex_codes.append(rows['punctuation_code'][count:(count + 2)])
+        count += 2
+
+    orig_name = rows["remainder_name"] + rows["reverse_name"][::-1]
+    name_list = []
+    for items in hex_codes:
+        punc, pos = reference_hex_translator(items)
+        name_list.append(orig_name[:pos])
+        name_list.append(punc)
+        orig_name = orig_name[pos:]
+
+    name_list.append(orig_name)
+    full_name = ''.join(name_list)
+    try:
+        surname_pos = full_name.index('*')
+        forenames = full_name[:surname_pos]
+        surname = full_name[surname_pos + 1:]
+    except ValueError:
+        surname = ""
+        forenames = full_name
+
+    return forenames.split(), surname
+
+
+def outcome(func, *args):
+    try:
+        return func(*args)
+    except Exception as e:
+        return type(e)
+
+
+def random_rows(count=5000, seed=1):
+    rng = random.Random(seed)
+    for n in range(count):
+        letters = ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for i in range(rng.randint(0, 30)))
+        split = rng.randint(0, len(letters))
+        codes = ''.join(rng.choice(['{:02X}'.format(rng.randint(0, 0xDF)), '{:02x}'.format(rng.randint(0, 0xDF)),
+                                    '{:02X}'.format(rng.randint(0, 255)), 'C3', '26', 'zz'])
+                        for i in range(rng.randint(0, 5)))
+        if rng.random() < 0.1:
+            codes += rng.choice('0123456789ABCDEF')
+        yield {'punctuation_code': codes, 'remainder_name': letters[:split], 'reverse_name': letters[split:]}
+
+
+class TestNameDecoder:
+    def test_every_code_matches_reference(self):
+        codes = ['{:02X}'.format(n) for n in range(256)] + ['{:02x}'.format(n) for n in range(256)] + \
+            list('0123456789abcdef') + ['-1', ' 5', 'G0', '', '100']
+        for code in codes:
+            assert outcome(hex_translator, code) == outcome(reference_hex_translator, code), code
+        assert routes_hex_translator is hex_translator
+
+    def test_names_match_reference(self):
+        rows = list(random_rows())
+        for row in rows:
+            assert outcome(decode_row, row) == outcome(reference_decode, row), row
+
+    def test_round_trip(self):
+        remainder, reverse, codes = encode_private_name(['GUY', 'UBALDO'], 'ALEXANDERWELCH')
+        assert decode_name(codes, remainder, reverse) == (['GUY', 'UBALDO'], 'ALEXANDERWELCH')
+
+    def test_bad_code(self):
+        with pytest.raises(IndexError):
+            decode_name('FF', 'ABC', '')
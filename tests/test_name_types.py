@@ -0,0 +1,26 @@
+import application.routes as routes
+from application.routes import classify_name, register_name_type, extract_data
+
+
+def row(name_hex):
+    return {'reverse_name_hex': name_hex, 'name': 'ANYTOWN DISTRICT COUNCIL'}
+
+
+class TestNameTypes:
+    def test_classification(self):
+        cases = {'0001': 'County Council', '0002': 'Rural Council', '0004': 'Parish Council', '0008': 'Other Council',
+                 '0010': 'Development Corporation', '00F1': 'Limited Company', '00F2': 'Other',
+                 'F90000000001F3': 'Complex Name', '0000000001F3': 'Simple', '4C4557': 'Simple', '': 'Simple'}
+        for name_hex, name_type in cases.items():
+            assert classify_name(row(name_hex))[0] == name_type, name_hex
+
+    def test_counts_and_new_codes(self, monkeypatch):
+        monkeypatch.setattr(routes, 'NAME_TYPES', dict(routes.NAME_TYPES))
+        monkeypatch.setattr(routes, 'name_type_counts', {})
+        register_name_type('F4', 'Test Name', lambda data: {'name': data['name']})
+
+        registrations = extract_data([row('00F4')], 'NR')
+        assert registrations == [{'name': 'ANYTOWN DISTRICT COUNCIL', 'type': 'NR'}]
+        classify_name(row('00F4'))
+        classify_name(row('0001'))
+        assert routes.name_type_counts == {'Test Name': 2, 'County Council': 1}
@@ -0,0 +1,57 @@
+import pytest
+from application.pipeline import prefetch, BackgroundStage, StageFailed
+
+
+def failing_source():
+    yield 1
+    raise RuntimeError('adapter went away')
+
+
+class TestPipeline:
+    def test_prefetch_preserves_order(self):
+        assert list(prefetch(iter(range(100)), 3)) == list(range(100))
+
+    def test_prefetch_raises_producer_failure(self):
+        with pytest.raises(StageFailed):
+            list(prefetch(failing_source(), 2))
+
+    def test_background_stage_results(self):
+        stage = BackgroundStage(lambda x: x * 2, 2)
+        for x in range(10):
+            stage.put(x)
+        assert stage.join() == [x * 2 for x in range(10)]
+
+    def test_background_stage_failure(self):
+        def boom(x):
+            raise RuntimeError('database went away')
+
+        stage = BackgroundStage(boom, 1)
+        stage.put(1)
+        with pytest.raises(StageFailed):
+            stage.join()
+
+    def test_background_stage_on_result(self):
+        seen = []
+        stage = BackgroundStage(lambda x: x + 1, 2, on_result=seen.append)
+        for x in range(5):
+            stage.put(x)
+        stage.join()
+        assert seen == [1, 2, 3, 4, 5]
+
+    def test_background_stage_close_finishes_queue(self):
+        seen = []
+        stage = BackgroundStage(seen.append, 5)
+        for x in range(3):
+            stage.put(x)
+        stage.close()
+        assert seen == [0, 1, 2]
+        stage.close()
+
+    def test_background_stage_close_does_not_raise(self):
+        def boom(x):
+            raise RuntimeError('database went away')
+
+        stage = BackgroundStage(boom, 1)
+        stage.put(1)
+        stage.close()
+        assert stage.failure is not None
@@ -0,0 +1,35 @@
+from multiprocessing import Queue
+from application.planner import plan_partitions, partition_worker, day_range
+
+
+skewed_volumes = [(day, 1000 if day.startswith('2010-01') else 1) for day in day_range('2009-12-01', '2010-02-28')]
+
+
+class TestPlanner:
+    def test_partitions_cover_range(self):
+        partitions = sorted(plan_partitions(skewed_volumes, 8), key=lambda p: p['start'])
+        assert partitions[0]['start'] == '2009-12-01'
+        assert partitions[-1]['end'] == '2010-02-28'
+        days = [day for p in partitions for day in day_range(p['start'], p['end'])]
+        assert days == [day for day, volume in skewed_volumes]
+        assert sum(p['volume'] for p in partitions) == sum(v for d, v in skewed_volumes)
+
+    def test_partitions_are_balanced(self):
+        partitions = plan_partitions(skewed_volumes, 8)
+        assert len(partitions) <= 8
+        target = sum(v for d, v in skewed_volumes) / 8.0
+        assert max(p['volume'] for p in partitions) < target + 1000
+        assert partitions == sorted(partitions, key=lambda p: p['volume'], reverse=True)
+
+    def test_no_volume(self):
+        assert plan_partitions([], 4) == []
+        assert len(plan_partitions([('2001-01-01', 0), ('2001-01-02', 0)], 4)) == 1
+
+    def test_worker_pulls_until_sentinel(self):
+        tasks = Queue()
+        for p in plan_partitions(skewed_volumes, 4):
+            tasks.put(p)
+        tasks.put(None)
+        done = []
+        partition_worker(lambda config, start, end: done.append((start, end)), {}, tasks)
+        assert len(done) == 4
@@ -0,0 +1,85 @@
+import application.data as data
+
+
+class FakeConnection(object):
+    # Every session gets the same backend pid, as a reconnect can
+    def __init__(self, conn_str=None):
+        self.closed = 0
+        self.statements = []
+
+    def get_backend_pid(self):
+        return 100
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeCursor(object):
+    def __init__(self, connection=None):
+        self.connection = connection or FakeConnection()
+        self.statements = self.connection.statements
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+    def fetchone(self):
+        return [1]
+
+
+class TestPreparedStatements:
+    def setup_method(self, method):
+        data.prepared.clear()
+        data.statement_stats.clear()
+        data.shared_connection = None
+
+    def teardown_method(self, method):
+        data.shared_connection = None
+
+    def test_prepared_once_per_session(self, monkeypatch):
+        monkeypatch.setattr(data, 'app_config', {'PSQL_PREPARED_STATEMENTS': True})
+        cursor = FakeCursor()
+        data.insert_row(cursor, 'party_trading', {'party_id': 1, 'trading_name': 'A'})
+        data.insert_row(cursor, 'party_trading', {'party_id': 2, 'trading_name': 'B'})
+
+        name = data.statement_names[('party_trading', ('party_id', 'trading_name'))]
+        assert cursor.statements == [
+            ('PREPARE {} AS INSERT INTO party_trading (party_id, trading_name) VALUES ($1, $2) RETURNING id'.format(
+                name), None),
+            ('EXECUTE {} (%s, %s)'.format(name), [1, 'A']),
+            ('EXECUTE {} (%s, %s)'.format(name), [2, 'B'])
+        ]
+        assert data.statement_stats[name] == 2
+
+        # A new session (say, after a reconnect) prepares it again
+        other = FakeCursor()
+        data.insert_row(other, 'party_trading', {'party_id': 3, 'trading_name': 'C'})
+        assert other.statements[0][0].startswith('PREPARE')
+
+    def test_plain_statements_when_disabled(self, monkeypatch):
+        monkeypatch.setattr(data, 'app_config', {'PSQL_PREPARED_STATEMENTS': False})
+        cursor = FakeCursor()
+        data.insert_row(cursor, 'party_trading', {'party_id': 1, 'trading_name': 'A'})
+        assert cursor.statements == [('INSERT INTO party_trading (party_id, trading_name) '
+                                      'VALUES (%(party_id)s, %(trading_name)s) RETURNING id',
+                                      {'party_id': 1, 'trading_name': 'A'})]
+
+    def test_replaced_connection_prepares_again(self, monkeypatch):
+        monkeypatch.setattr(data, 'app_config', {'PSQL_PREPARED_STATEMENTS': True})
+        monkeypatch.setattr(data, 'connect_to_psql', FakeConnection)
+        config = {'PSQL_CONNECTION': '', 'PSQL_HEALTH_CHECK_INTERVAL': 30}
+
+        first = data.get_connection(config)
+        data.insert_row(first.cursor(), 'party_trading', {'party_id': 1, 'trading_name': 'A'})
+        first.closed = 2
+        second = data.get_connection(config)
+        assert second is not first and second.get_backend_pid() == first.get_backend_pid()
+        assert first not in data.prepared
+
+        data.insert_row(second.cursor(), 'party_trading', {'party_id': 2, 'trading_name': 'B'})
+        assert [sql.split()[0] for sql, params in second.statements] == ['PREPARE', 'EXECUTE']
+
+        data.close_connection()
+        assert len(data.prepared) == 0
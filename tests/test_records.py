@@ -0,0 +1,113 @@
+import copy
+import pytest
+import gc
+import json
+import tracemalloc
+import application.bulk_insert as bulk_insert
+import application.data as data
+from application.records import compact, to_dict, json_default, Registration
+from application.utility import class_without_brackets
+from application.stub_adapter import SyntheticData
+from tests.test_bulk_insert import FakeCursor, chains
+
+
+def registrations(count):
+    # Transformed as migrate() would, from synthetic legacy rows
+    from application.routes import extract_data
+    synthetic = SyntheticData(volume=count)
+    records = []
+    for day in ['1990-01-{:02d}'.format(d) for d in range(1, 29)]:
+        for history in synthetic.land_charges_data(day):
+            for item in history:
+                if item['land_charge'] is not None:
+                    records += extract_data(item['land_charge'], item['type'])
+            if len(records) >= count:
+                return records[:count]
+    return records
+
+
+def allocated(build):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        held = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return held, size
+
+
+def migrate(monkeypatch, records):
+    cursor = FakeCursor()
+    monkeypatch.setattr(data, 'connect_to_psql', lambda conn_str=None: cursor)
+    monkeypatch.setattr(data, 'shared_connection', None)
+    monkeypatch.setattr(data, 'get_county_id', lambda cursor, county: 7)
+    failures = data.migrate_record({'PSQL_CONNECTION': '', 'MIGRATION_COMMIT_UNIT': 'entry'}, records)
+    return failures, cursor.rows, cursor.cancelled
+
+
+def migrate_bulk_fallback(monkeypatch, records):
+    # Through migrate_batch, with the bulk load failing so that the batch is re-run row by row
+    cursor = FakeCursor()
+    cursor.closed = 0
+    monkeypatch.setattr(data, 'connect_to_psql', lambda conn_str=None: cursor)
+    monkeypatch.setattr(data, 'shared_connection', None)
+    monkeypatch.setattr(data, 'get_county_id', lambda cursor, county: 7)
+    monkeypatch.setattr(bulk_insert, 'get_county_id', lambda cursor, county: 7)
+    monkeypatch.setattr(bulk_insert, 'allocator', None)
+
+    def load(batch):
+        raise RuntimeError('duplicate key value violates unique constraint')
+
+    monkeypatch.setattr(bulk_insert.BulkBatch, 'load', load)
+    fallbacks = bulk_insert.stats['fallbacks']
+    failures = bulk_insert.migrate_batch({'PSQL_CONNECTION': '', 'MIGRATION_COMMIT_UNIT': 'entry',
+                                          'MIGRATION_ID_BLOCK': 10}, records)
+    assert bulk_insert.stats['fallbacks'] == fallbacks + 1
+    return failures, cursor.rows, cursor.cancelled
+
+
+class TestRecords:
+    def test_same_as_dicts(self):
+        records = registrations(200)
+        compacted = compact(copy.deepcopy(records))
+        assert isinstance(compacted[0], Registration)
+        assert [to_dict(r) for r in compacted] == records
+        assert compacted == records
+        assert json.dumps(compacted, sort_keys=True, default=json_default) == json.dumps(records, sort_keys=True)
+        for record, original in zip(compacted, records):
+            assert ('particulars' in record) == ('particulars' in original)
+            assert record.get('priority_notice') is None
+            for party, original_party in zip(record['parties'], original['parties']):
+                assert ('addresses' in party) == ('addresses' in original_party)
+
+    def test_writes_same_rows(self, monkeypatch):
+        assert migrate(monkeypatch, chains()) == migrate(monkeypatch, [compact(chain) for chain in chains()])
+
+    def test_bulk_fallback_writes_same_rows(self, monkeypatch):
+        compacted = [compact(chain) for chain in chains()]
+        assert migrate_bulk_fallback(monkeypatch, chains()) == migrate_bulk_fallback(monkeypatch, compacted)
+
+    def test_pop(self):
+        record = compact([{'type': 'NR', 'parties': [], 'previous': 1, 'sorted_date': '1990-01-01'}])[0]
+        assert record.pop('previous', None) == 1 and 'previous' not in record
+        assert record.pop('previous', None) is None
+        assert record.pop('sorted_date') == '1990-01-01' and 'sorted_date' not in record
+        with pytest.raises(KeyError):
+            record.pop('details_id')
+
+    def test_extra_fields(self):
+        record = compact([{'type': 'NR', 'parties': [], 'sorted_date': '1990-01-01'}])[0]
+        record['details_id'] = 4
+        assert record['sorted_date'] == '1990-01-01' and record['details_id'] == 4
+        assert to_dict(record) == {'type': 'NR', 'parties': [], 'details_id': 4, 'sorted_date': '1990-01-01'}
+        del record['sorted_date']
+        assert 'sorted_date' not in record
+
+    def test_memory(self):
+        # The benchmark: the same registrations held as dicts and as records
+        source = registrations(2000)
+        as_dicts, dict_size = allocated(lambda: copy.deepcopy(source))
+        as_records, record_size = allocated(lambda: compact(copy.deepcopy(source)))
+        assert record_size < dict_size * 0.75
@@ -0,0 +1,38 @@
+import pytest
+from application.reference_data import ReferenceData, load_reference_data
+
+
+class FakeCursor(object):
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, sql):
+        self.queries.append(sql)
+
+    def fetchall(self):
+        if 'county_search_keys' in self.queries[-1]:
+            return [('DEVON', 'DEVON'), ('SOUTH YORKSHIRE', 'SYORKS'), ('AVON', 'AVON1'), ('AVON', 'AVON2')]
+        return [(1, 'Devon'), (2, 'Cornwall '), (3, 'DEVON')]
+
+
+class TestReferenceData:
+    def test_lookups(self):
+        data = load_reference_data(FakeCursor())
+        assert data.county_id(' devon') == 1
+        assert data.county_id('CORNWALL') == 2
+        assert data.name_key('South Yorkshire') == 'SYORKS'
+        assert data.name_key('WEST RIDING OF YORKSHIRE') == 'WESTRIDIN'
+
+    def test_misses_fail(self):
+        data = ReferenceData([(1, 'Devon')], [('AVON', 'AVON1'), ('AVON', 'AVON2')])
+        with pytest.raises(RuntimeError):
+            data.county_id('Atlantis')
+        with pytest.raises(RuntimeError):
+            data.name_key('Atlantis')
+        with pytest.raises(RuntimeError):
+            data.name_key('Avon')
+
+    def test_maps_are_read_only(self):
+        data = ReferenceData([(1, 'Devon')], [])
+        with pytest.raises(TypeError):
+            data.counties['CORNWALL'] = 2
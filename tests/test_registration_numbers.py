@@ -0,0 +1,145 @@
+import application.data as data
+import application.registration_numbers as registration_numbers
+from application.registration_numbers import RegistrationNumbers, LOCK, CREATE, STORED, FIRST, INSERT, UPDATE
+
+
+class FakeDatabase(object):
+    # The coordination table and the (committed) register: {year: next_no} and [(registration_no, year)]
+    def __init__(self, register=()):
+        self.table = {}
+        self.register = list(register)
+        self.statements = 0
+
+    def connect(self, conn_str):
+        return FakeConnection(self)
+
+    def migrate(self, allocator, year, number):
+        # A registration written, and committed, with its original number
+        allocator.taken(year, number)
+        self.register.append((number, year))
+
+    def generate(self, allocator, year):
+        number = allocator.next_number(year)
+        self.register.append((number, year))
+        return number
+
+
+class FakeConnection(object):
+    def __init__(self, db):
+        self.db = db
+        self.closed = 0
+        self.result = None
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.db.statements += 1
+        if sql == STORED:
+            year = params['year']
+            self.result = (self.db.table[year],) if year in self.db.table else None
+        elif sql == FIRST:
+            year = int(params['start'][:4])
+            high = [no + 1 for no, y in self.db.register if y == year]
+            candidates = [value for value in [params['next'], params['taken'], max(high or [None])]
+                          if value is not None]
+            self.result = (max(candidates) if len(candidates) > 0 else 1000,)
+        elif sql in (INSERT, UPDATE):
+            self.db.table[params['year']] = params['next']
+        else:
+            assert sql in (LOCK, CREATE)
+
+    def fetchone(self):
+        return self.result
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeCursor(object):
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchone(self):
+        return [1]
+
+
+def allocators(monkeypatch, db, count=2):
+    monkeypatch.setattr(registration_numbers.psycopg2, 'connect', db.connect)
+    return [RegistrationNumbers('', 10) for n in range(count)]
+
+
+class TestRegistrationNumbers:
+    def test_numbers_come_from_reserved_blocks(self, monkeypatch):
+        db = FakeDatabase([(1499, 1990), (1499, 1991)])
+        first, second = allocators(monkeypatch, db)
+
+        assert [first.next_number(1990) for n in range(3)] == [1500, 1501, 1502]
+        statements = db.statements
+        assert [first.next_number(1990) for n in range(7)] == list(range(1503, 1510))
+        assert db.statements == statements
+
+        assert second.next_number(1990) == 1510
+        assert first.next_number(1990) == 1520
+        assert second.next_number(1991) == 1500
+        assert first.reservations == 2 and second.reservations == 2
+
+    def test_empty_year_starts_at_1000(self, monkeypatch):
+        db = FakeDatabase()
+        first, = allocators(monkeypatch, db, 1)
+        assert first.next_number(1990) == 1000
+
+    def test_reservation_starts_above_numbers_migrated_since(self, monkeypatch):
+        db = FakeDatabase([(1499, 1990)])
+        first, second = allocators(monkeypatch, db)
+        assert db.generate(first, 1990) == 1500
+
+        # Another worker migrates a registration above the stored mark (1510)
+        db.migrate(second, 1990, 1600)
+        for n in range(9):
+            db.generate(first, 1990)
+        assert db.generate(first, 1990) == 1601
+        assert db.generate(second, 1990) == 1611
+
+    def test_own_uncommitted_numbers_are_skipped(self, monkeypatch):
+        db = FakeDatabase([(1499, 1990)])
+        first, = allocators(monkeypatch, db, 1)
+        assert first.next_number(1990) == 1500
+
+        # Written in this worker's open transaction: not in the register the reservation sees
+        first.taken(1990, 1503)
+        first.taken(1990, 1700)
+        first.taken(1991, 1505)
+        assert [first.next_number(1990) for n in range(6)] == [1504, 1505, 1506, 1507, 1508, 1509]
+        assert first.next_number(1990) == 1701
+        assert first.next_number(1991) == 1506
+
+    def test_interleaved_numbers_never_collide(self, monkeypatch):
+        db = FakeDatabase([(1499, 1990)])
+        workers = allocators(monkeypatch, db, 3)
+        migrated = iter([1502, 1515, 1530, 1531, 1560, 1800, 1801, 1950])
+        for step in range(60):
+            worker = workers[step % 3]
+            if step % 7 == 3:
+                number = next(migrated, None)
+                if number is not None:
+                    db.migrate(worker, 1990, number)
+                    continue
+            db.generate(worker, 1990)
+
+        numbers = [no for no, year in db.register]
+        assert len(numbers) == len(set(numbers))
+
+    def test_migrated_registrations_are_reported(self, monkeypatch):
+        db = FakeDatabase([(1499, 1990)])
+        first, = allocators(monkeypatch, db, 1)
+        monkeypatch.setattr(data, 'app_config', {'PSQL_PREPARED_STATEMENTS': False})
+        monkeypatch.setattr(data, 'get_registration_numbers', lambda config: first)
+        cursor = FakeCursor()
+
+        assert data.insert_registration(cursor, None, 1, None, '1990-05-01', None)[0] == 1500
+        assert data.insert_registration(cursor, None, 2, None, '1990-05-01', None, 1501)[0] == 1501
+        assert data.insert_registration(cursor, None, 3, None, '1990-05-01', None)[0] == 1502
@@ -0,0 +1,106 @@
+import datetime
+import application.rerun as rerun
+from application.rerun import MigratedChains, MIGRATED
+from application.data import delete_migrated
+
+
+def item(reg_no, date, cls='C1', type='NR'):
+    return {'reg_no': reg_no, 'date': date, 'class': cls, 'type': type}
+
+
+COMPLETE = [item('100', '1990-01-02'), item('5', '1991-03-04', type='AM'), item('6', '1992-01-01', type='CN')]
+PARTIAL = [item('101', '1990-01-02', 'PAB'), item('7', '1991-03-04', 'PAB', 'RN')]
+NEW = [item('102', '1990-01-02')]
+
+# migration_status: (original_regn_no, date, class_of_charge, register_id)
+STATUS = [('100', datetime.date(1990, 1, 2), 'C1', 1), ('5', datetime.date(1991, 3, 4), 'C1', 2),
+          ('101', datetime.date(1990, 1, 2), 'PAB', 3)]
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = 0
+        self.lookups = 0
+        self.deleted = []
+        self.result = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        if sql == MIGRATED:
+            self.lookups += 1
+            keys = set(zip(params['nos'], params['dates'], params['classes']))
+            self.result = [row for row in STATUS if (row[0], str(row[1]), row[2]) in keys]
+        elif sql.startswith('SELECT DISTINCT details_id FROM register'):
+            self.deleted += params['ids']
+            self.result = []
+        else:
+            self.result = []
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def run(monkeypatch, policy):
+    conn = FakeConnection()
+    monkeypatch.setattr(rerun.psycopg2, 'connect', lambda conn_str: conn)
+    chains = MigratedChains('', policy)
+    histories = [('1990-01-02', COMPLETE), ('1990-01-02', PARTIAL), ('1990-01-02', NEW), ('1990-01-02', 'END')]
+    return list(chains.filter(iter(histories), 'END')), chains, conn
+
+
+class FakeCursor(object):
+    # A chain of two details rows (10, 11), cancelled by a third (12) that amends the second
+    def __init__(self):
+        self.statements = []
+        self.result = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+        if sql.startswith('SELECT DISTINCT details_id'):
+            self.result = [(10,), (11,)]
+        elif sql.startswith('SELECT id FROM register_details WHERE amends'):
+            self.result = [(12,)] if 11 in params['found'] else []
+        elif sql.startswith('SELECT id FROM party '):
+            self.result = [(20,), (21,)]
+        elif sql.startswith('SELECT request_id'):
+            self.result = [(30,), (31,), (32,)]
+        else:
+            self.result = []
+
+    def fetchall(self):
+        return self.result
+
+
+class TestRerun:
+    def test_skip_complete_replace_partial(self, monkeypatch):
+        out, chains, conn = run(monkeypatch, 'skip')
+        assert [h for d, h in out] == [PARTIAL, NEW, 'END']
+        assert conn.lookups == 1
+        assert conn.deleted == [3]
+        assert chains.stats['skipped'] == 1 and chains.stats['replaced'] == 1
+
+    def test_replace_everything_found(self, monkeypatch):
+        out, chains, conn = run(monkeypatch, 'replace')
+        assert [h for d, h in out] == [COMPLETE, PARTIAL, NEW, 'END']
+        assert sorted(conn.deleted) == [1, 2, 3]
+        assert chains.stats['skipped'] == 0 and chains.stats['replaced'] == 2
+
+    def test_delete_takes_cancellations_too(self):
+        cursor = FakeCursor()
+        assert delete_migrated(cursor, [1, 2]) == 3
+        deletes = [(sql.split()[2], params['ids']) for sql, params in cursor.statements if sql.startswith('DELETE')]
+        assert deletes[0] == ('migration_status', [10, 11, 12])
+        assert ('register_details', [10, 11, 12]) in deletes
+        assert ('party', [20, 21]) in deletes
+        assert deletes[-1] == ('request', [30, 31, 32])
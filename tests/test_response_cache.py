@@ -0,0 +1,53 @@
+import pytest
+import os
+from application.response_cache import ResponseCache, CacheMiss, cache_key
+
+
+url = 'http://legacy/land_charges_data/2001-01-01'
+
+
+class TestResponseCache:
+    def test_key_ignores_parameter_order(self):
+        assert cache_key(url, {'a': '1', 'b': '2'}) == cache_key(url, {'b': '2', 'a': '1'})
+        assert cache_key(url, {'a': '1'}) != cache_key(url, {'a': '2'})
+
+    def test_read_through(self, tmpdir):
+        cache = ResponseCache(str(tmpdir), 1024 * 1024)
+        assert cache.load(url) is None
+        cache.store(url, 200, b'[[{"reg_no": "1"}]]')
+        assert cache.load(url) == (200, b'[[{"reg_no": "1"}]]')
+        assert cache.hits == 1 and cache.misses == 1
+
+    def test_errors_are_not_cached(self, tmpdir):
+        cache = ResponseCache(str(tmpdir), 1024 * 1024)
+        cache.store(url, 500, b'oops')
+        assert cache.load(url) is None
+
+    def test_replay_miss(self, tmpdir):
+        cache = ResponseCache(str(tmpdir), 1024 * 1024, 'replay')
+        with pytest.raises(CacheMiss):
+            cache.load(url)
+
+    def test_refresh_ignores_entries(self, tmpdir):
+        ResponseCache(str(tmpdir), 1024 * 1024).store(url, 200, b'[]')
+        cache = ResponseCache(str(tmpdir), 1024 * 1024, 'refresh')
+        assert cache.load(url) is None
+        assert len(cache.entries) == 1
+
+    def test_lru_eviction(self, tmpdir):
+        cache = ResponseCache(str(tmpdir), 3 * 1024)
+        for day in range(10):
+            cache.store(url + str(day), 200, os.urandom(1000))
+            os.utime(cache.path(cache_key(url + str(day))), (day, day))
+        assert cache.total_bytes <= 3 * 1024
+        assert cache.evictions > 0
+        assert cache.load(url + '9') is not None
+        assert cache.load(url + '0') is None
+
+    def test_cap_covers_every_worker(self, tmpdir):
+        workers = [ResponseCache(str(tmpdir), 3 * 1024) for n in range(3)]
+        for day in range(30):
+            workers[day % 3].store(url + str(day), 200, os.urandom(1000))
+            on_disk = sum(f.size() for f in tmpdir.visit(lambda f: f.ext == '.gz'))
+            assert on_disk <= 3 * 1024
+        assert sum(worker.evictions for worker in workers) > 0
@@ -0,0 +1,158 @@
+import random
+import pytest
+import application.data as data
+import application.reference_data
+import application.search_key as search_key
+import tests.search_key_reference as reference
+
+WORDS = sorted(set(
+    [word for common in search_key.COMMON_WORDS for word in search_key.COMMON_WORDS[common]] +
+    list(search_key.COMMON_WORDS) + search_key.S_WORDS + search_key.COMPLEX_NAME_INDICATORS + search_key.NOISE +
+    list(search_key.LA_ABBREVIATIONS) + search_key.NON_KEY_WORDS + search_key.LA_NON_KEY_WORDS +
+    search_key.B_INDICATORS + ['MESSRS', 'PUBLIC', 'LIMITED', 'CWMNI', 'C', 'P', 'L', 'NEW TOWN', 'DEVELOPMENT',
+                               'CORPORATION', 'SMITH', 'JONES', "O'BRIEN", 'ST. JOHN', 'BOARDS', 'TRUSTY', 'A', 'B',
+                               'HOLDING', 'SON', 'CO-OPS', '1st', '(UK)', 'W.H.', '', 'ÉCOLE']))
+
+
+def random_name(rng):
+    words = []
+    for n in range(rng.randint(0, 7)):
+        word = rng.choice(WORDS)
+        if rng.random() < 0.2:
+            word = word.lower()
+        elif rng.random() < 0.1:
+            word = word.title()
+        words.append(word)
+    name = rng.choice([' ', ' ', ' ', '  ', ', ']).join(words)
+    if rng.random() < 0.1:
+        name = ' ' + name
+    if rng.random() < 0.1:
+        name += ' '
+    return name
+
+
+def outcome(function, *args):
+    try:
+        return function(*args)
+    except Exception as e:
+        return type(e), str(e)
+
+
+def names(count=3000, seed=1):
+    rng = random.Random(seed)
+    for n in range(count):
+        text = random_name(rng)
+        forenames = [word for word in random_name(rng).split(' ') if word != ''][:3]
+        yield {'type': 'Private Individual', 'private': {'forenames': forenames, 'surname': text}}
+        yield {'type': 'Limited Company', 'company': text}
+        yield {'type': rng.choice(['Parish Council', 'Rural Council', 'Other Council']), 'local': {'area': text}}
+        yield {'type': 'Development Corporation', 'other': text + rng.choice(
+            ['', ' Development Corporation', ' New Town Development Corporation', ' new town  development corporation'])}
+        yield {'type': 'Other', 'other': text}
+        yield {'type': 'Complex Name', 'complex': {'name': text, 'number': 1}}
+        yield {'type': 'Coded Name', 'other': text}
+
+
+def search_key_inputs(name):
+    # The same names, as create_search_keys takes them
+    if name['type'] == 'Private Individual':
+        return 'Private Individual', {'forenames': ' '.join(name['private']['forenames']),
+                                      'surname': name['private']['surname']}
+    if name['type'] == 'Limited Company':
+        return name['type'], {'company_name': name['company']}
+    if name['type'] in ['Parish Council', 'Rural Council', 'Other Council']:
+        return name['type'], {'local_authority_area': name['local']['area']}
+    if name['type'] == 'Development Corporation':
+        return name['type'], {'other': name['other']}
+    if name['type'] == 'Complex Name':
+        return 'Complex', name
+    return name['type'], {'other_name': name['other']}
+
+
+COUNTY_KEYS = [('DEVON', 'DEVON'), ('SOUTH YORKSHIRE', 'SYORKS'), ('AVON', 'AVON1'), ('AVON', 'AVON2')]
+
+
+class CountyCursor(object):
+    # county_search_keys, queried a name at a time (the reference) or read in full (reference_data)
+    def execute(self, sql, params=None):
+        if params is not None:
+            self.result = [{'key': key} for name, key in COUNTY_KEYS if name == params['name']]
+        elif 'county_search_keys' in sql:
+            self.result = COUNTY_KEYS
+        else:
+            self.result = []
+
+    def fetchall(self):
+        return self.result
+
+
+class TestSearchKey:
+    def test_registration_keys_match_reference(self):
+        for name in names():
+            assert search_key.create_registration_key(None, name) == reference.create_registration_key(None, name), name
+
+    def test_search_keys_match_reference(self):
+        for name in names(seed=2):
+            name_type, data = search_key_inputs(name)
+            assert search_key.create_search_keys(None, name_type, data) == \
+                reference.create_search_keys(None, name_type, data), name
+
+    def test_county_council_keys_match_reference(self, monkeypatch):
+        monkeypatch.setattr(application.reference_data, 'loaded', None)
+        cursor = CountyCursor()
+        for area in ['DEVON', 'South Yorkshire', 'WEST RIDING OF YORKSHIRE', 'AVON', 'ATLANTIS']:
+            name = {'type': 'County Council', 'local': {'area': area}}
+            assert outcome(search_key.create_registration_key, cursor, name) == \
+                outcome(reference.create_registration_key, cursor, name), area
+
+    def test_rules(self):
+        assert search_key.create_limited_name_key('The Smith Brothers Public Limited Company') == 'SMITHBROLD'
+        assert search_key.get_other_key('BOARD OF GOVERNORS OF ST JOHNS SCHOOL') == ('STJOHNSSCHOOL', 'B')
+        assert search_key.get_other_key('J SMITH') == ('JSMITH', 'A')
+        assert search_key.create_local_authority_key('Stratford upon Avon') == 'STRATFORDAVON'
+
+    def test_batch_keys_match_unmemoised(self, monkeypatch):
+        monkeypatch.setattr(search_key, 'key_cache', search_key.KeyCache(50))
+        batch = list(names(200, seed=3))
+        batch += batch[:300]
+        assert search_key.registration_keys(None, batch) == \
+            [search_key.create_registration_key(None, name) for name in batch]
+
+    def test_registration_names_keyed_in_one_call(self, monkeypatch):
+        calls = []
+        batch = search_key.registration_keys
+        monkeypatch.setattr(data, 'registration_keys', lambda cursor, names: calls.append(len(names)) or
+                            batch(cursor, names))
+        smith = {'type': 'Limited Company', 'company': 'Smith Ltd'}
+        jones = {'type': 'Other', 'other': 'J SMITH'}
+        registration = {'parties': [{'names': [smith, jones]}, {'names': [smith]}]}
+
+        keys = data.name_keys(None, registration)
+        rows = [data.party_name_row(None, name, next(keys)) for party in registration['parties']
+                for name in party['names']]
+        assert [(row['searchable_string'], row['subtype']) for row in rows] == \
+            [('SMITHLD', ''), ('JSMITH', 'A'), ('SMITHLD', '')]
+        assert calls == [3]
+
+    def test_key_cache(self, monkeypatch):
+        cache = search_key.KeyCache(2)
+        monkeypatch.setattr(search_key, 'key_cache', cache)
+        smith = {'type': 'Limited Company', 'company': 'Smith Ltd'}
+        jones = {'type': 'Limited Company', 'company': 'Jones Ltd'}
+        brown = {'type': 'Other', 'other': 'BROWN'}
+
+        assert search_key.registration_keys(None, [smith, smith, jones]) == \
+            [{'key': 'SMITHLD', 'indicator': ''}] * 2 + [{'key': 'JONESLD', 'indicator': ''}]
+        assert cache.stats == {'hits': 0, 'misses': 2, 'evictions': 0}
+        search_key.registration_key(None, smith)
+        search_key.registration_key(None, brown)    # evicts jones, the least recently used
+        search_key.registration_key(None, smith)
+        search_key.registration_key(None, jones)
+        assert cache.stats == {'hits': 2, 'misses': 4, 'evictions': 2}
+
+    def test_failures_not_cached(self, monkeypatch):
+        cache = search_key.KeyCache(10)
+        monkeypatch.setattr(search_key, 'key_cache', cache)
+        with pytest.raises(RuntimeError):
+            search_key.registration_key(None, {'type': 'Mystery', 'other': 'X'})
+        assert len(cache.entries) == 0
@@ -0,0 +1,51 @@
+import requests
+from application.stub_adapter import start_server, SyntheticData, FixtureStore
+from application.routes import extract_data
+
+
+class TestStubAdapter:
+    def test_synthetic_data_is_repeatable(self):
+        server = start_server(synthetic=SyntheticData(volume=20))
+        try:
+            base = 'http://localhost:{}'.format(server.server_address[1])
+            first = requests.get(base + '/land_charges_data/1990-05-01').json()
+            second = requests.get(base + '/land_charges_data/1990-05-01').json()
+            index = requests.get(base + '/land_charges_index/1990-05-01/1990-05-01').json()
+            assert first == second
+            assert len(first) == len(index)
+            assert [chain[0]['reg_no'] for chain in first] == [entry['registration_no'] for entry in index]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_synthetic_rows_transform(self):
+        for chain in SyntheticData(volume=50).land_charges_data('2001-03-14'):
+            for item in chain:
+                if item['land_charge'] is not None:
+                    registration = extract_data(item['land_charge'], item['type'])[0]
+                    assert len(registration['parties'][0]['names']) == 1
+
+    def test_error_injection(self):
+        server = start_server(synthetic=SyntheticData(), error_rate=1.0)
+        try:
+            response = requests.get('http://localhost:{}/land_charges_data/1990-05-01'.format(server.server_address[1]))
+            assert response.status_code == 500
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_fixtures(self, tmpdir):
+        store = FixtureStore(str(tmpdir))
+        path = store.path('doc_history', ('1416',), {'class': 'D2', 'date': '2002-04-16'})
+        tmpdir.mkdir('doc_history')
+        with open(path, 'w') as f:
+            f.write('[{"reg_no": "1416"}]')
+
+        server = start_server(fixtures=store)
+        try:
+            response = requests.get('http://localhost:{}/doc_history/1416'.format(server.server_address[1]),
+                                    params={'class': 'D2', 'date': '2002-04-16'})
+            assert response.json() == [{'reg_no': '1416'}]
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,40 @@
+from application.task_queue import publish_tasks, run_worker, collect_results
+
+
+partitions = [
+    {'start': '2001-01-01', 'end': '2001-01-31', 'volume': 10},
+    {'start': '2001-02-01', 'end': '2001-02-28', 'volume': 10},
+    {'start': '2001-03-01', 'end': '2001-03-31', 'volume': 10}
+]
+
+
+class TestTaskQueue:
+    def test_round_trip(self):
+        config = {'TASK_QUEUE_URI': 'memory://'}
+        done = []
+
+        def target(config, start, end):
+            if start == '2001-02-01':
+                raise RuntimeError('Database went away')
+            done.append((start, end))
+
+        publish_tasks(config, 'migrate', partitions)
+        assert run_worker(config, {'migrate': target}, idle_timeout=1) == 3
+        results = collect_results(config, 3, timeout=1)
+
+        assert done == [('2001-01-01', '2001-01-31'), ('2001-03-01', '2001-03-31')]
+        assert len(results) == 3
+        assert [r['status'] for r in results] == ['ok', 'failed', 'ok']
+        assert results[1]['error'] == 'Database went away'
+
+    def test_filesystem_transport_stays_in_its_folder(self, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir.mkdir('cwd'))
+        folder = str(tmpdir.join('queue'))
+        config = {'TASK_QUEUE_URI': 'filesystem://', 'TASK_QUEUE_FOLDER': folder}
+
+        publish_tasks(config, 'migrate', partitions[:1])
+        assert run_worker(config, {'migrate': lambda config, start, end: None}, idle_timeout=1) == 1
+        assert len(collect_results(config, 1, timeout=1)) == 1
+
+        assert tmpdir.join('cwd').listdir() == []
+        assert tmpdir.join('queue', 'control', 'lc-migrator-tasks.exchange').check()
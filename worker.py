@@ -0,0 +1,27 @@
+from log.logger import setup_logging
+import importlib
+import os
+from application.routes import migrate, check
+from application.task_queue import run_worker
+from multiprocessing import Process
+
+# Queue consumer for distribute.py: starts MIGRATOR_WORKERS processes on this host, each taking tasks
+# until the queue has been idle for WORKER_IDLE_TIMEOUT seconds (0 to run until killed).
+
+cfg = 'Config'
+c = getattr(importlib.import_module('config'), cfg)
+config = {}
+
+for key in dir(c):
+    if key.isupper():
+        config[key] = getattr(c, key)
+
+setup_logging(config)
+
+slices = int(os.getenv("MIGRATOR_WORKERS", '8'))
+idle_timeout = int(os.getenv("WORKER_IDLE_TIMEOUT", '60'))
+
+for x in range(0, slices):
+    p = Process(target=run_worker, args=(config, {'migrate': migrate, 'check': check}, idle_timeout),
+                name="Queue worker {}".format(x))
+    p.start()